@@ -0,0 +1,179 @@
+"""
+Result cache of the ExoFarm VULCAN scenarios.
+
+The input hash of a scenario is the SHA-256 of everything that feeds create_vulcan_cfg and the run:
+the YAML settings (but out_name), the contents of the files it points to (network, Gibbs and composition tables,
+atmosphere profile, stellar spectrum, boundary-condition fluxes and the initial .vul if any), the contents of the
+data read from the data folders (the NASA-9 coefficients in thermo/NASA9/, the cross sections in the cross_folder
+when use_photo and the FastChem input when ini_mix = 'EQ') and the version of VULCAN (the contents of its Python
+sources). The runners pass it to VULCAN (run_case.py --input-hash), which stores it in the .vul output under 'input_hash'.
+A warm-started run (run_campaign.py --warm-start) is given warm_hash instead, which also covers
+its initial .vul and starting timestep, so it is never reused as the result of a cold start.
+
+Before a scenario is run, its converged output in Results/Outputs is looked up:
+- the .vul of the scenario has the same input hash: the run is skipped;
+- another .vul has the same input hash (e.g. a renamed out_name): it is copied and the run is skipped.
+Only converged outputs (end_case 1) are reused: a run stopped by runtime or count_max is run again.
+The hashes and end cases of the outputs are kept in Results/Outputs/input_hashes.json (with the mtime
+of each file), so the .vul files are only unpickled when they are new or have changed.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+import yaml
+
+# the cfg entries naming the input files of a run, with the condition for the file to be read
+input_files = [
+    ('network', lambda cfg: True),
+    ('gibbs_text', lambda cfg: True),
+    ('com_file', lambda cfg: True),
+    ('atm_file', lambda cfg: True),
+    ('sflux_file', lambda cfg: getattr(cfg, 'use_photo', True)),
+    ('bot_BC_flux_file', lambda cfg: getattr(cfg, 'use_botflux', False)),
+    ('top_BC_flux_file', lambda cfg: getattr(cfg, 'use_topflux', False)),
+    ('vul_ini', lambda cfg: getattr(cfg, 'ini_mix', '') == 'vulcan_ini'),
+]
+# the data folders read by a run (the cfg entry giving the folder or a path under data_dir), with the files read
+# (glob patterns, the files the run writes there excluded) and the condition for the folder to be read
+data_folders = [
+    (('data_dir', 'thermo/NASA9/'), ['*.txt'], lambda cfg: True),
+    (('cross_folder', ''), ['thresholds.txt', '*/*.csv', '*/*.txt'], lambda cfg: getattr(cfg, 'use_photo', True)),
+    (('data_dir', 'fastchem_vulcan/input/'), ['*.dat', 'config.input'], lambda cfg: getattr(cfg, 'ini_mix', '') == 'EQ'),
+]
+data_written = ('element_abundances_vulcan.dat', 'parameters.dat')
+index_name = 'input_hashes.json'
+# the content hashes of the data files already read, by (path, size, mtime)
+_data_hashes = {}
+
+
+def file_hash(path, h):
+    """Updating the hash h with the contents of path (or a marker if the file does not exist)."""
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    except OSError:
+        h.update(b'<missing>')
+
+
+def data_hash(folder, patterns):
+    """The hash of the names and contents of the files matching patterns in folder."""
+    h = hashlib.sha256()
+    paths = sorted(set(path for pattern in patterns for path in glob.glob(os.path.join(folder, pattern))))
+    for path in paths:
+        if not os.path.isfile(path) or os.path.basename(path) in data_written:
+            continue
+        st = os.stat(path)
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in _data_hashes:
+            _data_hashes[key] = hashlib.sha256()
+            file_hash(path, _data_hashes[key])
+        h.update(os.path.relpath(path, folder).encode())
+        h.update(_data_hashes[key].digest())
+    return h.hexdigest()
+
+
+def vulcan_version(vulcan_dir):
+    """The hash of the VULCAN Python sources (without the generated vulcan_cfg.py and chem_funs.py)."""
+    h = hashlib.sha256()
+    for path in sorted(glob.glob(os.path.join(vulcan_dir, '*.py'))):
+        if os.path.basename(path) in ('vulcan_cfg.py', 'chem_funs.py'):
+            continue
+        h.update(os.path.basename(path).encode())
+        file_hash(path, h)
+    return h.hexdigest()
+
+
+def input_hash(yaml_abs_path, cfg, vulcan_dir):
+    """The input hash of the scenario with the YAML file yaml_abs_path and the settings cfg (vulcan_config.Config)."""
+    with open(yaml_abs_path) as f:
+        conf = yaml.safe_load(f)
+    # the name of the output does not change the result
+    conf.get('chemistry', {}).pop('out_name', None)
+    h = hashlib.sha256(json.dumps(conf, sort_keys=True, default=str).encode())
+    for name, is_read in input_files:
+        path = getattr(cfg, name, None)
+        if path and is_read(cfg):
+            h.update(name.encode())
+            file_hash(path, h)
+    for (name, sub), patterns, is_read in data_folders:
+        if is_read(cfg):
+            h.update(sub.encode() or name.encode())
+            h.update(data_hash(os.path.join(getattr(cfg, name, '') or '', sub), patterns).encode())
+    h.update(vulcan_version(vulcan_dir).encode())
+    return h.hexdigest()[:24]
+
+
+def warm_hash(h, vul_ini, dttry):
+    """
+    The hash stored with a warm-started run (input hash h, initialized from vul_ini with the starting timestep dttry),
+    so the lookups of cold runs (by h) never return a warm-started output.
+    """
+    h = hashlib.sha256(('warm start ' + h + ' ' + repr(float(dttry))).encode())
+    file_hash(vul_ini, h)
+    return h.hexdigest()[:24]
+
+
+def stored_entry(vul_file):
+    """The input hash and the end_case saved in a .vul output (None if it has none or cannot be read)."""
+    try:
+        with open(vul_file, 'rb') as f:
+            data = pickle.load(f)
+        return {'hash': data.get('input_hash'), 'end_case': data['parameter'].get('end_case')}
+    except Exception:
+        return {'hash': None, 'end_case': None}
+
+
+def load_index(output_dir):
+    """The input hashes of the .vul files in output_dir: {file name: {'hash': ..., 'end_case': ..., 'mtime': ...}}."""
+    index, changed = {}, False
+    try:
+        with open(os.path.join(output_dir, index_name)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        pass
+    for path in glob.glob(os.path.join(output_dir, '*.vul')):
+        fname, mtime = os.path.basename(path), os.path.getmtime(path)
+        # the entries written before end_case was indexed are read again
+        if fname not in index or index[fname]['mtime'] != mtime or 'end_case' not in index[fname]:
+            index[fname] = dict(stored_entry(path), mtime=mtime)
+            changed = True
+    for fname in [fname for fname in index if not os.path.exists(os.path.join(output_dir, fname))]:
+        del index[fname]
+        changed = True
+    if changed:
+        save_index(output_dir, index)
+    return index
+
+
+def save_index(output_dir, index):
+    tmp = os.path.join(output_dir, index_name + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp, os.path.join(output_dir, index_name))
+
+
+def lookup(output_dir, out_name, h):
+    """
+    The cached converged output for the input hash h: output_dir/out_name if its hash matches, or a copy of
+    another converged .vul with the same hash made as output_dir/out_name. None if there is none.
+    """
+    if not h or not os.path.isdir(output_dir):
+        return None
+    index = load_index(output_dir)
+    dst = os.path.join(output_dir, out_name)
+    if out_name in index and index[out_name]['hash'] == h and index[out_name]['end_case'] == 1:
+        return dst
+    for fname, entry in index.items():
+        if entry['hash'] == h and entry['end_case'] == 1:
+            shutil.copyfile(os.path.join(output_dir, fname), dst)
+            index[out_name] = {'hash': h, 'end_case': 1, 'mtime': os.path.getmtime(dst)}
+            save_index(output_dir, index)
+            print(f"Reusing {fname} (same input hash {h}) as {out_name}")
+            return dst
+    return None
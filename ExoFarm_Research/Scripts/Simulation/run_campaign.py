@@ -0,0 +1,508 @@
+"""
+Campaign runner for the ExoFarm VULCAN scenarios.
+
+Instead of launching every scenario at once, the scenarios are queued and admitted to a
+pool of worker processes only when a CPU slot is free and the estimated memory of the run
+fits in the memory budget (a fraction of the available memory). The memory of each run is
+estimated from the size of the problem: the number of species (ni) and reactions of the
+network, the number of layers (nz) and the number of wavelength bins (nbins).
+
+Each scenario runs in its own run folder (temp_run_<id>) with the input data read in place
+from the VULCAN folder (run_case.py --data-dir), as in run_parallel_earth.py.
+The runs are asyncio subprocesses: VULCAN writes json-lines progress records into its stdout
+(run_case.py --progress -), which the runner reads as they come to show the step throughput,
+longdy and ETA of every scenario; the rest of the output goes to the log of the run.
+A finished run frees its slot at once and its .vul output is moved to Results/Outputs
+and the run folder is removed.
+
+The scenarios whose inputs (YAML, boundary conditions, stellar spectrum, atmosphere, network and
+VULCAN sources) are unchanged since their converged output in Results/Outputs was made are not run again
+(see result_cache.py); --force runs them anyway. Outputs stopped by runtime or count_max are not reused.
+A run folder left with a checkpoint of the same inputs (a run stopped by SIGTERM, see VULCAN/checkpoint.py)
+is resumed from it instead of starting again.
+
+With --warm-start, the scenarios that differ only in their bottom boundary fluxes (e.g. A0-A3) are chained:
+the one closest to the others starts cold and each of the others starts from the converged output of its
+nearest scenario (ini_mix = 'vulcan_ini') with a larger starting timestep. A warm start already made from
+the same output is reused from Results/Outputs. The steps and wall time saved against cold starts are
+reported at the end.
+
+At the end, the queue, run and finish times of every scenario, with the estimated and the peak
+memory, are printed and saved to Results/Logs/campaign_<date>.json.
+
+Usage:
+    python run_campaign.py [earth|trappist|all] [--max-workers N] [--mem-fraction F] [--force] [--warm-start]
+"""
+
+import argparse
+import asyncio
+import collections
+import glob
+import json
+import math
+import os
+import pickle
+import re
+import shutil
+import sys
+import time
+
+import yaml
+
+import result_cache
+from scenarios import campaigns
+
+# ==========================================
+# Path Setup
+# ==========================================
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+# Project root is 3 levels up from Scripts/Simulation/
+project_root = os.path.abspath(os.path.join(script_dir, '../../../'))
+
+vulcan_dir = os.path.join(project_root, 'VULCAN')
+config_dir = os.path.join(project_root, 'ExoFarm_Research', 'Config')
+boundary_conditions_dir = os.path.join(config_dir, 'Boundary_Conditions')
+output_final_dir = os.path.join(project_root, 'ExoFarm_Research', 'Results', 'Outputs')
+log_dir = os.path.join(project_root, 'ExoFarm_Research', 'Results', 'Logs')
+work_base_dir = os.path.join(project_root, 'ExoFarm_Research')
+line_limit = 2**28  # the longest line of a run's output read by the campaign runner (asyncio's default is 64 KiB)
+
+# run_case.render_cfg and vulcan_config.Config give the VULCAN settings of a yaml file
+sys.path.insert(0, vulcan_dir)
+
+# ==========================================
+# Memory Estimate
+# ==========================================
+
+base_memory = 180 * 2**20  # the Python interpreter with numpy, scipy, matplotlib and chem_funs
+
+
+def load_settings(yaml_abs_path):
+    """The vulcan_cfg settings of a scenario (paths resolved under the VULCAN folder)."""
+    import vulcan_config
+    return vulcan_config.Config.from_yaml(yaml_abs_path, vulcan_dir, boundary_conditions_dir)
+
+
+def network_size(network):
+    """The number of species and reactions (forward and reverse) of a network file."""
+    species, n_re = set(), 0
+    with open(network) as f:
+        for line in f:
+            match = re.search(r'\[(.*?)->(.*?)\]', line)
+            if not match or line.lstrip().startswith('#'):
+                continue
+            n_re += 1
+            for side in match.groups():
+                for sp in side.split('+'):
+                    sp = sp.strip()
+                    if sp and sp != 'M':
+                        species.add(sp)
+    return len(species), 2 * n_re
+
+
+def n_bins(cfg):
+    """The number of wavelength bins made by make_bins_read_cross (upper limit)."""
+    if not cfg.use_photo:
+        return 0
+    wavelength = []
+    try:
+        with open(cfg.sflux_file) as f:
+            for line in f:
+                try:
+                    wavelength.append(float(line.split()[0]))
+                except (ValueError, IndexError):
+                    continue
+    except OSError:
+        print(f"Warning: {cfg.sflux_file} not found; assuming bins from 2 to 700 nm")
+    bin_min, bin_max = (max(wavelength[0], 2.), min(wavelength[-1], 700.)) if wavelength else (2., 700.)
+    trans = min(max(cfg.dbin_12trans, bin_min), bin_max)
+    return int((trans - bin_min) / cfg.dbin1) + int((bin_max - trans) / cfg.dbin2) + 1
+
+
+def estimate_memory(cfg):
+    """
+    The memory (bytes) of one VULCAN run:
+    the 3 (ni x ni) Jacobian blocks per layer of the block-tridiagonal solver and their factorisation,
+    about 40 (nz x nbins) arrays of radiative transfer and T-dependent cross sections,
+    and the rate constants and reaction rates (nr x nz).
+    """
+    ni, nr = network_size(cfg.network)
+    nz, nbins = cfg.nz, n_bins(cfg)
+    n_float = 4 * nz * ni * ni + 40 * (nz + 1) * nbins + 4 * nr * nz
+    return base_memory + 8 * n_float
+
+
+def available_memory():
+    """The memory (bytes) available for new processes, or None if unknown."""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_AVPHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+# ==========================================
+# Warm Start
+# ==========================================
+
+warm_dttry = 1.e-4  # the starting timestep (s) of a warm start (the cold starts use dttry = 1e-10 s)
+
+
+def scenario_base(yaml_abs_path):
+    """The yaml settings of a scenario but its name, output and bottom boundary fluxes (the same for the scenarios of one chain)."""
+    with open(yaml_abs_path) as f:
+        conf = yaml.safe_load(f)
+    conf.get('planet', {}).pop('name', None)
+    for key in ['bot_BC_flux_file', 'out_name']:
+        conf.get('chemistry', {}).pop(key, None)
+    return json.dumps(conf, sort_keys=True, default=str)
+
+
+def read_bc(cfg):
+    """The bottom boundary condition {species: (log10 of 1 + flux, log10 of the deposition velocity)} of a scenario."""
+    bc = {}
+    if not getattr(cfg, 'use_botflux', False):
+        return bc
+    try:
+        with open(cfg.bot_BC_flux_file) as f:
+            for line in f:
+                if line.startswith('#') or len(line.split()) < 3:
+                    continue
+                sp, flux, vdep = line.split()[:3]
+                bc[sp] = (math.log10(1. + abs(float(flux))), math.log10(float(vdep) + 1e-10))
+    except (OSError, ValueError) as e:
+        print(f"Warning: cannot read {cfg.bot_BC_flux_file} ({e})")
+    return bc
+
+
+def bc_distance(a, b):
+    """The distance between two boundary conditions (in decades of the fluxes and deposition velocities)."""
+    none = (0., -10.)
+    return math.sqrt(sum((a.get(sp, none)[0] - b.get(sp, none)[0]) ** 2 + (a.get(sp, none)[1] - b.get(sp, none)[1]) ** 2
+                         for sp in set(a) | set(b)))
+
+
+def plan_warm_start(jobs, bcs):
+    """
+    Ordering the jobs into chains: the scenarios with the same base settings (scenario_base) form one chain,
+    starting (cold) from the scenario closest to all the others, followed by the nearest scenario to the ones
+    already in the chain. Sets job['chain'], job['neighbours'] (the other ids, nearest first) and returns the order.
+    """
+    chains = collections.OrderedDict()
+    for job in jobs:
+        chains.setdefault(scenario_base(job['yaml_abs_path']), []).append(job)
+
+    ordered = []
+    for n, members in enumerate(chains.values()):
+        dist = {(a['id'], b['id']): bc_distance(bcs[a['id']], bcs[b['id']]) for a in members for b in members}
+        root = min(members, key=lambda a: sum(dist[a['id'], b['id']] for b in members))
+        chain, rest = [root], [job for job in members if job is not root]
+        while rest:
+            nxt = min(rest, key=lambda a: min(dist[a['id'], b['id']] for b in chain))
+            chain.append(nxt)
+            rest.remove(nxt)
+        for job in chain:
+            job['chain'] = n
+            job['neighbours'] = sorted((b['id'] for b in members if b is not job), key=lambda b: dist[job['id'], b])
+        ordered += chain
+        print(f"Warm-start chain {n}: " + ' -> '.join(job['id'] for job in chain))
+    return ordered
+
+
+def converged(vul_file):
+    """True if the .vul output is a converged (steady-state) run."""
+    try:
+        with open(vul_file, 'rb') as f:
+            return pickle.load(f)['parameter'].get('end_case') == 1
+    except Exception:
+        return False
+
+
+def warm_start_source(job, jobs, running):
+    """
+    The converged job to initialize job from (the nearest one of its chain), 'wait' while a job of the
+    chain is still running or None for a cold start.
+    """
+    by_id = {j['id']: j for j in jobs}
+    for nid in job['neighbours']:
+        if by_id[nid]['converged']:
+            return by_id[nid]
+    if any(j['chain'] == job['chain'] for j in running):
+        return 'wait'
+    return None
+
+
+def baseline(job, t0):
+    """The steps and wall time of a cold converged run of the same inputs in the previous campaign reports (None if none)."""
+    for fname in sorted(glob.glob(os.path.join(log_dir, 'campaign_*.json')), reverse=True):
+        try:
+            with open(fname) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for j in previous:
+            rec = j.get('progress') or {}
+            if j.get('input_hash') == job['input_hash'] and not j.get('warm_from') and rec.get('end_case') == 1 and j['queued'] < t0:
+                return rec['count'], rec['wall']
+    return None
+
+# ==========================================
+# Simulation Execution
+# ==========================================
+
+
+def update_progress(job, rec, history):
+    """Printing the throughput (steps/s over the last records), longdy and ETA of a run from a progress record."""
+    job['progress'] = rec
+    if rec.get('peak_rss'):
+        job['peak_memory'] = max(job['peak_memory'] or 0, rec['peak_rss'])
+    history.append(rec)
+    if rec['event'] != 'step' or len(history) < 2:
+        return
+    first = history[0]
+    rate = (rec['count'] - first['count']) / max(rec['wall'] - first['wall'], 1e-9)
+    # ETA: the time to count_max (an upper limit) or, while longdy is falling, to longdy = yconv_cri
+    eta = (rec['count_max'] - rec['count']) / rate if rate > 0 else float('inf')
+    if 0 < rec['longdy'] < first['longdy'] and rec['longdy'] > rec['yconv_cri']:
+        slope = (math.log(rec['longdy']) - math.log(first['longdy'])) / max(rec['wall'] - first['wall'], 1e-9)
+        eta = min(eta, math.log(rec['yconv_cri'] / rec['longdy']) / slope)
+    eta_str = f"{eta / 60:.1f} min" if math.isfinite(eta) else '-'
+    rejections = sum(rec['rejections'].values())
+    print(f"[{job['id']}] step {rec['count']}/{rec['count_max']}  {rate:.2f} steps/s  t = {rec['t']:.2e} s  "
+          f"dt = {rec['dt']:.2e}  longdy = {rec['longdy']:.2e}  rejected {rejections}  ETA {eta_str}")
+
+
+async def run_scenario(job):
+    """Running one scenario in its run folder and collecting its output."""
+    try:
+        await launch(job)
+    except Exception as e:
+        print(f"[{job['id']}] Error: {e}")
+    finally:
+        job['end'] = time.time()
+
+
+def checkpoint_of(job, temp_dir):
+    """True if the run folder has a checkpoint of the run with the same inputs (left by a stopped run)."""
+    try:
+        with open(os.path.join(temp_dir, 'output', job['out_name'] + '.ckpt.json')) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return meta.get('input_hash') == job['run_hash']
+
+
+async def launch(job):
+    run_id = job['id']
+    temp_dir = os.path.join(work_base_dir, f'temp_run_{run_id}')
+    # a run stopped before (e.g. by SIGTERM) is resumed from its checkpoint in its run folder
+    job['resumed'] = checkpoint_of(job, temp_dir)
+    if job['resumed']:
+        print(f"[{run_id}] resuming from the checkpoint in {temp_dir}")
+    else:
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+        os.makedirs(temp_dir)
+
+    cmd = [sys.executable, '-u', os.path.join(vulcan_dir, 'run_case.py'), job['yaml_abs_path'],
+           '--data-dir', vulcan_dir, '--bc-dir', boundary_conditions_dir, '--progress', '-',
+           '--input-hash', job['run_hash']]
+    if job['warm_from']:
+        cmd += ['--vul-ini', job['vul_ini'], '--dttry', str(warm_dttry)]
+    if job['resumed']:
+        cmd += ['--resume']
+    log_file_path = os.path.join(temp_dir, f'run_{run_id}.log')
+    history = collections.deque(maxlen=10)
+    with open(log_file_path, 'a' if job['resumed'] else 'w') as log_file:
+        # VULCAN prints whole arrays on one line (np.set_printoptions(threshold=np.inf)): reading them needs a large limit
+        p = await asyncio.create_subprocess_exec(*cmd, cwd=temp_dir, stdout=asyncio.subprocess.PIPE,
+                                                 stderr=asyncio.subprocess.STDOUT, limit=line_limit)
+        # the progress records are the lines starting with {"event"; the rest is the log of the run
+        async for line in p.stdout:
+            line = line.decode(errors='replace')
+            if line.startswith('{"event"'):
+                try:
+                    update_progress(job, json.loads(line), history)
+                    continue
+                except (ValueError, KeyError):
+                    pass
+            log_file.write(line)
+        await p.wait()
+    job['returncode'] = p.returncode
+    if job['progress'] and job['progress']['event'] == 'end':
+        end_case = {1: 'converged', 2: 'runtime exceeded', 3: 'count_max exceeded'}.get(job['progress']['end_case'])
+        print(f"[{run_id}] {end_case} after {job['progress']['count']} steps")
+
+    # Collect Output Files (.vul)
+    vul_files = glob.glob(os.path.join(temp_dir, 'output', '*.vul'))
+    if not vul_files:
+        print(f"[{run_id}] Warning: No .vul output files found (log: {log_file_path})")
+    for vf in vul_files:
+        dst = os.path.join(output_final_dir, os.path.basename(vf))
+        try:
+            shutil.move(vf, dst)
+            job['outputs'].append(dst)
+        except Exception as e:
+            print(f"[{run_id}] Error moving output file: {e}")
+
+    job['converged'] = bool(job['outputs']) and bool(job['progress']) and job['progress'].get('end_case') == 1
+
+    # The run folder is kept (with its log) when the run failed
+    if p.returncode == 0 and vul_files:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    else:
+        job['log'] = log_file_path
+
+
+async def schedule(jobs, all_jobs, max_workers, mem_budget, warm_start=False, force=False):
+    """
+    Admitting the queued jobs while they fit and waiting for the next run to finish.
+    With warm_start, a job waits for a converged job of its chain (see plan_warm_start) to start from;
+    a warm start made before from the same output (same warm_hash) is reused unless force.
+    """
+    pending, running = list(jobs), {}
+    while pending or running:
+        # admitting the queued jobs in order, letting smaller jobs pass a job that does not fit yet
+        for job in list(pending):
+            if len(running) >= max_workers:
+                break
+            mem_used = sum(j['memory'] for j in running.values())
+            if running and mem_used + job['memory'] > mem_budget:
+                continue
+            source = warm_start_source(job, all_jobs, running.values()) if warm_start else None
+            if source == 'wait':
+                continue
+            if job['memory'] > mem_budget:
+                print(f"[{job['id']}] Warning: estimated memory above the budget; running it alone")
+            pending.remove(job)
+            job['start'] = time.time()
+            if source:
+                job['warm_from'], job['vul_ini'] = source['id'], source['outputs'][0]
+                # the output of a warm start is not the cold-start result of the same inputs
+                job['run_hash'] = result_cache.warm_hash(job['input_hash'], job['vul_ini'], warm_dttry)
+                cached = None if force else result_cache.lookup(output_final_dir, job['out_name'], job['run_hash'])
+                if cached:
+                    job.update({'end': job['start'], 'cached': True, 'outputs': [cached], 'converged': True})
+                    print(f"[{job['id']}] warm start from {source['id']} unchanged (hash {job['run_hash']}): using {cached}")
+                    continue
+                print(f"[{job['id']}] warm start from {source['id']} ({os.path.basename(job['vul_ini'])}, dttry = {warm_dttry:.0e} s)")
+            print(f"[{job['id']}] started after {job['start'] - job['queued']:.0f} s in the queue")
+            running[asyncio.create_task(run_scenario(job))] = job
+        if not running:  # the admitted jobs were all cached
+            continue
+
+        # the finished jobs free their CPU slot and memory
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            job = running.pop(task)
+            print(f"[{job['id']}] finished with return code {job['returncode']} in {job['end'] - job['start']:.0f} s")
+
+
+def run_campaign(scenarios, max_workers, mem_fraction, force=False, warm_start=False):
+    os.makedirs(output_final_dir, exist_ok=True)
+    os.makedirs(log_dir, exist_ok=True)
+
+    t0 = time.time()
+    jobs, bcs = [], {}
+    for sc in scenarios:
+        yaml_abs_path = os.path.join(config_dir, sc['yaml'])
+        cfg = load_settings(yaml_abs_path)
+        jobs.append({'id': sc['id'], 'name': sc.get('name', sc['id']), 'yaml_abs_path': yaml_abs_path,
+                     'memory': estimate_memory(cfg), 'peak_memory': None, 'queued': t0,
+                     'start': None, 'end': None, 'returncode': None, 'progress': None, 'outputs': [],
+                     'input_hash': result_cache.input_hash(yaml_abs_path, cfg, vulcan_dir), 'cached': False,
+                     'converged': False, 'warm_from': None, 'vul_ini': None, 'out_name': cfg.out_name, 'resumed': False})
+        bcs[sc['id']] = read_bc(cfg)
+        jobs[-1]['run_hash'] = jobs[-1]['input_hash']  # the hash given to VULCAN (see warm_hash)
+        cached = None if force else result_cache.lookup(output_final_dir, cfg.out_name, jobs[-1]['input_hash'])
+        if cached:
+            jobs[-1].update({'start': t0, 'end': t0, 'cached': True, 'outputs': [cached], 'converged': converged(cached)})
+
+    avail = available_memory()
+    mem_budget = mem_fraction * avail if avail else float('inf')
+    print(f"Campaign of {len(jobs)} scenarios with at most {max_workers} workers and "
+          f"{mem_budget / 2**30:.2f} GB memory budget")
+    for job in jobs:
+        if job['cached']:
+            print(f"[{job['id']}] inputs unchanged (hash {job['input_hash']}): using {job['outputs'][0]}")
+        else:
+            print(f"[{job['id']}] queued (estimated memory {job['memory'] / 2**20:.0f} MB)")
+
+    order = plan_warm_start(jobs, bcs) if warm_start else jobs
+    asyncio.run(schedule([job for job in order if not job['cached']], jobs, max_workers, mem_budget, warm_start, force))
+
+    report(jobs, t0)
+    if warm_start:
+        report_warm_start(jobs, t0)
+    return jobs
+
+
+def report(jobs, t0):
+    print("")
+    print(f"{'id':<14s} {'queued (s)':>10s} {'run (s)':>9s} {'finish (s)':>10s} {'est. MB':>8s} {'peak MB':>8s} {'rc':>6s}")
+    for job in jobs:
+        peak = f"{job['peak_memory'] / 2**20:.0f}" if job['peak_memory'] else '-'
+        rc = 'cached' if job['cached'] else str(job['returncode'])
+        print(f"{job['id']:<14s} {job['start'] - job['queued']:>10.0f} {job['end'] - job['start']:>9.0f} "
+              f"{job['end'] - t0:>10.0f} {job['memory'] / 2**20:>8.0f} {peak:>8s} {rc:>6s}")
+    print(f"Campaign finished in {time.time() - t0:.0f} s")
+
+    fname = os.path.join(log_dir, 'campaign_' + time.strftime('%Y%m%d_%H%M%S', time.localtime(t0)) + '.json')
+    with open(fname, 'w') as f:
+        json.dump(jobs, f, indent=2)
+    print(f"Report saved to {fname}")
+
+
+def report_warm_start(jobs, t0):
+    """
+    Printing the steps and wall time of the warm-started runs against a cold start of the same inputs
+    (from a previous campaign report) or, if there is none, against the cold start of their chain (marked *).
+    """
+    cold = {}
+    for job in jobs:
+        if not job['warm_from'] and job['converged'] and job['progress']:
+            cold[job['chain']] = (job['progress']['count'], job['progress']['wall'])
+    print("")
+    print(f"{'id':<14s} {'from':<14s} {'steps':>7s} {'cold':>8s} {'saved':>7s} {'wall (s)':>9s} {'cold (s)':>9s} {'saved (s)':>9s}")
+    saved_steps, saved_wall = 0, 0.
+    for job in jobs:
+        if not job['warm_from'] or not job['progress']:
+            continue
+        ref, mark = baseline(job, t0), ' '
+        if ref is None and job['chain'] in cold:
+            ref, mark = cold[job['chain']], '*'
+        steps, wall = job['progress']['count'], job['progress']['wall']
+        if ref is None:
+            print(f"{job['id']:<14s} {job['warm_from']:<14s} {steps:>7d} {'-':>8s} {'-':>7s} {wall:>9.0f} {'-':>9s} {'-':>9s}")
+            continue
+        saved_steps += ref[0] - steps
+        saved_wall += ref[1] - wall
+        print(f"{job['id']:<14s} {job['warm_from']:<14s} {steps:>7d} {ref[0]:>7d}{mark} {ref[0] - steps:>7d} "
+              f"{wall:>9.0f} {ref[1]:>9.0f} {ref[1] - wall:>9.0f}")
+    print(f"Warm starts saved {saved_steps} steps and {saved_wall:.0f} s of integration")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a campaign of VULCAN scenarios with bounded concurrency.')
+    parser.add_argument('campaign', nargs='?', default='earth', choices=sorted(campaigns))
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1,
+                        help='the maximal number of concurrent runs (default: the number of CPUs)')
+    parser.add_argument('--mem-fraction', type=float, default=0.8,
+                        help='the fraction of the available memory the runs may use (default: 0.8)')
+    parser.add_argument('--warm-start', action='store_true',
+                        help='initialize each scenario from the converged output of the nearest scenario (in bottom fluxes)')
+    parser.add_argument('--force', action='store_true',
+                        help='run the scenarios even if their inputs are unchanged since their output was made')
+    args = parser.parse_args()
+
+    run_campaign(campaigns[args.campaign], max(args.max_workers, 1), args.mem_fraction, args.force, args.warm_start)
+
+
+if __name__ == "__main__":
+    main()
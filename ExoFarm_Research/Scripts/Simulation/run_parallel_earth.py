@@ -3,13 +3,14 @@ Script to run parallel VULCAN simulations for Earth scenarios.
 
 This script manages the execution of multiple VULCAN simulations in parallel.
 It performs the following steps for each scenario:
-1. Creates a temporary working directory (e.g., temp_run_A0).
-2. Copies necessary VULCAN source code and data files (atm, thermo, fastchem) to the temp directory.
-3. Copies the specific Boundary Condition files.
-4. Generates a VULCAN configuration file from the specified YAML input.
-5. Runs the simulation using `run_case.py`.
-6. Moves the final output (.vul file) to the Results/Outputs directory.
-7. Cleans up (deletes) the temporary directory.
+0. Skips the scenario if its converged output in Results/Outputs was made from the same inputs
+   (same input hash, see result_cache.py); a run stopped by runtime or count_max is run again.
+1. Creates a run folder (e.g., temp_run_A0) for the generated vulcan_cfg.py, chem_funs.py, logs and outputs.
+2. Runs the simulation using `run_case.py` from the VULCAN folder with the run folder as working directory.
+   The input data (thermo, atm, fastchem) are read in place from the VULCAN folder (--data-dir) and
+   the Boundary Condition files from Config/Boundary_Conditions (--bc-dir), so nothing is copied.
+3. Moves the final output (.vul file) to the Results/Outputs directory.
+4. Cleans up (deletes) the run folder.
 
 Usage:
     python run_parallel_earth.py
@@ -26,33 +27,8 @@ import glob
 # Configuration
 # ==========================================
 
-# List of scenarios to run.
-# Each dictionary contains:
-# - id: Unique identifier for the run (used for temp folder naming).
-# - yaml: Relative path to the YAML configuration file.
-# - name: Human-readable name for the scenario.
-scenarios = [
-    {
-        'id': 'A0',
-        'yaml': 'planets/earth_sun/input_earth_sun_A0.yml',
-        'name': 'Pre-Agri'
-    },
-    {
-        'id': 'A1',
-        'yaml': 'planets/earth_sun/input_earth_sun_A1.yml',
-        'name': 'Current'
-    },
-    {
-        'id': 'A2',
-        'yaml': 'planets/earth_sun/input_earth_sun_A2.yml',
-        'name': 'Moderate'
-    },
-    {
-        'id': 'A3',
-        'yaml': 'planets/earth_sun/input_earth_sun_A3.yml',
-        'name': 'Extreme'
-    }
-]
+# List of scenarios to run (see scenarios.py).
+from scenarios import earth_scenarios as scenarios
 
 # DEBUGGING / TESTING:
 # Uncomment the following line to run only specific scenarios (e.g., only A1)
@@ -72,7 +48,7 @@ config_dir = os.path.join(project_root, 'ExoFarm_Research', 'Config')
 boundary_conditions_dir = os.path.join(config_dir, 'Boundary_Conditions')
 output_final_dir = os.path.join(project_root, 'ExoFarm_Research', 'Results', 'Outputs')
 
-# Work base directory for creating temporary simulation folders
+# Work base directory for creating the run folders
 work_base_dir = os.path.join(project_root, 'ExoFarm_Research')
 
 # Ensure output directory exists
@@ -80,15 +56,15 @@ if not os.path.exists(output_final_dir):
     os.makedirs(output_final_dir)
     print(f"Created output directory: {output_final_dir}")
 
+# vulcan_config.Config gives the VULCAN settings of a yaml file (for the input hash)
+sys.path.insert(0, vulcan_dir)
+import vulcan_config
+import result_cache
+
 # ==========================================
 # Simulation Execution
 # ==========================================
 
-# Define resources to copy
-py_files = glob.glob(os.path.join(vulcan_dir, '*.py'))
-vulcan_folders_to_copy = ['thermo', 'atm', 'fastchem_vulcan']
-folders_to_create = ['output', 'plot']
-
 processes = []
 
 print(f"Starting parallel execution of {len(scenarios)} scenarios...")
@@ -101,57 +77,27 @@ for sc in scenarios:
     yaml_rel_path = sc['yaml']
     yaml_abs_path = os.path.join(config_dir, yaml_rel_path)
     
-    # 1. Create unique temp directory
+    # 0. Skip the scenario if its converged output was made from the same inputs
+    cfg = vulcan_config.Config.from_yaml(yaml_abs_path, vulcan_dir, boundary_conditions_dir)
+    input_hash = result_cache.input_hash(yaml_abs_path, cfg, vulcan_dir)
+    if result_cache.lookup(output_final_dir, cfg.out_name, input_hash):
+        print(f"[{run_id}] Inputs unchanged (hash {input_hash}): skipping, converged output {cfg.out_name} is up to date")
+        continue
+    
+    # 1. Create unique run folder
     temp_dir = os.path.join(work_base_dir, f'temp_run_{run_id}')
     if os.path.exists(temp_dir):
         shutil.rmtree(temp_dir)
     os.makedirs(temp_dir)
     
     print(f"[{run_id}] Setting up directory: {temp_dir}")
-    
-    # 2. Copy Python source files
-    print(f"[{run_id}] Copying .py files from VULCAN...")
-    for f in py_files:
-        try:
-            shutil.copy(f, temp_dir)
-        except Exception as e:
-            print(f"[{run_id}] Error copying {f}: {e}")
-
-    # Explicitly ensure run_case.py and vulcan.py are copied (critical files)
-    for f in ['run_case.py', 'vulcan.py']:
-        src = os.path.join(vulcan_dir, f)
-        dst = os.path.join(temp_dir, f)
-        if os.path.exists(src):
-            try:
-                shutil.copy2(src, dst)
-            except Exception as e:
-                print(f"[{run_id}] Error explicitly copying {f}: {e}")
-        else:
-             print(f"[{run_id}] Warning: {f} not found in {vulcan_dir}")
-        
-    # 3. Copy VULCAN data folders (thermo, atm, etc.)
-    for folder in vulcan_folders_to_copy:
-        src = os.path.join(vulcan_dir, folder)
-        dst = os.path.join(temp_dir, folder)
-        if os.path.exists(src):
-            shutil.copytree(src, dst)
-
-    # 4. Copy Boundary Conditions
-    # Note: VULCAN expects a 'boundary_conditions' folder
-    src_bc = boundary_conditions_dir
-    dst_bc = os.path.join(temp_dir, 'boundary_conditions')
-    if os.path.exists(src_bc):
-        shutil.copytree(src_bc, dst_bc)
-            
-    # 5. Create output structure
-    for folder in folders_to_create:
-        os.makedirs(os.path.join(temp_dir, folder), exist_ok=True)
         
-    # 6. Launch Simulation Process
+    # 2. Launch Simulation Process
     print(f"[{run_id}] Launching VULCAN...")
-    # Command: python -u run_case.py <abs_path_to_yaml>
+    # Command: python -u <VULCAN>/run_case.py <abs_path_to_yaml> --data-dir <VULCAN> --bc-dir <Boundary_Conditions>
     # -u: Unbuffered output (useful for logging)
-    cmd = [sys.executable, '-u', 'run_case.py', yaml_abs_path]
+    cmd = [sys.executable, '-u', os.path.join(vulcan_dir, 'run_case.py'), yaml_abs_path,
+           '--data-dir', vulcan_dir, '--bc-dir', boundary_conditions_dir, '--input-hash', input_hash]
     
     # Redirect stdout/stderr to a log file
     log_file_path = os.path.join(temp_dir, f'run_{run_id}.log')
@@ -208,7 +154,7 @@ for proc in processes:
              print(f"[{run_id}] Error moving output file: {e}")
         
     # 2. Delete Temporary Directory
-    print(f"[{run_id}] Cleaning up temp directory {temp_dir}...")
+    print(f"[{run_id}] Cleaning up run folder {temp_dir}...")
     try:
         shutil.rmtree(temp_dir)
         print(f"[{run_id}] Temp directory removed.")
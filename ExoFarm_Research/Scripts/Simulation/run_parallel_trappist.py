@@ -3,13 +3,14 @@ Script to run parallel VULCAN simulations for TRAPPIST-1e scenarios.
 
 This script manages the execution of multiple VULCAN simulations in parallel.
 It performs the following steps for each scenario:
-1. Creates a temporary working directory (e.g., temp_run_Trappist_A0).
-2. Copies necessary VULCAN source code and data files (atm, thermo, fastchem) to the temp directory.
-3. Copies the specific Boundary Condition files.
-4. Generates a VULCAN configuration file from the specified YAML input.
-5. Runs the simulation using `run_case.py`.
-6. Moves the final output (.vul file) to the Results/Outputs directory.
-7. Cleans up (deletes) the temporary directory.
+0. Skips the scenario if its converged output in Results/Outputs was made from the same inputs
+   (same input hash, see result_cache.py); a run stopped by runtime or count_max is run again.
+1. Creates a run folder (e.g., temp_run_Trappist_A0) for the generated vulcan_cfg.py, chem_funs.py, logs and outputs.
+2. Runs the simulation using `run_case.py` from the VULCAN folder with the run folder as working directory.
+   The input data (thermo, atm, fastchem) are read in place from the VULCAN folder (--data-dir) and
+   the Boundary Condition files from Config/Boundary_Conditions (--bc-dir), so nothing is copied.
+3. Moves the final output (.vul file) to the Results/Outputs directory.
+4. Cleans up (deletes) the run folder.
 
 Usage:
     python run_parallel_trappist.py
@@ -35,7 +36,7 @@ config_dir = os.path.join(project_root, 'ExoFarm_Research', 'Config')
 boundary_conditions_dir = os.path.join(config_dir, 'Boundary_Conditions')
 output_final_dir = os.path.join(project_root, 'ExoFarm_Research', 'Results', 'Outputs')
 
-# Base directory for temporary simulation folders
+# Base directory for the run folders
 work_base_dir = os.path.join(project_root, 'ExoFarm_Research')
 
 # Ensure output directory exists
@@ -43,14 +44,14 @@ if not os.path.exists(output_final_dir):
     os.makedirs(output_final_dir)
     print(f"Created output directory: {output_final_dir}")
 
-# Define scenarios to run
+# vulcan_config.Config gives the VULCAN settings of a yaml file (for the input hash)
+sys.path.insert(0, vulcan_dir)
+import vulcan_config
+import result_cache
+
+# Define scenarios to run (see scenarios.py)
 # Each scenario has a unique ID and a relative path to its configuration file
-scenarios = [
-    {'id': 'Trappist_A0', 'config': 'planets/earth_trappist/input_earth_trappist_A0.yml'},
-    {'id': 'Trappist_A1', 'config': 'planets/earth_trappist/input_earth_trappist_A1.yml'},
-    {'id': 'Trappist_A2', 'config': 'planets/earth_trappist/input_earth_trappist_A2.yml'},
-    {'id': 'Trappist_A3', 'config': 'planets/earth_trappist/input_earth_trappist_A3.yml'}
-]
+from scenarios import trappist_scenarios as scenarios
 
 # FOR TESTING: Uncomment the following line to run only the first scenario
 # scenarios = scenarios[:1]
@@ -68,9 +69,16 @@ print(f"Working base: {work_base_dir}")
 
 for sc in scenarios:
     run_id = sc['id']
-    config_rel_path = sc['config']
+    config_rel_path = sc['yaml']
     config_abs_path = os.path.join(config_dir, config_rel_path)
     
+    # 0. Skip the scenario if its converged output was made from the same inputs
+    cfg = vulcan_config.Config.from_yaml(config_abs_path, vulcan_dir, boundary_conditions_dir)
+    input_hash = result_cache.input_hash(config_abs_path, cfg, vulcan_dir)
+    if result_cache.lookup(output_final_dir, cfg.out_name, input_hash):
+        print(f"[{run_id}] Inputs unchanged (hash {input_hash}): skipping, converged output {cfg.out_name} is up to date")
+        continue
+    
     # Define temporary directory path
     temp_dir = os.path.join(work_base_dir, f'temp_run_{run_id}')
     
@@ -82,64 +90,16 @@ for sc in scenarios:
     
     print(f"[{run_id}] Setting up in {temp_dir}...")
     
-    # -------------------------------------------------------------------------
-    # Copy VULCAN Source Code
-    # -------------------------------------------------------------------------
-    
-    # Copy all .py files from VULCAN root
-    py_files = glob.glob(os.path.join(vulcan_dir, '*.py'))
-    # print(f"[{run_id}] Copying {len(py_files)} .py files from VULCAN...")
-    for file in py_files:
-        try:
-            shutil.copy(file, temp_dir)
-        except Exception as e:
-            print(f"[{run_id}] Error copying {file}: {e}")
-
-    # Explicitly ensure run_case.py and vulcan.py are copied (critical files)
-    for f in ['run_case.py', 'vulcan.py']:
-        src = os.path.join(vulcan_dir, f)
-        dst = os.path.join(temp_dir, f)
-        if os.path.exists(src):
-            try:
-                shutil.copy2(src, dst)
-            except Exception as e:
-                print(f"[{run_id}] Error explicitly copying {f}: {e}")
-        else:
-             print(f"[{run_id}] Warning: {f} not found in {vulcan_dir}")
-
-    # Copy data folders: atm, thermo, fastchem_vulcan
-    vulcan_folders_to_copy = ['atm', 'thermo', 'fastchem_vulcan']
-    for folder in vulcan_folders_to_copy:
-        src = os.path.join(vulcan_dir, folder)
-        dst = os.path.join(temp_dir, folder)
-        if os.path.exists(src):
-            shutil.copytree(src, dst)
-        else:
-            print(f"[{run_id}] Warning: Folder {folder} not found in VULCAN dir.")
-
-    # -------------------------------------------------------------------------
-    # Copy Boundary Conditions
-    # -------------------------------------------------------------------------
-    
-    # Rename folder to 'boundary_conditions' for VULCAN compatibility
-    src_bc = boundary_conditions_dir
-    dst_bc = os.path.join(temp_dir, 'boundary_conditions')
-    if os.path.exists(src_bc):
-        shutil.copytree(src_bc, dst_bc)
-    else:
-        print(f"[{run_id}] Warning: Boundary conditions dir not found at {src_bc}")
-            
-    # Create output directories within the temp folder
-    os.makedirs(os.path.join(temp_dir, 'output'), exist_ok=True)
-    os.makedirs(os.path.join(temp_dir, 'plot'), exist_ok=True)
-    
     # -------------------------------------------------------------------------
     # Launch Process
     # -------------------------------------------------------------------------
     
-    # Command to run: python run_case.py <config_file>
+    # The run folder only receives the generated files and the outputs:
+    # the data folders are read from vulcan_dir and the boundary conditions from their Config folder
+    # Command to run: python <VULCAN>/run_case.py <config_file> --data-dir <VULCAN> --bc-dir <Boundary_Conditions>
     # We pass the absolute path of the YAML file
-    cmd = [sys.executable, '-u', 'run_case.py', config_abs_path]
+    cmd = [sys.executable, '-u', os.path.join(vulcan_dir, 'run_case.py'), config_abs_path,
+           '--data-dir', vulcan_dir, '--bc-dir', boundary_conditions_dir, '--input-hash', input_hash]
     
     # Open log file to capture stdout/stderr
     log_file_path = os.path.join(temp_dir, f'{run_id}.log')
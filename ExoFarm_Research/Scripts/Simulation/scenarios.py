@@ -0,0 +1,28 @@
+"""
+Scenario lists of the ExoFarm simulation campaigns.
+
+Each dictionary contains:
+- id: Unique identifier for the run (used for the run folder naming).
+- yaml: Path of the YAML configuration file relative to ExoFarm_Research/Config.
+- name: Human-readable name for the scenario.
+"""
+
+earth_scenarios = [
+    {'id': 'A0', 'yaml': 'planets/earth_sun/input_earth_sun_A0.yml', 'name': 'Pre-Agri'},
+    {'id': 'A1', 'yaml': 'planets/earth_sun/input_earth_sun_A1.yml', 'name': 'Current'},
+    {'id': 'A2', 'yaml': 'planets/earth_sun/input_earth_sun_A2.yml', 'name': 'Moderate'},
+    {'id': 'A3', 'yaml': 'planets/earth_sun/input_earth_sun_A3.yml', 'name': 'Extreme'},
+]
+
+trappist_scenarios = [
+    {'id': 'Trappist_A0', 'yaml': 'planets/earth_trappist/input_earth_trappist_A0.yml', 'name': 'TRAPPIST-1e Pre-Agri'},
+    {'id': 'Trappist_A1', 'yaml': 'planets/earth_trappist/input_earth_trappist_A1.yml', 'name': 'TRAPPIST-1e Current'},
+    {'id': 'Trappist_A2', 'yaml': 'planets/earth_trappist/input_earth_trappist_A2.yml', 'name': 'TRAPPIST-1e Moderate'},
+    {'id': 'Trappist_A3', 'yaml': 'planets/earth_trappist/input_earth_trappist_A3.yml', 'name': 'TRAPPIST-1e Extreme'},
+]
+
+campaigns = {
+    'earth': earth_scenarios,
+    'trappist': trappist_scenarios,
+    'all': earth_scenarios + trappist_scenarios,
+}
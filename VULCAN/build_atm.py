@@ -3,7 +3,7 @@ from numpy import polynomial
 import scipy
 from scipy import interpolate
 import scipy.optimize as sop
-import subprocess
+import subprocess, os
 import pickle
 from shutil import copyfile 
 
@@ -12,6 +12,11 @@ from phy_const import kb, Navo, r_sun, au
 from vulcan_cfg import nz
 import chem_funs
 from chem_funs import ni, nr  # number of species and reactions in the network
+
+def fastchem_dir():
+    # FastChem reads and writes its files in its own folder, under the data_dir of the active configuration
+    return os.path.join(getattr(vulcan_cfg, 'data_dir', ''), 'fastchem_vulcan/')
+
 species = chem_funs.spec_list
 
 ### read in the basic chemistry data
@@ -79,11 +84,12 @@ class InitialAbun(object):
         # reading-in the default elemental abundances from Lodders 2009
         # depending on including ion or not (whether there is e- in the fastchem elemental abundance dat)
         tmp_str = ""
-        solar_ele = 'fastchem_vulcan/input/solar_element_abundances.dat'
+        fc_dir = fastchem_dir()
+        solar_ele = fc_dir + 'input/solar_element_abundances.dat'
         if vulcan_cfg.use_ion == True:
-            copyfile('fastchem_vulcan/input/parameters_ion.dat', 'fastchem_vulcan/input/parameters.dat')
+            copyfile(fc_dir + 'input/parameters_ion.dat', fc_dir + 'input/parameters.dat')
         else:
-            copyfile('fastchem_vulcan/input/parameters_wo_ion.dat', 'fastchem_vulcan/input/parameters.dat')
+            copyfile(fc_dir + 'input/parameters_wo_ion.dat', fc_dir + 'input/parameters.dat')
             
         with open(solar_ele ,'r') as f:
             new_str = ""
@@ -125,17 +131,17 @@ class InitialAbun(object):
                         new_str += line
                 
             # make the new elemental abundance file
-            with open('fastchem_vulcan/input/element_abundances_vulcan.dat', 'w') as f: f.write(new_str)
+            with open(fc_dir + 'input/element_abundances_vulcan.dat', 'w') as f: f.write(new_str)
             
         # write a T-P text file for fast_chem
-        with open('fastchem_vulcan/input/vulcan_TP/vulcan_TP.dat' ,'w') as f:
+        with open(fc_dir + 'input/vulcan_TP/vulcan_TP.dat' ,'w') as f:
             ost = '#p (bar)    T (K)\n'   
             for n, p in enumerate(data_atm.pco): # p in bar in fast_chem
                 ost +=  '{:.3e}'.format(p/1.e6) + '\t' + '{:.1f}'.format(data_atm.Tco[n])  + '\n'
             ost = ost[:-1]
             f.write(ost)
         
-        try: subprocess.check_call(["./fastchem input/config.input"], shell=True, cwd='fastchem_vulcan/') # check_call instead of call can catch the error 
+        try: subprocess.check_call(["./fastchem input/config.input"], shell=True, cwd=fc_dir) # check_call instead of call can catch the error 
         except: print ('\n FastChem cannot run properly. Try compile it by running make under /fastchem_vulcan\n'); raise
            
     def ini_y(self, data_var, data_atm): 
@@ -150,7 +156,8 @@ class InitialAbun(object):
         if vulcan_cfg.ini_mix == 'EQ':
         
             self.ini_fc(data_var, data_atm)
-            fc = np.genfromtxt('fastchem_vulcan/output/vulcan_EQ.dat', names=True, dtype=None, skip_header=0)
+            fc_dir = fastchem_dir()
+            fc = np.genfromtxt(fc_dir + 'output/vulcan_EQ.dat', names=True, dtype=None, skip_header=0)
             for sp in species:
                 if sp in fc.dtype.names:
                     y_ini[:,species.index(sp)] = fc[sp]*gas_tot # this also changes data_var.y because the address of y array has passed to y_ini
@@ -161,7 +168,7 @@ class InitialAbun(object):
                     if compo[compo_row.index(sp)]['e'] != 0: charge_list.append(sp)
             
             # remove the fc output
-            subprocess.call(["rm vulcan_EQ.dat"], shell=True, cwd='fastchem_vulcan/output/')
+            subprocess.call(["rm vulcan_EQ.dat"], shell=True, cwd=fc_dir + 'output/')
                              
         elif vulcan_cfg.ini_mix == 'vulcan_ini':
             print ("Initializing with compositions from the prvious run " + vulcan_cfg.vul_ini)
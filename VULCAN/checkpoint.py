@@ -0,0 +1,134 @@
+# ==============================================================================
+# Checkpoints of a running integration, to resume it later (resume = True or vulcan.py --resume)
+# A checkpoint is the pickled state of var, atm and para (y, t, dt, k, the photochemistry and condensation
+# state, the step history, ...), the state of Integration (photo update frequency, adaptive rtol) and the position
+# of the streamed evolution file. It is written every checkpoint_frq steps, every checkpoint_min minutes,
+# at the end of an unconverged run and on SIGTERM (then the run stops), into a temporary file renamed over the
+# previous checkpoint, so a killed run always leaves a complete one. A small json file next to it
+# (fname + '.json') gives count, t and the input hash without unpickling the state.
+# ==============================================================================
+import os, sys, time, json, pickle, signal
+import vulcan_cfg
+import store
+from chem_funs import spec_list
+
+version = 1
+
+def default_file():
+    # checkpoint_file = '' in vulcan_cfg: output_dir + out_name + '.ckpt'
+    return getattr(vulcan_cfg, 'checkpoint_file', '') or vulcan_cfg.output_dir + vulcan_cfg.out_name + '.ckpt'
+
+def resuming():
+    # resume = True in vulcan_cfg (or vulcan.py --resume) and there is a checkpoint to resume from
+    requested = getattr(vulcan_cfg, 'resume', False) == True or '--resume' in sys.argv
+    return requested and os.path.isfile(default_file())
+
+def remove(fname=None):
+    # removing the checkpoint (after the run has converged)
+    fname = fname or default_file()
+    for f in [fname, fname + '.json']:
+        if os.path.isfile(f): os.remove(f)
+
+class Checkpointer(object):
+    """
+    deciding when to write the checkpoints and catching SIGTERM while integrating
+    """
+    def __init__(self, fname=None, frq=None, minutes=None):
+        self.fname = fname or default_file()
+        self.frq = frq or getattr(vulcan_cfg, 'checkpoint_frq', 1000)
+        self.interval = 60. * (minutes or getattr(vulcan_cfg, 'checkpoint_min', 30.))
+        self.last_time = time.time()
+        self.terminated = False
+        self.prev_handler = None
+
+    def catch_sigterm(self):
+        # only possible in the main thread
+        try: self.prev_handler = signal.signal(signal.SIGTERM, self.on_sigterm)
+        except ValueError: self.prev_handler = None
+
+    def release_sigterm(self):
+        if self.prev_handler != None: signal.signal(signal.SIGTERM, self.prev_handler)
+        self.prev_handler = None
+
+    def on_sigterm(self, signum, frame):
+        # the checkpoint is written after the current step
+        self.terminated = True
+
+    def due(self, para):
+        return self.terminated or para.count % self.frq == 0 or time.time() - self.last_time >= self.interval
+
+    def save(self, var, atm, para, integ):
+        save(self.fname, var, atm, para, integ)
+        self.last_time = time.time()
+
+def state_of(obj):
+    # the attributes of obj without the functions (e.g. var.k_fun, remade by ReadRate when the run is set up)
+    return dict( (k, v) for k, v in vars(obj).items() if not callable(v) and not (isinstance(v, dict) and any(callable(f) for f in v.values())) )
+
+def save(fname, var, atm, para, integ):
+    '''
+    writing the state of the integration into fname (atomically)
+    '''
+    output = integ.output
+    evo = None
+    if getattr(output, 'evo_writer', None) != None:
+        output.evo_writer.flush()
+        evo = {'size': os.path.getsize(output.evo_writer.fname), 'count': output.evo_writer.count}
+
+    photo_sched = None
+    if getattr(integ, 'photo_sched', None) != None:
+        photo_sched = dict( (k, v) for k, v in vars(integ.photo_sched).items() if k != 'odesolver' )
+    state = {'version': version, 'species': list(spec_list), 'nz': vulcan_cfg.nz, 'out_name': vulcan_cfg.out_name,\
+    'input_hash': getattr(vulcan_cfg, 'input_hash', ''), 'var': state_of(var), 'atm': state_of(atm), 'para': state_of(para),\
+    'integ': {'update_photo_frq': getattr(integ, 'update_photo_frq', None), 'loss_criteria': integ.loss_criteria, 'photo_sched': photo_sched},\
+    'rtol': vulcan_cfg.rtol, 'elapsed': time.time() - para.start_time, 'evo': evo}
+
+    folder = os.path.dirname(fname)
+    if folder and not os.path.exists(folder): os.makedirs(folder)
+    tmp = fname + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, fname)
+    finally:
+        if os.path.isfile(tmp): os.remove(tmp)
+
+    meta = {'count': para.count, 't': float(var.t), 'dt': float(var.dt), 'out_name': vulcan_cfg.out_name, 'input_hash': state['input_hash'], 'time': time.time()}
+    with open(tmp, 'w') as f: json.dump(meta, f)
+    os.replace(tmp, fname + '.json')
+    print ('Checkpoint written to ' + fname + ' at step ' + str(para.count) + ' (t = ' + '{:.2e}'.format(var.t) + ' s)')
+
+def load(fname, var, atm, para, integ):
+    '''
+    restoring the state written by save into var, atm, para and integ (after the setup of the run, before integrating)
+    '''
+    with open(fname, 'rb') as f: state = pickle.load(f)
+
+    if state.get('version') != version: raise IOError(fname + ' is not a checkpoint of this VULCAN version.')
+    if state['species'] != list(spec_list) or state['nz'] != vulcan_cfg.nz:
+        raise ValueError('The checkpoint ' + fname + ' was written with a different network or number of layers.')
+    input_hash = getattr(vulcan_cfg, 'input_hash', '')
+    if input_hash and state['input_hash'] and input_hash != state['input_hash']:
+        raise ValueError('The checkpoint ' + fname + ' was written with different inputs (input_hash ' + state['input_hash'] + ').')
+
+    var.__dict__.update(state['var'])
+    # RateCoef is pickled as a plain dict (as in the .vul output): back k with its contiguous array again
+    if not isinstance(var.k, store.RateCoef): var.k = store.RateCoef(var.k)
+    var.cross_version = getattr(var, 'cross_version', 0) + 1 # the cross sections are new arrays
+    atm.__dict__.update(state['atm'])
+    para.__dict__.update(state['para'])
+    para.start_time = time.time() - state['elapsed'] # the wall time counts from the original start
+    vulcan_cfg.rtol = state['rtol']
+
+    if state['integ']['update_photo_frq'] != None: integ.update_photo_frq = state['integ']['update_photo_frq']
+    integ.loss_criteria = state['integ']['loss_criteria']
+    if integ.photo_sched != None and state['integ']['photo_sched'] != None:
+        integ.photo_sched.__dict__.update(state['integ']['photo_sched'])
+
+    # dropping the snapshots streamed after the checkpoint
+    if getattr(integ.output, 'evo_writer', None) != None and state['evo'] != None:
+        integ.output.evo_writer.truncate(state['evo']['size'], state['evo']['count'])
+
+    print ('Resuming from ' + fname + ' at step ' + str(para.count) + ' (t = ' + '{:.2e}'.format(var.t) + ' s)')
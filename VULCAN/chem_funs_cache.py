@@ -0,0 +1,78 @@
+# ==============================================================================
+# Content-addressed cache of the generated chem_funs.py
+# The key is the hash of everything make_chem_funs.py reads: the network file, gibbs_text,
+# com_file, the cfg flags that change the parsing (use_photo), make_chem_funs.py itself and
+# nasa9_table.py (the NASA-9 data are loaded when chem_funs is imported, not written into it).
+# The cached module and its (hash-checked) bytecode are copied into the working directory
+# instead of re-running make_chem_funs.py, e.g. across the temp directories of parallel runs.
+# ==============================================================================
+import os, shutil, hashlib, py_compile, importlib.util
+import vulcan_cfg
+
+ofname = 'chem_funs.py'
+default_dir = '~/.cache/vulcan/chem_funs'
+
+def cache_dir():
+    # chem_funs_cache = None or '' in vulcan_cfg switches the cache off
+    path = getattr(vulcan_cfg, 'chem_funs_cache', default_dir)
+    return os.path.expanduser(path) if path else None
+
+def cache_key():
+    h = hashlib.sha256()
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+    for fname in [vulcan_cfg.network, vulcan_cfg.gibbs_text, vulcan_cfg.com_file, os.path.join(src_dir, 'make_chem_funs.py'), os.path.join(src_dir, 'nasa9_table.py')]:
+        with open(fname, 'rb') as f: h.update(f.read())
+        h.update(b'\0')
+    h.update(('use_photo=' + str(vulcan_cfg.use_photo)).encode())
+    return h.hexdigest()[:24]
+
+def pyc_name():
+    return importlib.util.cache_from_source(ofname)
+
+def restore(key):
+    '''
+    copying the cached chem_funs.py (with its bytecode) and the renumbered network into the working directory.
+    Returns False if there is no entry for key.
+    '''
+    path = cache_dir()
+    if not path: return False
+    entry = os.path.join(path, key)
+    if not os.path.isfile(os.path.join(entry, ofname)): return False
+
+    shutil.copyfile(os.path.join(entry, ofname), ofname)
+    if os.path.isfile(os.path.join(entry, 'chem_funs.pyc')):
+        os.makedirs(os.path.dirname(pyc_name()), exist_ok=True)
+        shutil.copyfile(os.path.join(entry, 'chem_funs.pyc'), pyc_name())
+    # make_chem_funs.py rewrites the network with renumbered reactions
+    with open(os.path.join(entry, 'network.txt')) as f: network = f.read()
+    with open(vulcan_cfg.network) as f:
+        if f.read() != network:
+            with open(vulcan_cfg.network, 'w') as f: f.write(network)
+    print ('chem_funs.py restored from the cache ' + entry)
+
+    return True
+
+def store(key):
+    '''
+    saving the freshly generated chem_funs.py, its bytecode and the renumbered network under key.
+    The entry is also registered under the key of the renumbered network (what the next run reads).
+    Each entry is written into a temporary folder and renamed, so concurrent runs never see a partial entry.
+    '''
+    path = cache_dir()
+    if not path: return
+    try:
+        os.makedirs(path, exist_ok=True)
+        # the bytecode checks the hash of the source (not the mtime), so it stays valid after copying
+        py_compile.compile(ofname, cfile=pyc_name(), invalidation_mode=py_compile.PycInvalidationMode.CHECKED_HASH, doraise=True)
+        for k in sorted(set([key, cache_key()])):
+            entry = os.path.join(path, k)
+            if os.path.isdir(entry): continue
+            tmp = entry + '.' + str(os.getpid()) + '.tmp'
+            os.makedirs(tmp, exist_ok=True)
+            shutil.copyfile(ofname, os.path.join(tmp, ofname))
+            shutil.copyfile(pyc_name(), os.path.join(tmp, 'chem_funs.pyc'))
+            shutil.copyfile(vulcan_cfg.network, os.path.join(tmp, 'network.txt'))
+            try: os.rename(tmp, entry)
+            except OSError: shutil.rmtree(tmp, ignore_errors=True) # another run has stored the same entry
+    except (OSError, py_compile.PyCompileError) as e:
+        print ('Warning: cannot store chem_funs.py in the cache ' + path + ' (' + str(e) + ')')
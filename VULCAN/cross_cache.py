@@ -0,0 +1,124 @@
+# ==============================================================================
+# Cache of the binned cross sections made by ReadRate.make_bins_read_cross
+# The key is the hash of the absorbing and scattering species (with their branches), the bin setting
+# (dbin1, dbin2, dbin_12trans), the wavelength range of the stellar spectrum, the temperature profile
+# and the size/mtime of every cross-section file read.
+# Each entry is one (n_row, nbin) binary array, memory-mapped when loaded, and a json index of its rows,
+# so runs sharing the same network and atmosphere skip all the csv parsing and interpolation.
+# ==============================================================================
+import numpy as np
+import os, json, hashlib
+import vulcan_cfg
+from vulcan_cfg import nz
+
+default_dir = '~/.cache/vulcan/cross'
+# the dictionaries of binned cross sections in var (keyed by sp or by (sp, branch))
+cross_dicts = ['cross', 'cross_J', 'cross_scat', 'cross_T', 'cross_J_T', 'cross_Jion']
+
+def cache_dir():
+    # cross_cache = None or '' in vulcan_cfg switches the cache off
+    path = getattr(vulcan_cfg, 'cross_cache', default_dir)
+    return os.path.expanduser(path) if path else None
+
+def file_stamps(var):
+    # (name, size, mtime) of the files read in make_bins_read_cross
+    fnames = [vulcan_cfg.cross_folder + 'thresholds.txt']
+    for sp in sorted(set.union(var.photo_sp, var.ion_sp)):
+        folder = vulcan_cfg.cross_folder + sp + '/'
+        if os.path.isdir(folder): fnames += [folder + f for f in sorted(os.listdir(folder))]
+    fnames += [vulcan_cfg.cross_folder + 'rayleigh/' + sp + '_scat.txt' for sp in vulcan_cfg.scat_sp]
+    stamps = []
+    for fname in fnames:
+        try:
+            st = os.stat(fname)
+            stamps.append([fname, st.st_size, st.st_mtime_ns])
+        except OSError: stamps.append([fname, None, None]) # make_bins_read_cross reports the missing file
+
+    return stamps
+
+def cache_key(var, atm):
+    photo_sp, ion_sp = sorted(var.photo_sp), sorted(var.ion_sp)
+    setting = {'photo_sp': photo_sp, 'ion_sp': ion_sp, 'scat_sp': list(vulcan_cfg.scat_sp), 'T_cross_sp': list(vulcan_cfg.T_cross_sp),\
+    'n_branch': [var.n_branch[sp] for sp in photo_sp], 'ion_branch': [var.ion_branch[sp] for sp in ion_sp] if vulcan_cfg.use_ion == True else [],\
+    'use_ion': vulcan_cfg.use_ion, 'dbin': [vulcan_cfg.dbin1, vulcan_cfg.dbin2, vulcan_cfg.dbin_12trans],\
+    'bin_range': [float(var.def_bin_min), float(var.def_bin_max)], 'files': file_stamps(var)}
+    h = hashlib.sha256(json.dumps(setting).encode())
+    h.update(np.ascontiguousarray(atm.Tco, dtype=float).tobytes())
+
+    return h.hexdigest()[:24]
+
+def restore(key, var):
+    '''
+    setting the bins and the binned cross sections in var from the cache entry key (as views into the memory-mapped table).
+    Returns False if there is no entry for key.
+    '''
+    path = cache_dir()
+    if not path: return False
+    try:
+        with open(os.path.join(path, key + '.json')) as f: index = json.load(f)
+        tab = np.load(os.path.join(path, key + '.npy'), mmap_mode='r')
+    except (OSError, ValueError): return False
+    if 'bin_range' not in index: return False # an entry written before the bin range was stored: rebuilt
+    tab = np.asarray(tab) # plain (read-only) ndarray views of the memory map
+
+    var.threshold = index['threshold']
+    var.cross_T_sp_list = index['cross_T_sp_list']
+    var.dbin1, var.dbin2 = vulcan_cfg.dbin1, vulcan_cfg.dbin2
+    var.bins = tab[0]
+    var.nbin = len(var.bins)
+    var.cross_version += 1
+    for name in cross_dicts:
+        if name not in index['rows']: continue
+        setattr(var, name, {})
+        for sp, i, start, n_row in index['rows'][name]:
+            rows = tab[start] if n_row == 0 else tab[start:start+n_row]
+            getattr(var, name)[sp if i == None else (sp,i)] = rows
+
+    # all variables that depend on the size of nbins (as in make_bins_read_cross)
+    var.sflux = np.zeros( (nz+1, var.nbin) )
+    var.dflux_u, var.dflux_d = np.zeros( (nz+1, var.nbin) ), np.zeros( (nz+1, var.nbin) )
+    var.aflux = np.zeros( (nz, var.nbin) )
+    var.tau = np.zeros( (nz+1, var.nbin) )
+    var.sflux_top = np.zeros(var.nbin)
+
+    # the same lines as make_bins_read_cross
+    bin_min, bin_max, diss_max = index['bin_range']
+    print ("Input stellar spectrum from " + "{:.1f}".format(var.def_bin_min) + " to " + "{:.1f}".format(var.def_bin_max) )
+    print ("Photodissociation threshold: " + "{:.1f}".format(diss_max) )
+    print ("Using wavelength bins from " + "{:.1f}".format(bin_min) + " to " +  str(bin_max) )
+    print ('Cross sections restored from the cache ' + os.path.join(path, key + '.npy'))
+
+    return True
+
+def store(key, var, bin_range):
+    '''
+    saving the bins and the binned cross sections of var under key, with bin_range = (bin_min, bin_max, diss_max)
+    of make_bins_read_cross (printed again when restored).
+    The table and then the index are written into temporary files and renamed, so concurrent runs never read a partial entry.
+    '''
+    path = cache_dir()
+    if not path: return
+    rows, blocks, start = {}, [np.asarray(var.bins, dtype=float)[np.newaxis,:]], 1
+    for name in cross_dicts:
+        if not hasattr(var, name): continue
+        rows[name] = []
+        for k, v in getattr(var, name).items():
+            sp, i = (k[0], k[1]) if isinstance(k, tuple) else (k, None)
+            v = np.asarray(v, dtype=float)
+            n_row = 0 if v.ndim == 1 else v.shape[0] # 0 for a single (nbin,) row
+            rows[name].append([sp, i, start, n_row])
+            blocks.append(v.reshape(-1, var.nbin))
+            start += max(n_row, 1)
+    index = {'rows': rows, 'bin_range': [float(b) for b in bin_range], 'threshold': dict((str(sp), float(ld)) for sp, ld in var.threshold.items()),\
+    'cross_T_sp_list': dict((sp, [int(T) for T in T_list]) for sp, T_list in var.cross_T_sp_list.items())}
+
+    try:
+        os.makedirs(path, exist_ok=True)
+        tmp = os.path.join(path, key + '.npy.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'wb') as f: np.save(f, np.concatenate(blocks))
+        os.replace(tmp, os.path.join(path, key + '.npy'))
+        tmp = os.path.join(path, key + '.json.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'w') as f: json.dump(index, f)
+        os.replace(tmp, os.path.join(path, key + '.json'))
+    except OSError as e:
+        print ('Warning: cannot store the cross sections in the cache ' + path + ' (' + str(e) + ')')
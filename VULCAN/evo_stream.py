@@ -0,0 +1,71 @@
+# ==============================================================================
+# Appendable on-disk file for the evolution (t_time, y_time) of a run.
+# The snapshots are written in chunks while integrating, so the memory use does not grow
+# with the number of steps and a crashed run still leaves the chunks written so far.
+# Each chunk is an .npz blob (np.savez or np.savez_compressed) with the arrays t (n,) and y (n, nz, ni),
+# preceded by its size as an 8-byte little-endian integer.
+# ==============================================================================
+import numpy as np
+import io, os, struct
+
+magic = b'VULCAN-EVO 1\n'
+
+class EvoWriter(object):
+    """
+    buffering the snapshots and appending them to fname every chunk snapshots
+    """
+    def __init__(self, fname, chunk=50, compress=False, append=False):
+        self.fname, self.chunk, self.compress = fname, chunk, compress
+        self.t_buf, self.y_buf = [], []
+        self.count = 0 # number of snapshots written
+        # append: keeping the file of a run to be resumed (see truncate)
+        if append and os.path.isfile(fname): return
+        with open(fname, 'wb') as f: f.write(magic)
+
+    def append(self, t, y):
+        self.t_buf.append(t)
+        self.y_buf.append(np.array(y)) # a copy of y
+        if len(self.t_buf) >= self.chunk: self.flush()
+
+    def flush(self):
+        if not self.t_buf: return
+        blob = io.BytesIO()
+        if self.compress: np.savez_compressed(blob, t=np.array(self.t_buf), y=np.array(self.y_buf))
+        else: np.savez(blob, t=np.array(self.t_buf), y=np.array(self.y_buf))
+        blob = blob.getvalue()
+        with open(self.fname, 'ab') as f:
+            f.write(struct.pack('<Q', len(blob)) + blob)
+            f.flush()
+            os.fsync(f.fileno())
+        self.count += len(self.t_buf)
+        self.t_buf, self.y_buf = [], []
+
+    def truncate(self, size, count):
+        # going back to a state written before (resuming from a checkpoint): dropping the chunks after size bytes
+        self.t_buf, self.y_buf = [], []
+        with open(self.fname, 'r+b') as f: f.truncate(size)
+        self.count = count
+
+    def close(self):
+        self.flush()
+
+def read_evo(fname):
+    '''
+    reading the evolution file into the arrays (t_time, y_time)
+    an incomplete last chunk (e.g. from a crashed run) is ignored
+    '''
+    t_list, y_list = [], []
+    with open(fname, 'rb') as f:
+        if f.read(len(magic)) != magic: raise IOError(fname + ' is not a VULCAN evolution file.')
+        while True:
+            head = f.read(8)
+            if len(head) < 8: break
+            size = struct.unpack('<Q', head)[0]
+            blob = f.read(size)
+            if len(blob) < size: break
+            data = np.load(io.BytesIO(blob))
+            t_list.append(data['t'])
+            y_list.append(data['y'])
+    if not t_list: return np.array([]), np.array([])
+
+    return np.concatenate(t_list), np.concatenate(y_list)
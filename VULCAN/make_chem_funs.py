@@ -2,11 +2,9 @@
 
 import sys, os
 import numpy as np
+import time
+sys.path.insert(0, os.getcwd()) # vulcan_cfg.py of the run folder (the working directory)
 import vulcan_cfg
-# for constructing the symbolic Jacobian matrix
-from sympy import sin, cos, Matrix
-from sympy import Symbol
-from sympy import lambdify
 
 ofname = 'chem_funs.py'
 gibbs_text = vulcan_cfg.gibbs_text
@@ -650,22 +648,57 @@ def make_Gibbs(re_table, gibbs_text, ofname):
         f.write(gstr)
         
 
+def jac_terms(ni, nr):
+    '''
+    the analytical Jacobian of chemdf derived directly from the mass-action form in re_dict/re_wM_dict (without sympy):
+    reaction j with the rate k[j]*prod(reactants) contributes nu_i * d(rate)/dy[s] to J[i,s], 
+    where d(rate)/dy[s] = n_s * k[j] * y[s]**(n_s-1) * prod(other reactants) for the reactant s appearing n_s times.
+    Returns a dictionary {(i,s): expression string} of the non-zero entries
+    '''
+    species = chemistry.spec_list
+    re_dict, re_wM_dict = chemistry.re_dict, chemistry.re_wM_dict
+    
+    # the coefficients of the monomials of each entry: terms[i,s][(j, n_M, ((species index, power),...))] 
+    terms = {}
+    for j in range(1,nr+1):
+        # net stoichiometric coefficients (without M)
+        nu = {}
+        for sp in re_dict[j][0]: nu[species.index(sp)] = nu.get(species.index(sp), 0) - 1
+        for sp in re_dict[j][1]: nu[species.index(sp)] = nu.get(species.index(sp), 0) + 1
+        nu = dict( (i, c) for i, c in nu.items() if c != 0 )
+        if not nu: continue
+        
+        n_M = re_wM_dict[j][0].count('M')
+        reac = {}
+        for sp in re_wM_dict[j][0]:
+            if sp != 'M': reac[species.index(sp)] = reac.get(species.index(sp), 0) + 1
+        
+        for s, n_s in reac.items():
+            # the derivative of the rate with respect to y[s]
+            mono = dict(reac)
+            mono[s] -= 1
+            if mono[s] == 0: del mono[s]
+            mono = (j, n_M, tuple(sorted(mono.items())))
+            for i, c in nu.items():
+                entry = terms.setdefault((i,s), {})
+                entry[mono] = entry.get(mono, 0) + c*n_s
+    
+    jac = {}
+    for (i,s) in sorted(terms):
+        expr = ''
+        for (j, n_M, mono), c in sorted(terms[i,s].items()):
+            if c == 0: continue # cancelled (e.g. reactions with the same species on both sides)
+            fac = ['M']*n_M + ['k[' + str(j) + ']'] + [ 'y[:,' + str(sp) + ']' + ('**' + str(p) if p > 1 else '') for sp, p in mono ]
+            expr += (' - ' if c < 0 else ' + ') + (str(abs(c)) + '*' if abs(c) != 1 else '') + '*'.join(fac)
+        if expr: jac[i,s] = expr[3:] if expr.startswith(' + ') else '-' + expr[3:]
+    
+    return jac
+
 def make_jac(ni, nr, ofname):
     '''
     to make the analytical Jocobian matrix of chemdf
     '''
-    M = Symbol('M')
-    y, k = [], []
-
-    for i in range(ni):
-        y.append( Symbol('y[:,'+str(i)+']') )
-    for i in range(nr+1):
-        k.append( Symbol('k['+str(i)+']') )
-    
-    # chemistry is the "ofname" module
-    dy = Matrix(chemistry.df(y,M,k))
-    x = Matrix(y)
-    jac = dy.jacobian(x)
+    jac = jac_terms(ni, nr)
 
     jstr = '\ndef symjac(y, M, k): \n'
     jstr += '\t nz = vulcan_cfg.nz\n'.expandtabs(3)
@@ -674,9 +707,8 @@ def make_jac(ni, nr, ofname):
     jstr += '\t for j in range(ni): \n'.expandtabs(3)
     jstr += '\t indx.append( np.arange(j,j+ni*nz,ni) ) \n'.expandtabs(7)
 
-    for i in range(ni):
-        for j in range(ni):
-            jstr += '\t dfdy[indx['.expandtabs(3) + str(i) + '], indx[' + str(j) +']] = ' + str(jac[i,j]) + '\n'
+    for (i,j) in sorted(jac): # dfdy is initialized with zeros
+        jstr += '\t dfdy[indx['.expandtabs(3) + str(i) + '], indx[' + str(j) +']] = ' + jac[i,j] + '\n'
 
     jstr += '\t return dfdy \n\n'.expandtabs(3)
 
@@ -687,18 +719,7 @@ def make_neg_jac(ni, nr, ofname):
     '''
     to make the analytical Jocobian matrix of chemdf
     '''
-    M = Symbol('M')
-    y, k = [], []
-
-    for i in range(ni):
-        y.append( Symbol('y[:,'+str(i)+']') )
-    for i in range(nr+1):
-        k.append( Symbol('k['+str(i)+']') )
-    
-    # chemistry is the "ofname" module
-    dy = Matrix(chemistry.df(y,M,k))
-    x = Matrix(y)
-    jac = dy.jacobian(x)
+    jac = jac_terms(ni, nr)
 
     jstr = '\ndef neg_symjac(y, M, k): \n'
     jstr += '\t nz = vulcan_cfg.nz\n'.expandtabs(3)
@@ -707,22 +728,39 @@ def make_neg_jac(ni, nr, ofname):
     jstr += '\t for j in range(ni): \n'.expandtabs(3)
     jstr += '\t indx.append( np.arange(j,j+ni*nz,ni) ) \n'.expandtabs(7)
 
-    for i in range(ni):
-        for j in range(ni):
-            jstr += '\t dfdy[indx['.expandtabs(3) + str(i) + '], indx[' + str(j) +']] = -(' + str(jac[i,j]) + ')\n'
+    for (i,j) in sorted(jac): # dfdy is initialized with zeros
+        jstr += '\t dfdy[indx['.expandtabs(3) + str(i) + '], indx[' + str(j) +']] = -(' + jac[i,j] + ')\n'
 
     jstr += '\t return dfdy \n\n'.expandtabs(3)
 
+    # the same negative Jacobian in the sparse form for each layer:
+    # only the structurally non-zero entries (neg_jac_row[n], neg_jac_col[n]) are evaluated into the values of shape (nz, nnz)
+    # used to assemble the banded/block lhs without the dense (ni*nz)^2 matrix
+    jac_row = [i for (i,j) in sorted(jac)]
+    jac_col = [j for (i,j) in sorted(jac)]
+
+    jstr += '\n# the sparsity pattern of the chemical Jacobian (' + str(len(jac_row)) + ' non-zero entries out of ni*ni)\n'
+    jstr += 'neg_jac_row = np.array(' + str(jac_row) + ')\n'
+    jstr += 'neg_jac_col = np.array(' + str(jac_col) + ')\n'
+    jstr += '\ndef neg_symjac_sparse(y, M, k): \n'
+    jstr += '\t nz = vulcan_cfg.nz\n'.expandtabs(3)
+    jstr += ('\t val = np.zeros(shape=[nz, ' + str(len(jac_row)) + '])   \n').expandtabs(3)
+
+    for n, (i,j) in enumerate(zip(jac_row, jac_col)):
+        jstr += '\t val[:, '.expandtabs(3) + str(n) + '] = -(' + jac[i,j] + ')\n'
+
+    jstr += '\t return val \n\n'.expandtabs(3)
+
     # save the output function
     with open (ofname, 'a+') as f: f.write(jstr)
-    
+
 def check_conserv():
     from chem_funs import re_dict
     conserv_check = True
     compo = np.genfromtxt(vulcan_cfg.com_file,names=True,dtype=None)
     compo_row = list(compo['species'])
     # Convert bytes to strings
-    compo_row = [sp.decode("utf-8") for sp in compo_row]
+    compo_row = [sp.decode("utf-8") if isinstance(sp, bytes) else str(sp) for sp in compo_row]
     #print (compo_row)
     num_atoms = len(compo.dtype.names) - 2 # dtype.names returns the column names and -2 is for 'species' and 'mass'
  
@@ -801,13 +839,17 @@ def check_duplicate(nr, photo_re_indx):
     
 
 if __name__ == "__main__":   
+    t_start = time.time()
     re_table, photo_table, photo_re_indx = read_network()
     (ni, nr, species) = make_chemdf(re_table, ofname)
     make_Gibbs(re_table, gibbs_text, ofname)
-    # import the "ofname" module as chemistry for make_jac to read df
+    # import the "ofname" module as chemistry for make_jac to read re_dict and re_wM_dict
     chemistry = __import__(ofname[:-3])
+    t_jac = time.time()
     make_jac(ni, nr, ofname) # the last function that writes into chem_funs.py
     make_neg_jac(ni, nr, ofname)
+    t_jac = time.time() - t_jac
+    print (ofname + ' generated in {:.2f} s (Jacobian: {:.2f} s) for '.format(time.time()-t_start, t_jac) + str(ni) + ' species and ' + str(nr) + ' reactions')
     check_conserv()
     check_duplicate(nr, photo_re_indx)
     
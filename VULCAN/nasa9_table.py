@@ -0,0 +1,86 @@
+# ==============================================================================
+# Packed NASA-9 coefficient table: the coefficients of all requested species are
+# read from thermo/NASA9/<sp>.txt once and stored in one binary (n_sp, 2, 10) array
+# (low/high temperature ranges) that is memory-mapped on the following imports of chem_funs
+# ==============================================================================
+import numpy as np
+import os, json, hashlib
+import vulcan_cfg
+
+index_file = 'nasa9_table.json' # the species index and the file mtimes of the current table
+
+def nasa9_dir():
+    # under the data_dir of the active configuration (read at every call, not once at import)
+    return os.path.join(getattr(vulcan_cfg, 'data_dir', ''), 'thermo/NASA9/')
+
+def mtime(sp, path):
+    return os.stat(os.path.join(path, str(sp) + '.txt')).st_mtime_ns
+
+def read_index(path):
+    try:
+        with open(os.path.join(path, index_file)) as f: return json.load(f)
+    except (OSError, ValueError): return None
+
+def build_table(species, path):
+    '''
+    reading the NASA-9 text files of species into an (n_sp, 2, 10) array and writing it (with the index) to path.
+    The array is written under a name made of the hash of its content and the index is replaced atomically,
+    so that runs importing chem_funs at the same time always see a consistent pair.
+    '''
+    species = sorted(species)
+    tab = np.empty((len(species),2,10))
+    for n, sp in enumerate(species):
+        tab[n] = np.loadtxt(os.path.join(path, str(sp) + '.txt')).flatten()[0:20].reshape(2,10)
+    index = {'species': species, 'mtime': [mtime(sp, path) for sp in species]}
+    index['file'] = 'nasa9_table_' + hashlib.sha1(json.dumps(index).encode()).hexdigest()[:12] + '.npy'
+
+    old = read_index(path)
+    try:
+        tmp = os.path.join(path, index['file'] + '.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'wb') as f: np.save(f, tab)
+        os.replace(tmp, os.path.join(path, index['file']))
+        tmp = os.path.join(path, index_file + '.' + str(os.getpid()) + '.tmp')
+        with open(tmp, 'w') as f: json.dump(index, f)
+        os.replace(tmp, os.path.join(path, index_file))
+        if old and old.get('file') != index['file']:
+            try: os.remove(os.path.join(path, old['file']))
+            except OSError: pass
+    except OSError: # e.g. the thermo folder is read-only: using the table in memory
+        print ('Warning: cannot write the NASA-9 table in ' + path)
+
+    return index, tab
+
+def load_table(spec_list, path=None):
+    '''
+    the (n_sp, 2, 10) coefficient array and the species index covering spec_list.
+    The stored table is memory-mapped if it contains all species with unchanged file mtimes,
+    otherwise it is rebuilt (keeping the species already in it)
+    '''
+    if path == None: path = nasa9_dir()
+    index = read_index(path)
+    if index:
+        pos = dict( (sp, n) for n, sp in enumerate(index['species']) )
+        try:
+            if all(sp in pos and index['mtime'][pos[sp]] == mtime(sp, path) for sp in spec_list):
+                return index, np.load(os.path.join(path, index['file']), mmap_mode='r')
+        except (OSError, ValueError): pass
+        # species whose text files were removed are dropped from the rebuilt table
+        species = set(sp for sp in index['species'] if os.path.isfile(os.path.join(path, str(sp) + '.txt')))
+    else: species = set()
+
+    return build_table(species | set(spec_list), path)
+
+def load_nasa9(spec_list, path=None):
+    '''
+    the nasa9 dictionary used in chem_funs: nasa9[sp] (20 coefficients), nasa9[sp,'low'] and nasa9[sp,'high']
+    as views into the packed table
+    '''
+    index, tab = load_table(spec_list, path)
+    pos = dict( (sp, n) for n, sp in enumerate(index['species']) )
+    nasa9 = {}
+    for sp in spec_list:
+        nasa9[sp] = tab[pos[sp]].reshape(20)
+        nasa9[sp,'low'] = tab[pos[sp],0]
+        nasa9[sp,'high'] = tab[pos[sp],1]
+
+    return nasa9
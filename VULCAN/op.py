@@ -14,7 +14,7 @@ from scipy import sparse
 from scipy import interpolate
 import matplotlib.pyplot as plt
 import matplotlib.legend as lg
-import time, os, pickle
+import time, os, sys, pickle, json
 import csv, ast
 # TEST numba
 # from numba import njit, jit
@@ -23,7 +23,9 @@ import csv, ast
 #from collections import defaultdict
 # TODO :test the TODO buldle
 
-import vulcan_cfg
+import vulcan_cfg, vulcan_config
+import cross_cache
+import checkpoint
 try: from PIL import Image
 except ImportError: 
     try: import Image
@@ -31,6 +33,7 @@ except ImportError:
 
 import build_atm
 import chem_funs
+import evo_stream
 from chem_funs import ni, nr  # number of species and reactions in the network
 
 from phy_const import kb, Navo, hc, ag0 # hc is used to convert to the actinic flux
@@ -40,11 +43,24 @@ from vulcan_cfg import nz
 # imported functions 
 chemdf = chem_funs.chemdf
 neg_achemjac = chem_funs.neg_symjac
+neg_achemjac_sparse = chem_funs.neg_symjac_sparse
+neg_jac_row, neg_jac_col = chem_funs.neg_jac_row, chem_funs.neg_jac_col # the sparsity pattern of neg_achemjac_sparse
 compo = build_atm.compo
 compo_row = build_atm.compo_row
 
 species = chem_funs.spec_list
 
+def stoi_matrix():
+    '''
+    the net stoichiometric coefficients (products - reactants, without M) of all reactions from chem_funs.re_dict
+    as a dense (nr x ni) array, where the row j-1 is the reaction j
+    '''
+    stoi = np.zeros((nr,ni))
+    for j in range(1,nr+1):
+        for sp in chem_funs.re_dict[j][0]: stoi[j-1,species.index(sp)] -= 1
+        for sp in chem_funs.re_dict[j][1]: stoi[j-1,species.index(sp)] += 1
+    return stoi
+
 
 class ReadRate(object):
     
@@ -85,6 +101,7 @@ class ReadRate(object):
         
         photo_sp = []
         ion_sp = [] 
+        rate_indx, rate_lind = [], [] # the reactions in the Arrhenius/Lindemann form and the flag for the Lindemann form
                
         with open(vulcan_cfg.network) as f:
             all_lines = f.readlines()
@@ -164,26 +181,18 @@ class ReadRate(object):
                 
                     # Note: make the defaut i=i
                     k_fun[i] = lambda temp, mm, i=i: a[i] *temp**n[i] * np.exp(-E[i]/temp)
-                
-                
-                    if re_tri == False:
-                        k[i] = k_fun[i](Tco, M)
                     
+                    # the rates are evaluated all together in arr_rate after reading the network
+                    rate_indx.append(i)
                     # for 3-body reactions, also calculating k_inf
-                    elif re_tri == True and len(columns)>=6:
-        
+                    if re_tri == True and len(columns)>=6:
         
                         kinf_fun[i] = lambda temp, i=i: a_inf[i] *temp**n_inf[i] * np.exp(-E_inf[i]/temp)
                         k_fun_new[i] = lambda temp, mm, i=i: (a[i] *temp**n[i] * np.exp(-E[i]/temp))/(1 + (a[i] *temp**n[i] * np.exp(-E[i]/temp))*mm/(a_inf[i] *temp**n_inf[i] * np.exp(-E_inf[i]/temp)) ) 
-        
-                        #k[i] = k_fun_new[i](Tco, M)
-                        k_inf = a_inf[i] *Tco**n_inf[i] * np.exp(-E_inf[i]/Tco)
-                        k[i] = k_fun[i](Tco, M)
-                        k[i] = k[i]/(1 + k[i]*M/k_inf )
-        
-        
-                    else: # for 3-body reactions without high-pressure rates
-                        k[i] = k_fun[i](Tco, M)
+                        rate_lind.append(True)
+                        
+                    else: # two-body reactions and 3-body reactions without high-pressure rates
+                        rate_lind.append(False)
                            
 
                     i += 2
@@ -271,6 +280,13 @@ class ReadRate(object):
                     i += 2
                 
         k_fun.update(k_fun_new)
+        
+        # the coefficients in arrays (a_inf, n_inf, E_inf are zero for the reactions without the high-pressure limit)
+        var.rate_indx = np.array(rate_indx, dtype=int)
+        var.rate_lind = np.array(rate_lind, dtype=bool)
+        var.rate_a, var.rate_n, var.rate_E = [np.array([coef[_] for _ in rate_indx], dtype=float) for coef in (a, n, E)]
+        var.rate_a_inf, var.rate_n_inf, var.rate_E_inf = [np.array([coef.get(_, 0.) for _ in rate_indx], dtype=float) for coef in (a_inf, n_inf, E_inf)]
+        k.set_rows(var.rate_indx, self.arr_rate(var, Tco, M))
     
         # store k into data_var
         # remeber k_fun has not removed reactions from remove_list
@@ -284,6 +300,22 @@ class ReadRate(object):
         return var
     
         
+    def arr_rate(self, var, Tco, M):
+        """
+        the rate coefficients of all the reactions in the Arrhenius form k = a T^n exp(-E/T) and the Lindemann form
+        k = k0/(1 + k0 M/k_inf) (3-body reactions with high-pressure rates) in one broadcast over (reactions x layers)
+        the order of the rows follows var.rate_indx 
+        e.g. for a perturbed temperature profile: var.k.set_rows(var.rate_indx, rate.arr_rate(var, Tco_new, M_new))
+        """
+        T = Tco[np.newaxis,:]
+        k = var.rate_a[:,np.newaxis] *T**var.rate_n[:,np.newaxis] * np.exp(-var.rate_E[:,np.newaxis]/T)
+        
+        lind = var.rate_lind
+        k_inf = var.rate_a_inf[lind,np.newaxis] *T**var.rate_n_inf[lind,np.newaxis] * np.exp(-var.rate_E_inf[lind,np.newaxis]/T)
+        k[lind] = k[lind]/(1 + k[lind]*M/k_inf )
+        
+        return k
+    
     def rev_rate(self, var, atm):
         
         rev_list = range(2,  var.stop_rev_indx, 2)
@@ -292,6 +324,8 @@ class ReadRate(object):
             var.k[i] = np.zeros(nz)
        
         Tco = atm.Tco.copy()
+        # the equilibrium constants of all forward reactions at once (the row j-1 is the reaction j)
+        K_eq = self.eq_const(Tco)
         
         # reversing rates and storing into data_var
         print ('Reverse rates from R1 to R' + str(var.stop_rev_indx-2))
@@ -301,7 +335,7 @@ class ReadRate(object):
                  var.k[i] = np.repeat(0.,nz)
             else:
                 var.k_fun[i] = lambda temp, mm, i=i: var.k_fun[i-1](temp, mm)/chem_funs.Gibbs(i-1,temp)
-                var.k[i] = var.k[i-1]/chem_funs.Gibbs(i-1,Tco)
+                var.k[i] = var.k[i-1]/K_eq[i-2]
             
             if np.any(var.k[i] > 1.e-6): print ('R' + str(i) + " " + var.Rf[i-1] +' :  ' + str(np.amax(var.k[i])) )
             if np.any(var.k[i-1] > 1.e-6): print ('R' + str(i-1) + " " + var.Rf[i-1] + ' :  ' + str(np.amax(var.k[i-1])) )        
@@ -309,6 +343,27 @@ class ReadRate(object):
         return var
         
     
+    def gibbs_table(self, Tco):
+        '''
+        g/RT (non-dimensional) of all species as an (ni x nz) array, 
+        from the NASA-9 coefficients of chem_funs.nasa9 stacked into (10 x ni x 1) arrays (same as chem_funs.gibbs_sp)
+        '''
+        a_low = np.array([chem_funs.nasa9[sp,'low'] for sp in species]).T[:,:,np.newaxis]
+        a_high = np.array([chem_funs.nasa9[sp,'high'] for sp in species]).T[:,:,np.newaxis]
+        
+        return chem_funs.g_RT(Tco[np.newaxis,:], a_low, a_high)
+    
+    def eq_const(self, Tco):
+        '''
+        the equilibrium constants of all reactions (nr x nz) from the g/RT table and the net stoichiometry matrix 
+        in a single matrix product (same as chem_funs.Gibbs), where the row j-1 is the reaction j
+        K = exp(-sum(nu*g/RT)) * (kb*T/P0)**(-sum(nu)) for the change of the number of gas molecules
+        '''
+        if not hasattr(self, 'stoi'): self.stoi = stoi_matrix()
+        d_num = self.stoi.sum(axis=1)
+        
+        return np.exp(-(self.stoi @ self.gibbs_table(Tco))) * (chem_funs.corr*Tco[np.newaxis,:])**(-d_num[:,np.newaxis])
+    
     def remove_rate(self, var):
         
         for i in vulcan_cfg.remove_list:
@@ -499,6 +554,10 @@ class ReadRate(object):
         var.cross stores the total absorption cross sections of each species, e.g. var.cross['H2O']
         var.cross stores the IDIVIDUAL photodissociation cross sections for each bracnh, e.g. var.cross_J[('H2O',1)], which is equvilent to var.cross['H2O'] times the branching ratio of branch 1   
         '''
+        # the binned cross sections of the same species, bins and temperature profile from the cache
+        cross_key = cross_cache.cache_key(var, atm)
+        if cross_cache.restore(cross_key, var): return
+        
         photo_sp = list(var.photo_sp)
         ion_sp = list(var.ion_sp)
         absp_sp = photo_sp + ion_sp
@@ -538,7 +597,7 @@ class ReadRate(object):
             # reading in temperature dependent cross sections
             if sp in vulcan_cfg.T_cross_sp: 
                 T_list = []
-                for temp_file in os.listdir("thermo/photo_cross/" + sp + "/"):
+                for temp_file in os.listdir(vulcan_cfg.cross_folder + sp + "/"):
                     if temp_file.startswith(sp) and temp_file.endswith("K.csv"):
                         temp = temp_file
                         temp = temp.replace(sp,''); temp = temp.replace('_cross_',''); temp = temp.replace('K.csv','')
@@ -778,8 +837,65 @@ class ReadRate(object):
             
             for n, ld in enumerate(bins):
                 var.cross_scat[sp][n] = inter_scat(ld)
+        
+        var.cross_version += 1
+        cross_cache.store(cross_key, var, (bin_min, bin_max, diss_max))
                  
 
+def peak_rss():
+    # the peak resident memory (bytes) of this process, or None if unknown
+    try:
+        import resource
+    except ImportError: return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024 # bytes on macOS, kB on Linux
+
+class PhotoScheduler(object):
+    """
+    deciding when to update tau, flux and the photolysis rates after switching to final_update_photo_frq.
+    The update is done every final_update_photo_frq steps only while the last measured actinic flux change (aflux_change) is above flux_cri
+    or the column densities of the absorbers above any level have changed by more than photo_col_tol since the last update,
+    and at least every ini_update_photo_frq steps otherwise.
+    """
+    def __init__(self, odesolver):
+        self.odesolver = odesolver
+        self.min_frq = vulcan_cfg.final_update_photo_frq
+        self.max_frq = max(vulcan_cfg.ini_update_photo_frq, vulcan_cfg.final_update_photo_frq)
+        self.col_tol = getattr(vulcan_cfg, 'photo_col_tol', 0.01)
+        self.tau_min = 1.e-3 # only the columns that are not optically thin (column * peak cross section > tau_min) are checked
+        self.last_count = 0
+        self.col_last = None
+        
+    def columns(self, var, atm):
+        # the column densities above each level (nz, n_sp) of the species in compute_tau, and their peak cross sections
+        w = self.odesolver.tau_cross_arrays(var)
+        if w.get('peak_cross') is None:
+            w['peak_cross'] = np.concatenate((np.amax(w['cross'], axis=1, initial=0.), np.amax(w['cross_T'], axis=(1,2), initial=0.)))
+        col = var.y[:,w['indx']+w['T_indx']] * atm.dz[:,np.newaxis]
+        np.cumsum(col[::-1], axis=0, out=col[::-1])
+        
+        return col, w['peak_cross']
+    
+    def updated(self, var, atm, para):
+        # recording the state at an update of tau, flux and J
+        self.last_count = para.count
+        self.col_last = self.columns(var, atm)[0]
+        para.photo_update_count += 1
+        
+    def due(self, var, atm, para):
+        n = para.count - self.last_count
+        if n < self.min_frq: return False
+        if self.col_last is None or n >= self.max_frq or var.aflux_change > vulcan_cfg.flux_cri: return True
+        
+        col, peak_cross = self.columns(var, atm)
+        thick = self.col_last*peak_cross > self.tau_min
+        if np.any(thick) and np.amax( np.abs(col-self.col_last)[thick]/self.col_last[thick] ) > self.col_tol: return True
+        
+        # counting the updates the fixed final_update_photo_frq would have done
+        if para.count % self.min_frq == 0: para.photo_update_skip += 1
+        return False
+        
+
 class Integration(object):
     """
     time-stepping until the stopping criteria (steady-state) is satisfied
@@ -799,6 +915,11 @@ class Integration(object):
         
         # including photoionisation
         if vulcan_cfg.use_photo == True: self.update_photo_frq = vulcan_cfg.ini_update_photo_frq
+        # skipping the photo updates in the final stage while the atmosphere is not changing
+        self.photo_sched = PhotoScheduler(odesolver) if vulcan_cfg.use_photo == True and getattr(vulcan_cfg, 'use_adapt_photo_frq', False) == True else None
+        # writing checkpoints of the state to resume the run from (checkpoint.py)
+        self.checkpoint = checkpoint.Checkpointer() if getattr(vulcan_cfg, 'use_checkpoint', False) == True else None
+        self.loss_criteria = 0.0005
         
         if vulcan_cfg.use_condense == True:  
             self.non_gas_sp_index = [species.index(sp) for sp in self.non_gas_sp]
@@ -808,7 +929,8 @@ class Integration(object):
     def __call__(self, var, atm, para, make_atm):
         
         use_print_prog, use_live_plot = vulcan_cfg.use_print_prog, vulcan_cfg.use_live_plot
-        self.loss_criteria = 0.0005
+        self.output.write_progress(var, para, 'start')
+        if self.checkpoint != None: self.checkpoint.catch_sigterm()
         
         while not self.stop(var, para, atm): # Looping until the stop condition is satisfied
             
@@ -822,12 +944,17 @@ class Integration(object):
                     print ('update_photo_frq changed to ' + str(vulcan_cfg.final_update_photo_frq) +'\n')
                     para.switch_final_photo_frq = True
             
-            if vulcan_cfg.use_photo == True and para.count % self.update_photo_frq == 0:
+            if self.photo_sched != None and para.switch_final_photo_frq == True: update_photo = self.photo_sched.due(var, atm, para)
+            else: update_photo = vulcan_cfg.use_photo == True and para.count % self.update_photo_frq == 0
+            
+            if update_photo == True:
                 self.odesolver.compute_tau(var, atm)
                 self.odesolver.compute_flux(var, atm)
                 self.odesolver.compute_J(var, atm)
                 if vulcan_cfg.use_ion == True: # photoionisation rate
                     self.odesolver.compute_Jion(var, atm)
+                if self.photo_sched != None: self.photo_sched.updated(var, atm, para)
+                else: para.photo_update_count += 1
                                     
             # integrating one step
             var, para = self.odesolver.one_step(var, atm, para)
@@ -924,6 +1051,16 @@ class Integration(object):
             
             if use_print_prog == True and para.count % vulcan_cfg.print_prog_num==0:
                 self.output.print_prog(var,para)
+            
+            if self.output.progress != None and para.count % self.output.progress_frq == 0:
+                self.output.write_progress(var, para)
+            
+            if self.checkpoint != None and self.checkpoint.due(para):
+                self.checkpoint.save(var, atm, para, self)
+                if self.checkpoint.terminated:
+                    self.checkpoint.release_sigterm()
+                    print ('Terminated (SIGTERM) at step ' + str(para.count) + '. Resume with resume = True in vulcan_cfg.py (or vulcan.py --resume).')
+                    raise SystemExit(128 + 15)
                 
             if vulcan_cfg.use_live_flux == True and vulcan_cfg.use_photo == True and para.count % vulcan_cfg.live_plot_frq ==0:
                 #plt.figure('flux')
@@ -932,8 +1069,13 @@ class Integration(object):
             if use_live_plot == True and para.count % vulcan_cfg.live_plot_frq ==0:
                 #plt.figure('mix')
                 self.output.plot_update(var, atm, para)
-            
-            
+        
+        self.output.write_progress(var, para, 'end')
+        if self.checkpoint != None:
+            self.checkpoint.release_sigterm()
+            # an unconverged run can be continued (e.g. with a larger count_max) from its last state
+            if para.end_case == 1: checkpoint.remove(self.checkpoint.fname)
+            else: self.checkpoint.save(var, atm, para, self)
         
     def backup(self, var):
         var.y_prev = np.copy(var.y)
@@ -1021,14 +1163,14 @@ class Integration(object):
         '''
         st_factor, mtol_conv, atol, yconv_cri, slope_cri, yconv_min =\
          vulcan_cfg.st_factor, vulcan_cfg.mtol_conv, vulcan_cfg.atol, vulcan_cfg.yconv_cri, vulcan_cfg.slope_cri, vulcan_cfg.yconv_min
-        y, ymix, y_time, t_time = var.y.copy(), var.ymix.copy(), var.y_time, var.t_time
+        y, ymix, hist = var.y.copy(), var.ymix.copy(), var.hist
         count = para.count
         
         #slope_min = min( np.amin(atm.Kzz)/np.amax(0.1*atm.Hp)**2 , 1.e-8)
         slope_min = min( np.amin(atm.Kzz/(0.1*atm.Hp[:-1])**2) , 1.e-8)
         slope_min = max(slope_min, 1.e-10)
 
-        indx = np.abs(t_time-var.t*st_factor).argmin()    
+        indx = hist.nearest(var.t*st_factor) # the step with t closest to t*st_factor
         if indx == para.count-1: indx-=1  #Important!! For dt larger than half of the runtime (count-1 is the last one) 
         
         # Don't check more than vulcan_cfg.conv_step (1000) steps back 
@@ -1037,7 +1179,7 @@ class Integration(object):
         # TEST
         if para.count %100==0: print ("conv_indx: "  + str(indx))
         
-        longdy = np.abs((y_time[count-1] - y_time[indx])/np.vstack(atm.n_0))
+        longdy = np.abs((hist.y_at(count-1) - hist.y_at(indx))/np.vstack(atm.n_0))
         longdy[ymix < mtol_conv] = 0
         longdy[y < atol] = 0
         
@@ -1053,7 +1195,7 @@ class Integration(object):
         para.where_varies_most = where_varies_most
          
         longdy = np.amax( longdy[ymix>0]/ymix[ymix>0] )
-        longdydt = longdy/(t_time[-1]-t_time[indx])
+        longdydt = longdy/(hist.t_at(count-1)-hist.t_at(indx))
         # store longdy and longdydt
         var.longdy, var.longdydt = longdy, longdydt
         
@@ -1092,10 +1234,14 @@ class Integration(object):
         para.count += 1
         
         # tmp = list(var.y)
-        #if para.count % self.y_time_freq ==0:
-        var.y_time.append(var.y)
+        var.hist.append(var.y, var.t)
+        # the evolution (y_time, t_time) is only kept every save_evo_frq step for the output and plot_evo
+        if (para.count-1) % vulcan_cfg.save_evo_frq == 0:
+            if self.output.evo_writer != None: self.output.evo_writer.append(var.t, var.y)
+            elif vulcan_cfg.save_evolution == True or vulcan_cfg.use_plot_evo == True:
+                var.y_time.append(var.y.copy())
+                var.t_time.append(var.t)
         #var.ymix_time.append(var.ymix.copy())
-        var.t_time.append(var.t)
     
         # only used in PI_control
         # var.dy_time.append(var.y)
@@ -1427,6 +1573,10 @@ class ODESolver(object):
         self.mtol = vulcan_cfg.mtol
         self.atol = vulcan_cfg.atol
         self.non_gas_sp = vulcan_cfg.non_gas_sp
+        # the defaults of clip, step_ok, step_reject, reset_y and step_size, fixed at the start of the run
+        # (use_adapt_rtol and post_conden_rtol change vulcan_cfg.rtol later but not these)
+        self.pos_cut, self.nega_cut, self.loss_eps, self.rtol = vulcan_cfg.pos_cut, vulcan_cfg.nega_cut, vulcan_cfg.loss_eps, vulcan_cfg.rtol
+        self.dt_var_min, self.dt_var_max, self.dt_min, self.dt_max = vulcan_cfg.dt_var_min, vulcan_cfg.dt_var_max, vulcan_cfg.dt_min, vulcan_cfg.dt_max
         
         if vulcan_cfg.use_condense == True:  
             self.non_gas_sp_index = [species.index(sp) for sp in self.non_gas_sp]
@@ -1434,6 +1584,10 @@ class ODESolver(object):
             
         self.fix_sp_bot_index = [species.index(sp) for sp in vulcan_cfg.use_fix_sp_bot.keys()]
         self.fix_sp_bot_mix = np.array([vulcan_cfg.use_fix_sp_bot[sp] for sp in vulcan_cfg.use_fix_sp_bot.keys()])
+        
+        # the chemical production/loss term: the generated chemdf or the stoichiometry-matrix engine
+        if getattr(vulcan_cfg, 'use_stoich_chemdf', False) == True: self.chemdf = StoichChemdf()
+        else: self.chemdf = chemdf
   
     def diffdf_no_mol(self, y, atm): 
         """
@@ -2442,13 +2596,134 @@ class ODESolver(object):
         +( (vs[-1]>0)*vs[-1] )/dzi[-1]  +( (vm[-1]>0)*vm[-1] )/dzi[-1]
 
         return dfdy
+
+    def lhs_trans_diag(self, var, atm):
+        """
+        the transport (Kzz, vz, Dzz, vm, vs) part of the Jacobian, which only fills the diagonals of the blocks
+        returns the diagonal of the (j,j) blocks (nz,ni), of the (j,j+1) blocks (nz-1,ni) and of the (j+1,j) blocks (nz-1,ni)
+        the same terms as in lhs_jac_tot, lhs_jac_tot_vm, lhs_jac_no_mol, lhs_jac_settling and lhs_jac_settling_vm (selected by vulcan_cfg)
+        """
+        y = var.y
+        # TEST condensation excluding non-gaseous species
+        if vulcan_cfg.use_moldiff == True and vulcan_cfg.use_settling == False and vulcan_cfg.use_vm_mol == False:
+            use_gas_indx = vulcan_cfg.use_condense # lhs_jac_tot uses use_condense
+        else: use_gas_indx = vulcan_cfg.non_gas_sp
+        if use_gas_indx:
+            ysum = np.sum(y[:,atm.gas_indx], axis=1)
+        else: ysum = np.sum(y, axis=1)
+        ysum = ysum[:,np.newaxis]
+        dzi = atm.dzi[:,np.newaxis]
+        
+        # the thickness of each layer: 0.5*(dzi[j-1] + dzi[j]) in the interior and dzi at the bottom and the top
+        dz_ave = np.empty((nz,1))
+        dz_ave[1:-1] = 0.5*(dzi[:-1] + dzi[1:])
+        dz_ave[0], dz_ave[-1] = dzi[0], dzi[-1]
+        
+        diag = np.zeros((nz,ni))
+        up = np.zeros((nz-1,ni)) # the (j,j+1) blocks
+        low = np.zeros((nz-1,ni)) # the (j+1,j) blocks
+        
+        def add_diff(K):
+            # eddy-like diffusion with coefficient K at the interfaces
+            Kf = K/dzi*(ysum[1:]+ysum[:-1])/2.
+            diag[:-1] += -Kf/ysum[:-1]/dz_ave[:-1]
+            diag[1:] += -Kf/ysum[1:]/dz_ave[1:]
+            up[:] += Kf/ysum[1:]/dz_ave[:-1]
+            low[:] += Kf/ysum[:-1]/dz_ave[1:]
+            
+        def add_adv(v_up, v_dn):
+            # upwind advection with the velocity used by the lower (v_up) and the upper (v_dn) layer of each interface
+            diag[:-1] -= (v_up>0)*v_up/dz_ave[:-1]
+            diag[1:] += (v_dn<0)*v_dn/dz_ave[1:]
+            up[:] -= (v_up<0)*v_up/dz_ave[:-1]
+            low[:] += (v_dn>0)*v_dn/dz_ave[1:]
+        
+        vz = atm.vz[:,np.newaxis]
+        add_diff(atm.Kzz[:,np.newaxis])
+        add_adv(vz, vz)
+        
+        if vulcan_cfg.use_moldiff == True:
+            Dzz = atm.Dzz
+            add_diff(Dzz)
             
+            if vulcan_cfg.use_vm_mol == False:
+                # thermal diffusion and the gravitational term
+                Ti, Hpi, g, ms, alpha = atm.Ti[:,np.newaxis], atm.Hpi[:,np.newaxis], atm.g[:,np.newaxis], atm.ms, atm.alpha
+                dT = (atm.Tco[1:]-atm.Tco[:-1])[:,np.newaxis]
+                def Dzz_beta(gi): return Dzz*(-1./Hpi + ms*gi/(Navo*kb*Ti) + alpha/Ti*dT/dzi)
+                # g of the lower layer for the lower cell and g of the upper layer for the upper cell of each interface
+                diag[:-1] += 1./(2.*dz_ave[:-1])*Dzz_beta(g[:-1])
+                diag[1:] += -1./(2.*dz_ave[1:])*Dzz_beta(g[1:])
+                g_up = g[1:].copy(); g_up[0] = g[0]
+                up[:] += 1./(2.*dz_ave[:-1])*Dzz_beta(g_up)
+                g_low = g[:-1].copy(); g_low[-1] = g[-1]
+                low[:] += -1./(2.*dz_ave[1:])*Dzz_beta(g_low)
+            
+            if vulcan_cfg.use_settling == True:
+                add_adv(atm.vs, atm.vs)
+            
+            if vulcan_cfg.use_vm_mol == True:
+                vm = atm.vm
+                vm_up, vm_dn = vm[:-1].copy(), np.vstack((vm[:-2], vm[-1]))
+                # the settling version does not include vm at the bottom
+                if vulcan_cfg.use_settling == True: vm_up[0] = 0.
+                add_adv(vm_up, vm_dn)
+                
+                # diffusion-limited escape
+                if vulcan_cfg.diff_esc: # not empty list
+                    for sp in vulcan_cfg.diff_esc:
+                        if y[-1,species.index(sp)] > 0:
+                            diag[-1,species.index(sp)] += atm.top_flux[species.index(sp)] /y[-1,species.index(sp)]
+        
+        # deposition velocity
+        if vulcan_cfg.use_botflux == True: diag[0] += -1.*atm.bot_vdep /dzi[0]
+        
+        return diag, up, low
+    
+    def lhs_jac_band(self, var, atm):
+        """
+        directly constructing lhs = 1./(r*h)*sparse.identity(ni*nz) - dfdy
+        in the diagonal ordered form of scipy.linalg.solve_banded without the dense (ni*nz)^2 matrix
+        the chemical Jacobian is block diagonal (ni x ni in each layer) and transport only couples the same species
+        in the adjacent layers, so the bandwidth is ni
+        """
+        r = 1. + 1./2.**0.5
+        c0 = 1./(r*var.dt)
+        
+        bw = ni
+        ab = np.zeros((2*bw+1,ni*nz))
+        
+        # the non-zero chemical entries: a[j*ni+p, j*ni+q] is stored in ab[bw+p-q, j*ni+q]
+        val = neg_achemjac_sparse(var.y, atm.M, var.k)
+        ab[bw+neg_jac_row-neg_jac_col, np.arange(nz)[:,np.newaxis]*ni+neg_jac_col] = val
+        ab[bw] += c0
+        
+        diag, up, low = self.lhs_trans_diag(var, atm)
+        ab[bw] -= diag.flatten()
+        ab[0,ni:] -= up.flatten()
+        ab[2*bw,:-ni] -= low.flatten()
+        
+        return (ab, bw)
+    
+    def lhs_jac_block(self, var, atm):
+        """
+        -dfdy in the block-tridiagonal form (without 1./(r*h) on the diagonal, which is added in the factorization)
+        returns the diagonal blocks (nz,ni,ni) and the diagonals of the (j,j+1) and (j+1,j) blocks (nz-1,ni)
+        """
+        blocks = np.zeros((nz,ni,ni))
+        blocks[:, neg_jac_row, neg_jac_col] = neg_achemjac_sparse(var.y, atm.M, var.k)
+        diag, up, low = self.lhs_trans_diag(var, atm)
+        blocks[:, np.arange(ni), np.arange(ni)] -= diag
         
-    def clip(self, var, para, atm, pos_cut = vulcan_cfg.pos_cut, nega_cut = vulcan_cfg.nega_cut):
+        return (blocks, -up, -low)
+    
+    def clip(self, var, para, atm, pos_cut = None, nega_cut = None):
         '''
         function to clip samll and negative values
         and to calculate the particle loss
         '''
+        if pos_cut == None: pos_cut = self.pos_cut
+        if nega_cut == None: nega_cut = self.nega_cut
         y, ymix = var.y, var.ymix.copy()
          
         para.small_y += np.abs(np.sum(y[np.logical_and(y<pos_cut, y>=0)]))
@@ -2486,13 +2761,17 @@ class ODESolver(object):
 
         return data_var
         
-    def step_ok(self, var, para, loss_eps = vulcan_cfg.loss_eps, rtol = vulcan_cfg.rtol):
+    def step_ok(self, var, para, loss_eps = None, rtol = None):
+        if loss_eps == None: loss_eps = self.loss_eps
+        if rtol == None: rtol = self.rtol
         if np.all(var.y>=0) and np.amax( np.abs( np.fromiter(var.atom_loss.values(),float) - np.fromiter(var.atom_loss_prev.values(),float) ) )<loss_eps and para.delta<=rtol:
             return True
         else:
             return False
             
-    def step_reject(self, var, para, loss_eps = vulcan_cfg.loss_eps, rtol = vulcan_cfg.rtol):
+    def step_reject(self, var, para, loss_eps = None, rtol = None):
+        if loss_eps == None: loss_eps = self.loss_eps
+        if rtol == None: rtol = self.rtol
         
         if para.delta > rtol: # truncation error larger than the tolerence value
             para.delta_count += 1
@@ -2521,10 +2800,11 @@ class ODESolver(object):
         
         return False
             
-    def reset_y(self, var, dt_reduc = vulcan_cfg.dt_var_min):
+    def reset_y(self, var, dt_reduc = None):
         '''
         reset y and reduce dt by dt_reduc
         '''
+        if dt_reduc == None: dt_reduc = self.dt_var_min
         
         # reset and store y and dt
         var.y = var.y_prev
@@ -2576,31 +2856,65 @@ class ODESolver(object):
         
         return x
     
-    #@njit
+    def tau_cross_arrays(self, var):
+        '''
+        the cross sections used in compute_tau stacked once (and rebuilt when the absorbers or the cross sections (var.cross_version) change):
+        the T-independent absorbers (photo_sp and ion_sp) and the scattering species (scat_sp) as one (n_sp, nbins) matrix 
+        and the T-dependent absorbers (T_cross_sp) as an (n_T_sp, nz, nbins) tensor
+        '''
+        absp_sp = list(set.union(var.photo_sp,var.ion_sp))
+        T_sp = [sp for sp in absp_sp if sp in vulcan_cfg.T_cross_sp]
+        key = (len(var.bins), tuple(absp_sp), var.cross_version)
+        if getattr(self, 'tau_work', None) == None or self.tau_work['key'] != key:
+            work = {'key': key}
+            sp_list = [sp for sp in absp_sp if sp not in T_sp]
+            work['indx'] = [species.index(sp) for sp in sp_list] + [species.index(sp) for sp in vulcan_cfg.scat_sp]
+            work['cross'] = np.array([var.cross[sp] for sp in sp_list] + [var.cross_scat[sp] for sp in vulcan_cfg.scat_sp]).reshape(len(work['indx']), len(var.bins))
+            work['T_indx'] = [species.index(sp) for sp in T_sp]
+            work['cross_T'] = np.array([var.cross_T[sp] for sp in T_sp]).reshape(len(T_sp), nz, len(var.bins))
+            work['dtau'] = np.zeros((nz, len(var.bins)))
+            self.tau_work = work
+        
+        return self.tau_work
+    
     def compute_tau(self, var, atm):
         ''' compute the optical depth '''
         
-        # reset to zero
-        var.tau.fill(0)
-        # absorption species
-        absp_sp = set.union(var.photo_sp,var.ion_sp)
-            
-        for j in range(nz-1,-1,-1):    
-            for sp in absp_sp:
-                # summing over all T-dependentphoto species
-                if sp in vulcan_cfg.T_cross_sp:
-                    var.tau[j] += var.y[j,species.index(sp)] * atm.dz[j] * var.cross_T[sp][j]  # 1-D shape of nbins from the j level
-                else: # summing over all T-independent photo species    
-                    var.tau[j] += var.y[j,species.index(sp)] * atm.dz[j] * var.cross[sp] # only the j-th laye
-            
-            for sp in vulcan_cfg.scat_sp: # scat_sp are not necessary photo_sp, e.g. He
-                var.tau[j] += var.y[j,species.index(sp)] * atm.dz[j] * var.cross_scat[sp]
-            # adding the layer above at the end of species loop   
-            var.tau[j] += var.tau[j+1]
+        w = self.tau_cross_arrays(var)
+        dtau = w['dtau']
+        
+        # the optical depth of each layer: the number densities times the cross sections summed over all species in one matrix product
+        np.dot(var.y[:,w['indx']], w['cross'], out=dtau)
+        # summing over all T-dependent photo species (cross_T: n_T_sp * nz * nbins)
+        if w['T_indx']: dtau += np.einsum('js,sjb->jb', var.y[:,w['T_indx']], w['cross_T'])
+        dtau *= atm.dz[:,np.newaxis]
+        
+        # adding the layers above: the cumulative sum from the top (tau[nz] = 0 at the top interface)
+        var.tau[nz] = 0.
+        np.cumsum(dtau[::-1], axis=0, out=var.tau[nz-1::-1])
                
-    # Lines like chi = zeta_m**2*tran**2 - zeta_p**2 doing large np 2D array multiplication
-    # can be sped up with cython           
-    def compute_flux(self, var, atm): # Vectorise this loop!  
+    def flux_work_arrays(self, var):
+        '''
+        the (nz, nbins) work arrays of compute_flux, allocated once and reused between calls
+        and the cross sections of the absorbing (photo_sp) and scattering (scat_sp) species stacked as (n_sp, nbins)
+        (restacked when the cross sections are set again, see var.cross_version)
+        '''
+        nbins = len(var.bins)
+        photo_sp = list(var.photo_sp)
+        if getattr(self, 'flux_work', None) == None or self.flux_work['shape'] != (nz, nbins) or self.flux_work['photo_sp'] != photo_sp or self.flux_work['cross_version'] != var.cross_version:
+            work = {'shape': (nz, nbins), 'photo_sp': photo_sp, 'cross_version': var.cross_version}
+            for key in ['tot_abs', 'tot_scat', 'w0', 'delta_tau', 'tran', 'zeta_p', 'zeta_m', 'g_p', 'g_m', 'chi', 'xi', 'phi', 'i_u', 'i_d', 'a', 'b', 'tmp']:
+                work[key] = np.zeros((nz, nbins))
+            work['dir_flux'] = np.zeros((nz+1, nbins))
+            work['abs_indx'] = [species.index(sp) for sp in photo_sp]
+            work['abs_cross'] = np.array([var.cross[sp] for sp in photo_sp]).reshape(len(photo_sp), nbins)
+            work['scat_indx'] = [species.index(sp) for sp in vulcan_cfg.scat_sp]
+            work['scat_cross'] = np.array([var.cross_scat[sp] for sp in vulcan_cfg.scat_sp]).reshape(len(vulcan_cfg.scat_sp), nbins)
+            self.flux_work = work
+        
+        return self.flux_work
+    
+    def compute_flux(self, var, atm):
         # change it to stagerred grids
         # top: stellar flux
         # bottom BC: zero upcoming flux
@@ -2608,126 +2922,156 @@ class ODESolver(object):
         # Note!!! Matej's mu is defined in the outgoing hemisphere so his mu<0
         # My cos[sl_angle] is always 0<=mu<=1
         # Converting my mu to Matej's mu (e.g. 45 deg -> 135 deg)
+        
+        # all (nz, nbins) arrays are written into the preallocated work arrays (flux_work_arrays) 
+        # to avoid allocating ~15 temporary arrays in every call
       
         mu_ang = -1.*np.cos(vulcan_cfg.sl_angle)
         edd = vulcan_cfg.edd
         tau = var.tau
+        w = self.flux_work_arrays(var)
+        tot_abs, tot_scat, w0, delta_tau, tran, zeta_p, zeta_m, g_p, g_m, chi, xi, phi, i_u, i_d, a, b, tmp = \
+        [w[key] for key in ['tot_abs', 'tot_scat', 'w0', 'delta_tau', 'tran', 'zeta_p', 'zeta_m', 'g_p', 'g_m', 'chi', 'xi', 'phi', 'i_u', 'i_d', 'a', 'b', 'tmp']]
         
-        # delta_tau (length nz) is used in the transmission function
-        delta_tau = tau - np.roll(tau,-1,axis=0) # np.roll(tau,-1,axis=0) are the upper layers
-        delta_tau = delta_tau[:-1]
-        
+        # delta_tau (length nz) is used in the transmission function (tau[1:] are the upper layers)
+        np.subtract(tau[:-1], tau[1:], out=delta_tau)
         
         # single-scattering albedo
-        nbins = len(var.bins)
-        tot_abs, tot_scat = np.zeros((nz, nbins)), np.zeros((nz, nbins))
-        for sp in var.photo_sp: 
-            tot_abs += np.vstack(var.ymix[:,species.index(sp)])*var.cross[sp] # nz * nbins
-        for sp in vulcan_cfg.scat_sp: 
-            tot_scat += np.vstack(var.ymix[:,species.index(sp)])*var.cross_scat[sp]
-
-        total = tot_abs + tot_scat
-        
-        w0 = tot_scat  / (tot_abs + tot_scat) # 2D: nz * nbins
-        # tot_abs + tot_scat can be zero when certain gas (e.g. H2) does not exist
-        
-        # Replace nan with zero and inf with very large numbers
-        w0 = np.nan_to_num(w0)
-        
+        # the sums over species as matrix products: (nz, n_sp) x (n_sp, nbins)
+        np.dot(var.ymix[:,w['abs_indx']], w['abs_cross'], out=tot_abs)
+        np.dot(var.ymix[:,w['scat_indx']], w['scat_cross'], out=tot_scat)
+        
+        # w0 = tot_scat / (tot_abs + tot_scat) (2D: nz * nbins)
+        # tot_abs + tot_scat can be zero when certain gas (e.g. H2) does not exist: w0 = 0 there (as nan_to_num did)
+        np.add(tot_abs, tot_scat, out=tmp)
+        w0.fill(0)
+        np.divide(tot_scat, tmp, out=w0, where=tmp>0)
         # to avoit w0=1
-        w0 = np.minimum(w0,1.-1.E-8)
+        np.minimum(w0, 1.-1.E-8, out=w0)
 
         # sflux: the direct beam; dflux: diffusive flux
         ''' Beer's law for the intensity'''
         var.sflux = var.sflux_top *  np.exp(-1.*tau/np.cos(vulcan_cfg.sl_angle) ) 
         # converting the intensity to flux for the raditive transfer calculation
-        dir_flux = var.sflux * np.cos(vulcan_cfg.sl_angle) # need to convert to diffuse flux in the RT definition so it can covert back to total intensity with eps
+        dir_flux = np.multiply(var.sflux, np.cos(vulcan_cfg.sl_angle), out=w['dir_flux']) # need to convert to diffuse flux in the RT definition so it can covert back to total intensity with eps
         
         # scattering
         # the transmission function (length nz)
-        if ag0 == 0: # to save memory
-            tran = np.exp( -1./edd *(1.- w0)**0.5 * delta_tau ) # 2D: nz * nbins
-            zeta_p = 0.5*( 1. + (1.-w0)**0.5 )
-            zeta_m = 0.5*( 1. - (1.-w0)**0.5 )
-            ll = -1.*w0/( 1./mu_ang**2 -1./edd**2 *(1.-w0) )
-            g_p = 0.5*( ll*(1./edd+1./mu_ang) )
-            g_m = 0.5*( ll*(1./edd-1./mu_ang) ) 
-
+        # a = (1-w0)**0.5 for ag0 = 0 and ((1-w0)/(1-w0*ag0))**0.5 otherwise; b = 1-w0*ag0
+        np.subtract(1., w0, out=tmp)
+        if ag0 == 0:
+            np.sqrt(tmp, out=a)
+            # tran = exp(-1/edd * (1-w0)**0.5 * delta_tau)
+            np.multiply(a, delta_tau, out=tran)
+            # ll = -w0/(1/mu**2 - (1-w0)/edd**2)
+            np.multiply(tmp, -1./edd**2, out=b)
+            b += 1./mu_ang**2
+            np.divide(w0, b, out=b)
+            b *= -1.
+            np.multiply(b, 0.5*(1./edd+1./mu_ang), out=g_p)
+            np.multiply(b, 0.5*(1./edd-1./mu_ang), out=g_m)
         else:
-            tran = np.exp( -1./edd *( (1.- w0*ag0)*(1.- w0) )**0.5 * delta_tau )
-            zeta_p = 0.5*( 1. + ((1.-w0)/(1-w0*ag0))**0.5 )
-            zeta_m = 0.5*( 1. - ((1.-w0)/(1-w0*ag0))**0.5 ) 
-            ll = ( (1.-w0)*(1-w0*ag0) - 1.)/( 1./mu_ang**2 -1./edd**2 *(1.-w0)*(1-w0*ag0) )
-            g_p = 0.5*( ll*(1./edd+1/(mu_ang*(1.-w0*ag0))) + w0*ag0*mu_ang/(1.-w0*ag0)  )
-            g_m = 0.5*( ll*(1./edd-1/(mu_ang*(1.-w0*ag0))) - w0*ag0*mu_ang/(1.-w0*ag0)  )
-        
-        
-        # to avoit zero denominator
-        ll = np.minimum(ll, 1.e10)
-        ll = np.maximum(ll, -1.e10)
-        
+            np.multiply(w0, -ag0, out=b)
+            b += 1. # b = 1-w0*ag0
+            np.multiply(tmp, b, out=tran)
+            np.sqrt(tran, out=tran) # ((1-w0)*(1-w0*ag0))**0.5
+            tran *= delta_tau
+            np.divide(tmp, b, out=a)
+            np.sqrt(a, out=a)
+            # ll = ((1-w0)*(1-w0*ag0) - 1)/(1/mu**2 - 1/edd**2*(1-w0)*(1-w0*ag0))
+            tmp *= b
+            np.multiply(tmp, -1./edd**2, out=g_m)
+            g_m += 1./mu_ang**2
+            tmp -= 1.
+            tmp /= g_m # ll
+            # g_p/g_m = 0.5*( ll*(1/edd +/- 1/(mu*(1-w0*ag0))) +/- w0*ag0*mu/(1-w0*ag0) )
+            np.divide(1./mu_ang, b, out=g_p)
+            np.multiply(w0, ag0*mu_ang, out=g_m)
+            g_m /= b
+            b[:] = g_p # 1/(mu*(1-w0*ag0))
+            np.add(b, 1./edd, out=g_p)
+            g_p *= tmp
+            g_p += g_m
+            g_p *= 0.5
+            np.subtract(1./edd, b, out=b)
+            b *= tmp
+            np.subtract(b, g_m, out=g_m)
+            g_m *= 0.5
+        tran *= -1./edd
+        np.exp(tran, out=tran)
+        np.add(1., a, out=zeta_p)
+        zeta_p *= 0.5
+        np.subtract(1., a, out=zeta_m)
+        zeta_m *= 0.5
+        # (the previous clipping of ll to [-1e10, 1e10] was applied after g_p and g_m had been computed and did not change them)
 
         # 2D: nz * nbins
-        chi = zeta_m**2*tran**2 - zeta_p**2
-        xi = zeta_p*zeta_m*(1.-tran**2)
-        phi = (zeta_m**2-zeta_p**2)*tran
+        # chi = zeta_m**2*tran**2 - zeta_p**2
+        np.multiply(zeta_m, tran, out=chi)
+        chi *= chi
+        np.multiply(zeta_p, zeta_p, out=tmp)
+        chi -= tmp
+        # xi = zeta_p*zeta_m*(1.-tran**2)
+        np.multiply(tran, tran, out=xi)
+        np.subtract(1., xi, out=xi)
+        xi *= zeta_p
+        xi *= zeta_m
+        # phi = (zeta_m**2-zeta_p**2)*tran
+        np.multiply(zeta_m, zeta_m, out=phi)
+        phi -= tmp
+        phi *= tran
         
         # 2D: nz * nbins
-        i_u = phi*g_p*dir_flux[:-1] - (xi*g_m+chi*g_p)*dir_flux[1:]
-        i_d = phi*g_m*dir_flux[1:] - (chi*g_m+xi*g_p)*dir_flux[:-1]
+        # i_u = phi*g_p*dir_flux[:-1] - (xi*g_m+chi*g_p)*dir_flux[1:]
+        # i_d = phi*g_m*dir_flux[1:] - (chi*g_m+xi*g_p)*dir_flux[:-1]
         # sflux[1:] are all the layers above and sflux[:-1] are all the layers abelow
+        np.multiply(xi, g_m, out=i_u)
+        np.multiply(chi, g_p, out=tmp)
+        i_u += tmp
+        i_u *= dir_flux[1:]
+        np.multiply(phi, g_p, out=tmp)
+        tmp *= dir_flux[:-1]
+        np.subtract(tmp, i_u, out=i_u)
+        np.multiply(chi, g_m, out=i_d)
+        np.multiply(xi, g_p, out=tmp)
+        i_d += tmp
+        i_d *= dir_flux[:-1]
+        np.multiply(phi, g_m, out=tmp)
+        tmp *= dir_flux[1:]
+        np.subtract(tmp, i_d, out=i_d)
         
         var.zeta_m = zeta_m
         var.zeta_p = zeta_p
         var.tran = tran
 
-        # For testing computating speed
-        #starting recording time
-        #start_time = timeit.default_timer()
-
         # propagating downward layer by layer and then upward
         # var.dflux_d and var.dflux_p are defined at the interfaces (staggerred)
         # the rest is defined in the center of the layer
+        # each sweep is the linear recurrence x[j] = a[j]*x[j+-1] + b[j] with the coefficients for all layers and bins computed at once
+        # (dflux_d uses dflux_u of the previous call and dflux_u uses the new dflux_d)
+        np.divide(phi, chi, out=a)
+        # dflux_d[j] = 1/chi[j]*(phi[j]*dflux_d[j+1] - xi[j]*dflux_u[j] + i_d[j]/mu_ang)
+        np.multiply(xi, var.dflux_u[:-1], out=tmp)
+        np.multiply(i_d, 1./mu_ang, out=b)
+        b -= tmp
+        b /= chi
         for j in range(nz-1,-1,-1): # dflux_d goes from the second top interface (nz+1 interfaces) 
-            var.dflux_d[j] = 1./chi[j]*(phi[j]*var.dflux_d[j+1] - xi[j]*var.dflux_u[j] + i_d[j]/mu_ang )
+            np.multiply(a[j], var.dflux_d[j+1], out=var.dflux_d[j])
+            var.dflux_d[j] += b[j]
+        # dflux_u[j] = 1/chi[j-1]*(phi[j-1]*dflux_u[j-1] - xi[j-1]*dflux_d[j] + i_u[j-1]/mu_ang)
+        np.multiply(xi, var.dflux_d[1:], out=tmp)
+        np.multiply(i_u, 1./mu_ang, out=b)
+        b -= tmp
+        b /= chi
         for j in range(1,nz+1):        
-            var.dflux_u[j] = 1./chi[j-1]*(phi[j-1]*var.dflux_u[j-1] - xi[j-1]*var.dflux_d[j] + i_u[j-1]/mu_ang )
-        
-
-        #print ("time passed...")
-        #print (timeit.default_timer() - start_time)
-                
-        # old
-        # # the average intensity (not flux!) of the direct beam
-#         ave_int = 0.5*( var.sflux[:-1] + var.sflux[1:])
-#         tot_int = (ave_int + 0.5*(var.dflux_u[:-1] + var.dflux_u[1:] + var.dflux_d[1:] + var.dflux_d[:-1]) )/edd
-#         # devided by the Eddington coefficient to recover the intensity
-        
+            np.multiply(a[j-1], var.dflux_u[j-1], out=var.dflux_u[j])
+            var.dflux_u[j] += b[j-1]
         
         # the average flux from the direct beam
         # !!! WITHOUT multiplied by the cos zenith angle (flux per unit area perpendicular to the direction of propagationat) !!! 
         ave_dir_flux = 0.5*( var.sflux[:-1] + var.sflux[1:]) 
         # devided by the Eddington coefficient to recover the total intensity (integrated over all directions)
         tot_flux = ave_dir_flux + 0.5*(var.dflux_u[:-1] + var.dflux_u[1:] + var.dflux_d[1:] + var.dflux_d[:-1])/edd 
-        
-        # For debugging
-        #var.ave_int = ave_int
-        # var.ll = ll
-        # var.chi=chi
-        # var.phi=phi
-        # var.xi = xi
-        # var.i_u = i_u
-        # var.i_d = i_d
-        # var.w0 = w0
-        # var.tot_abs = tot_abs
-        # var.tot_scat = tot_scat
-        # var.tran = tran
-        # var.delta_tau = delta_tau
-        # For debugging
-
-        # if np.any(tot_flux< -1.e-20):
-        #      print (tot_flux[tot_flux<-1.e-20])
-        #      raise IOError ('\nNegative diffusive flux! ')
          
         # store the previous actinic flux into prev_aflux
         var.prev_aflux = np.copy(var.aflux)
@@ -2748,79 +3092,119 @@ class ODESolver(object):
         
         
     
-    def compute_J(self, var, atm): # the vectorized version
+    def J_arrays(self, var, name, sp_list, n_branch, cross, cross_T, rate_index):
         '''
-        computes photodissociation/photoionization rates; including T-dependent cross sections
+        the branch cross sections of sp_list packed once for compute_J (name='J') or compute_Jion (name='Jion'):
+        the T-independent branches as an (n_branches, nbins) matrix and the T-dependent ones (cross_T, for T_cross_sp) 
+        as an (n_T_branches, nz, nbins) tensor, both multiplied by the trapezoid weights of the dbin1/dbin2 grid 
+        rebuilt when the branches, the cross sections (var.cross_version) or the grid change
+        '''
+        if cross_T == None: cross_T = {}
+        rows = [(sp,nbr) for sp in sp_list for nbr in range(1, n_branch[sp]+1)]
+        T_rows = [_ for _ in rows if _[0] in vulcan_cfg.T_cross_sp and _ in cross_T]
+        rows = [_ for _ in rows if _ not in T_rows] + T_rows
+        nbins, i12 = len(var.bins), var.sflux_din12_indx
+        key = (nbins, i12, var.dbin1, var.dbin2, tuple(rows), var.cross_version)
+        
+        if not hasattr(self, 'J_work'): self.J_work = {}
+        if name not in self.J_work or self.J_work[name]['key'] != key:
+            work = {'key': key, 'n1': len(rows) - len(T_rows)}
+            # the trapezoid weights: the same end-point corrections as the previous partial sums of each dbin region
+            w = np.zeros(nbins)
+            w[:i12] += var.dbin1
+            w[0] -= 0.5*var.dbin1
+            w[i12-1] -= 0.5*var.dbin1
+            w[i12:] += var.dbin2
+            w[i12] -= 0.5*var.dbin2
+            w[-1] -= 0.5*var.dbin2
+            
+            work['cross'] = np.array([cross[_] for _ in rows[:work['n1']]]).reshape(work['n1'], nbins) * w
+            work['cross_T'] = np.array([cross_T[_] for _ in T_rows]).reshape(len(T_rows), nz, nbins) * w
+            # J of every branch (rows) and the total J of every species (the sum over branches with the (n_sp, n_branches) matrix sum_br)
+            work['J'], work['J_tot'] = np.zeros((len(rows), nz)), np.zeros((len(sp_list), nz))
+            work['sum_br'] = np.array([[float(_[0] == sp) for _ in rows] for sp in sp_list]).reshape(len(sp_list), len(rows))
+            # the dictionary of J (e.g. var.J_sp) holding views of J and J_tot
+            work['J_sp'] = dict( [(_, work['J'][n]) for n, _ in enumerate(rows)] + [((sp,0), work['J_tot'][n]) for n, sp in enumerate(sp_list)] )
+            # the rate coefficients set by J (except for the reactions in remove_list)
+            work['k_rows'] = [n for n, _ in enumerate(rows) if rate_index[_] not in vulcan_cfg.remove_list]
+            work['k_indx'] = [rate_index[rows[n]] for n in work['k_rows']]
+            self.J_work[name] = work
+        
+        return self.J_work[name]
+    
+    def batch_J(self, var, work):
+        '''
+        J of all branches for all layers as one (n_branches, nbins) x (nbins, nz) product (plus the T-dependent branches)
+        written into the rate coefficients var.k
         '''
         flux = var.aflux
+        n1, J = work['n1'], work['J']
+        np.dot(work['cross'], flux.T, out=J[:n1])
+        if len(J) > n1: J[n1:] = np.einsum('sjb,jb->sj', work['cross_T'], flux)
+        np.dot(work['sum_br'], J, out=work['J_tot'])
         
-        diss_cross = var.cross_J # use the key (sp, branch index) e.g. ("H2O", 1); 1D array 
-        diss_cross_T = var.cross_J_T # 2D array with the shape of nz * bins
-            
-        bins = var.bins
-        n_branch = var.n_branch
-
-        # reset to zeros every time
-        var.J_sp = dict([( (sp,bn) , np.zeros(nz)) for sp in var.photo_sp for bn in range(n_branch[sp]+1) ])
-         
-        for sp in var.photo_sp:
-            # shape: flux (nz,nbin) cross (nbin)
-
-            for nbr in range(1, n_branch[sp]+1): # axis=1 is to sum over all wavelength
-                if sp in vulcan_cfg.T_cross_sp:
-                    var.J_sp[(sp, nbr)] = np.sum( flux[:,:var.sflux_din12_indx] * diss_cross_T[(sp,nbr)][:,:var.sflux_din12_indx] * var.dbin1, axis=1)
-                    var.J_sp[(sp, nbr)] -= 0.5* (flux[:,0] * diss_cross_T[(sp,nbr)][:,0] + flux[:,var.sflux_din12_indx-1] * diss_cross_T[(sp,nbr)][:,var.sflux_din12_indx-1]) * var.dbin1
-                    var.J_sp[(sp, nbr)] += np.sum( flux[:,var.sflux_din12_indx:] * diss_cross_T[(sp,nbr)][:,var.sflux_din12_indx:] * var.dbin2, axis=1)
-                    var.J_sp[(sp, nbr)] -= 0.5* (flux[:,var.sflux_din12_indx] * diss_cross_T[(sp,nbr)][:,var.sflux_din12_indx] + flux[:,-1] * diss_cross_T[(sp,nbr)][:,-1]) * var.dbin2
-                    
-                else:
-                    var.J_sp[(sp, nbr)] = np.sum( flux[:,:var.sflux_din12_indx] * diss_cross[(sp,nbr)][:var.sflux_din12_indx] * var.dbin1, axis=1)
-                    var.J_sp[(sp, nbr)] -= 0.5* (flux[:,0] * diss_cross[(sp,nbr)][0] + flux[:,var.sflux_din12_indx-1] * diss_cross[(sp,nbr)][var.sflux_din12_indx-1]) * var.dbin1
-                    var.J_sp[(sp, nbr)] += np.sum( flux[:,var.sflux_din12_indx:] * diss_cross[(sp,nbr)][var.sflux_din12_indx:] * var.dbin2, axis=1)
-                    var.J_sp[(sp, nbr)] -= 0.5* (flux[:,var.sflux_din12_indx] * diss_cross[(sp,nbr)][var.sflux_din12_indx] + flux[:,-1] * diss_cross[(sp,nbr)][-1]) * var.dbin2
-                
-                # summing over all branches
-                var.J_sp[(sp, 0)] += var.J_sp[(sp, nbr)]
-                # incoperating J into rate coefficients
-                if var.pho_rate_index[(sp, nbr)] not in vulcan_cfg.remove_list:
-                    var.k[ var.pho_rate_index[(sp, nbr)]  ] = var.J_sp[(sp, nbr)] * vulcan_cfg.f_diurnal # f_diurnal = 0.5 for Earth; = 1 for tidally-loced planets
-                                
+        # incoperating J into rate coefficients
+        if work['k_rows']: var.k.set_rows(work['k_indx'], J[work['k_rows']] * vulcan_cfg.f_diurnal) # f_diurnal = 0.5 for Earth; = 1 for tidally-loced planets
+        
+        return work['J_sp']
+    
+    def compute_J(self, var, atm): # the vectorized version
+        '''
+        computes photodissociation/photoionization rates; including T-dependent cross sections
+        var.J_sp[(sp, nbr)] is the rate of branch nbr and var.J_sp[(sp, 0)] the sum of all branches of sp
+        '''
+        work = self.J_arrays(var, 'J', list(var.photo_sp), var.n_branch, var.cross_J, var.cross_J_T, var.pho_rate_index)
+        var.J_sp = self.batch_J(var, work)
      
     def compute_Jion(self, var, atm): 
         '''
         compute the photoionization rate
         haven't considered any temperature dependence yet
         '''
-        flux = var.aflux
-        ion_cross = var.cross_Jion # use the key (sp, br) e.g. ("H2O", 1)
-        
-        bins = var.bins
-        n_branch = var.ion_branch
-
-        # reset to zeros every time
-        var.Jion_sp = dict([( (sp,bn) , np.zeros(nz)) for sp in var.ion_sp for bn in range(n_branch[sp]+1) ])
-
-        for sp in var.ion_sp:
-            # shape: flux (nz,nbin) cross (nbin)
-
-            # convert to actinic flux *1/(hc/ld)
-            for nbr in range(1, n_branch[sp]+1):
-                # axis=1 is to sum over all wavelength 
-                var.Jion_sp[(sp, nbr)] = np.sum( flux[:,:var.sflux_din12_indx] * ion_cross[(sp,nbr)][:var.sflux_din12_indx] * var.dbin1, axis=1)
-                var.Jion_sp[(sp, nbr)] -= 0.5* (flux[:,0] * ion_cross[(sp,nbr)][0]  + flux[:,var.sflux_din12_indx-1] * ion_cross[(sp,nbr)][var.sflux_din12_indx-1]) * var.dbin1
-                var.Jion_sp[(sp, nbr)] += np.sum( flux[:,var.sflux_din12_indx:] * ion_cross[(sp,nbr)][var.sflux_din12_indx:] * var.dbin2, axis=1)
-                var.Jion_sp[(sp, nbr)] -= 0.5* (flux[:,var.sflux_din12_indx] * ion_cross[(sp,nbr)][var.sflux_din12_indx]  + flux[:,-1] * ion_cross[(sp,nbr)][-1]) * var.dbin2
-                
-                # 0 is the total dissociation rate
-                # summing all branches
- 
-                var.Jion_sp[(sp, 0)] += var.Jion_sp[(sp, nbr)]
-                # incoperating J into rate coefficients
-                if var.ion_rate_index[(sp, nbr)] not in vulcan_cfg.remove_list:
-                    var.k[ var.ion_rate_index[(sp, nbr)]  ] = var.Jion_sp[(sp, nbr)] * vulcan_cfg.f_diurnal # f_diurnal = 0.5 for Earth; = 1 for tidally-loced planets        
-                # end of the loop: for sp in var.photo_sp:
+        work = self.J_arrays(var, 'Jion', list(var.ion_sp), var.ion_branch, var.cross_Jion, None, var.ion_rate_index)
+        var.Jion_sp = self.batch_J(var, work)
                      
                     
+class StoichChemdf(object):
+    """
+    the chemical production/loss term dy/dt (same as chem_funs.chemdf) computed from the reaction table
+    re_dict / re_wM_dict: the rates of all reactions (forward and reverse) for all layers in one (nz x nr) 
+    operation and dy/dt = rates @ (sparse stoichiometry matrix)
+    """
+    def __init__(self):
+        
+        re_dict, re_wM_dict = chem_funs.re_dict, chem_funs.re_wM_dict
+        n_reac = max(len(re_wM_dict[j][0]) for j in range(1,nr+1))
+        
+        # the reactants (including M) of reaction j as column indices of [y, M, 1] (the padding column is 1)
+        self.reac_indx = np.full((nr,n_reac), ni+1)
+        for j in range(1,nr+1):
+            for n, sp in enumerate(re_wM_dict[j][0]):
+                self.reac_indx[j-1,n] = ni if sp == 'M' else species.index(sp)
+        
+        # net stoichiometric coefficients (products - reactants, without M)
+        self.stoi = sparse.csr_matrix(stoi_matrix())
+        self.k_arr = np.zeros((nz,nr))
+        self.y_ext = np.ones((nz,ni+2))
+    
+    def rate(self, y, M, k):
+        """
+        the rates of all reactions (nz,nr), where the column j-1 is the reaction j 
+        """
+        if hasattr(k, 'arr'): k_arr = k.arr[1:].T # the contiguous (nr+1,nz) storage of RateCoef
+        else: 
+            k_arr = self.k_arr
+            for j in range(1,nr+1): k_arr[:,j-1] = k[j]
+        self.y_ext[:,:ni] = y
+        self.y_ext[:,ni] = M
+        
+        return k_arr * np.prod(self.y_ext[:,self.reac_indx], axis=2)
+        
+    def __call__(self, y, M, k):
+        
+        return (self.stoi.T @ self.rate(y, M, k).T).T
+      
+   
 class Ros2(ODESolver):
     '''
     class inheritance from ODEsolver for 2nd order Rosenbrock solver 
@@ -2828,6 +3212,11 @@ class Ros2(ODESolver):
     def __init__(self):
         #ODESolver.__init__(self)
         super().__init__()
+        # the (nb, nn) geometry, gather indices and output buffer of store_bandM
+        self.bandM_shape = None
+        self.bandM_dst, self.bandM_src, self.bandM_ab = None, None, None
+        # the block-tridiagonal Jacobian of the current step (reused for the retries with a smaller h)
+        self.lhs_block, self.lhs_block_count, self.lhs_block_y = None, None, None
         
            
     def store_bandM(self, a, nb, nn):
@@ -2837,25 +3226,116 @@ class Ros2(ODESolver):
         a : square block-tridiagonal matirx
         nb: size of the block matrix (number of species)
         nn: number of the block matrices (number of layers)
+        The gather indices are computed once for each (nb, nn) and the output buffer is reused 
+        between steps (ab is overwritten in the next call)
         """
     
         # band width (treat block-banded as banded matrix)
         bw = 2*nb-1 
-        ab = np.zeros((2*bw+1,nb*nn))
-
-        # first 2 columns
-        for i in range(0,2*nb):
-            ab[-(2*nb+i):,i] = a[0:2*nb+i,i]
-    
-        # middle
-        for i in range(2*nb, nn*nb-2*nb):
-            ab[:,i] = a[(i-2*nb+1):(i-2*nb+1)+(2*bw+1),i] 
-    
-        # last 2 columns
-        for ne,i in enumerate(range(nn*nb-2*nb,nn*nb)):
-            ab[:(2*bw+1 -ne),i] = a[-(2*bw+1 -ne):,i]
+        n = nb*nn
+        
+        if self.bandM_shape != (nb, nn):
+            # ab[bw+i-j, j] = a[i,j] 
+            # the first and last bw columns of ab are partly outside a: precomputed flat indices
+            ab_row, col = np.indices((2*bw+1,n))
+            edge = (col < bw) | (col >= n-bw)
+            ab_row, col = ab_row[edge], col[edge]
+            a_row = col + ab_row - bw
+            inside = (a_row >= 0) & (a_row < n)
+            self.bandM_dst = (ab_row*n + col)[inside]
+            self.bandM_src = (a_row*n + col)[inside]
+            self.bandM_ab = np.zeros((2*bw+1,n))
+            self.bandM_shape = (nb, nn)
+        
+        ab = self.bandM_ab
+        a_flat = np.ascontiguousarray(a).reshape(-1)
+        # the middle columns: ab[k, bw+c] = a[c+k, bw+c] is a strided view of a (flat index bw + c*(n+1) + k*n)
+        if n > 2*bw: ab[:,bw:n-bw] = np.lib.stride_tricks.as_strided(a_flat[bw:], shape=(2*bw+1,n-2*bw), strides=(n*a_flat.itemsize,(n+1)*a_flat.itemsize))
+        ab.reshape(-1)[self.bandM_dst] = a_flat[self.bandM_src]
             
         return (ab, bw)
+    
+    def fix_band_rows(self, ab, bw, indx, diag_val):
+        """
+        zero the rows indx of the matrix stored in the diagonal ordered form ab and set their diagonal elements to diag_val
+        (the banded version of lhs[indx,:] = 0; lhs[indx,indx] = diag_val)
+        """
+        indx = np.asarray(indx)
+        if indx.size == 0: return ab
+        # the element (row, row+d) is stored in ab[bw-d, row+d]
+        d = np.arange(-bw, bw+1)
+        col = indx[:,np.newaxis] + d
+        valid = (col >= 0) & (col < ab.shape[1])
+        ab[np.broadcast_to(bw-d, col.shape)[valid], col[valid]] = 0
+        ab[bw, indx] = diag_val
+        
+        return ab
+    
+    def band_factor(self, ab, bw):
+        """
+        LU factorization (LAPACK gbtrf) of the matrix in the diagonal ordered form
+        done once per step and used by band_solve for both stages
+        """
+        lab = np.zeros((3*bw+1, ab.shape[1])) # gbtrf needs bw extra rows for the fill-in
+        lab[bw:] = ab
+        lub, piv, info = scipy.linalg.lapack.dgbtrf(lab, bw, bw)
+        if info > 0: raise np.linalg.LinAlgError("singular matrix")
+        
+        return (lub, piv, bw)
+        
+    def band_solve(self, fac, b):
+        lub, piv, bw = fac
+        x, info = scipy.linalg.lapack.dgbtrs(lub, bw, bw, b, piv)
+        
+        return x
+    
+    def block_thomas_factor(self, blocks, up, low, c0, fix_indx=[]):
+        """
+        block LU (block-Thomas) factorization of the block-tridiagonal lhs = c0*I - dfdy
+        blocks: the (ni x ni) diagonal blocks of -dfdy (nz,ni,ni)
+        up, low: the diagonals of the (j,j+1) and (j+1,j) blocks of -dfdy (nz-1,ni)
+        c0: 1./(r*h)
+        fix_indx: (flattened) rows replaced by c0 on the diagonal (fixed species)
+        """
+        D = blocks.copy()
+        D[:, np.arange(ni), np.arange(ni)] += c0
+        up, low = up.copy(), low.copy()
+        
+        fix_indx = np.asarray(fix_indx, dtype=int)
+        if fix_indx.size > 0:
+            lev, sp = np.divmod(fix_indx, ni)
+            D[lev,sp,:] = 0
+            D[lev,sp,sp] = c0
+            up[lev[lev<nz-1],sp[lev<nz-1]] = 0
+            low[lev[lev>0]-1,sp[lev>0]] = 0
+        
+        # S_j = D_j - diag(low_j-1) S_j-1^-1 diag(up_j-1) and X_j = S_j^-1 diag(up_j)
+        lu, X = [], np.empty((nz-1,ni,ni))
+        for j in range(nz):
+            if j > 0: D[j] -= low[j-1][:,np.newaxis] * X[j-1]
+            lu.append( scipy.linalg.lu_factor(D[j], check_finite=False) )
+            # a zero pivot (lu_factor only warns): failing as band_factor (gbtrf) does
+            if np.any(np.diagonal(lu[j][0]) == 0): raise np.linalg.LinAlgError("singular matrix")
+            if j < nz-1: X[j] = scipy.linalg.lu_solve(lu[j], np.diag(up[j]), check_finite=False)
+        
+        return (lu, X, low)
+        
+    def block_thomas_solve(self, fac, b):
+        """
+        solving lhs x = b with the factors from block_thomas_factor (b is the flattened (nz,ni) vector)
+        """
+        lu, X, low = fac
+        x = b.reshape(nz,ni).copy()
+        
+        # forward elimination
+        for j in range(nz):
+            if j > 0: x[j] -= low[j-1] * x[j-1]
+            x[j] = scipy.linalg.lu_solve(lu[j], x[j], check_finite=False)
+        # back substitution
+        for j in range(nz-2,-1,-1):
+            x[j] -= X[j] @ x[j+1]
+        
+        return x.flatten()
 
     def solver(self, var, atm, para):
         """
@@ -2889,8 +3369,20 @@ class Ros2(ODESolver):
             
         r = 1. + 1./2.**0.5
 
-        df = chemdf(y,M,k).flatten() + diffdf(y, atm).flatten()
-        lhs = jac_tot(var, atm)
+        df = self.chemdf(y,M,k).flatten() + diffdf(y, atm).flatten()
+        
+        lhs_solver = getattr(vulcan_cfg, 'lhs_solver', 'banded')
+        use_band_jac = getattr(vulcan_cfg, 'use_band_jac', False)
+        if lhs_solver == 'block_thomas':
+            # the Jacobian only depends on y (k and atm are unchanged within a step),
+            # so it is reused when the step is retried with a smaller h
+            if not (self.lhs_block_count == para.count and np.array_equal(self.lhs_block_y, y)):
+                self.lhs_block = self.lhs_jac_block(var, atm)
+                self.lhs_block_count, self.lhs_block_y = para.count, y.copy()
+            fix_rows = []
+        # assembling lhs directly in the banded form or the dense matrix
+        elif use_band_jac == True: lhs_b, bw = self.lhs_jac_band(var, atm)
+        else: lhs = jac_tot(var, atm)
         
         # Fixed species including only below the cold trap # TEST 2022
         if vulcan_cfg.use_condense == True and para.fix_species_start == True:
@@ -2902,20 +3394,35 @@ class Ros2(ODESolver):
                     atm.fix_sp_indx[sp] = np.arange(species.index(sp), species.index(sp) + ni*(pfix_indx), ni)
                 
                 df[atm.fix_sp_indx[sp]] = 0
-                lhs[atm.fix_sp_indx[sp],:] = 0
-                lhs[atm.fix_sp_indx[sp],atm.fix_sp_indx[sp]] = 1./(r*h)  # cuz the jacobian func is directly outputing 1./(r*h)*sparse.identity(ni*nz) - dfdy                        
+                if lhs_solver == 'block_thomas': fix_rows.append(atm.fix_sp_indx[sp])
+                elif use_band_jac == True: self.fix_band_rows(lhs_b, bw, atm.fix_sp_indx[sp], 1./(r*h))
+                else:
+                    lhs[atm.fix_sp_indx[sp],:] = 0
+                    lhs[atm.fix_sp_indx[sp],atm.fix_sp_indx[sp]] = 1./(r*h)  # cuz the jacobian func is directly outputing 1./(r*h)*sparse.identity(ni*nz) - dfdy                        
         
         if vulcan_cfg.use_ion == True:
             df[atm.fix_e_indx] = 0
-            lhs[atm.fix_e_indx,:] = 0
-            lhs[atm.fix_e_indx,atm.fix_e_indx] = 1./(r*h)
-        
-        lhs_b, bw = self.store_bandM(lhs,ni,nz)
-        k1_flat = scipy.linalg.solve_banded((bw,bw),lhs_b,df)
+            if lhs_solver == 'block_thomas': fix_rows.append(atm.fix_e_indx)
+            elif use_band_jac == True: self.fix_band_rows(lhs_b, bw, atm.fix_e_indx, 1./(r*h))
+            else:
+                lhs[atm.fix_e_indx,:] = 0
+                lhs[atm.fix_e_indx,atm.fix_e_indx] = 1./(r*h)
+        
+        # factorizing lhs once and using the factors for both k1 and k2
+        if lhs_solver == 'block_thomas':
+            if fix_rows: fix_rows = np.concatenate(fix_rows)
+            lhs_fac = self.block_thomas_factor(*self.lhs_block, 1./(r*h), fix_rows)
+            lhs_solve = self.block_thomas_solve
+        else:
+            if use_band_jac == False: lhs_b, bw = self.store_bandM(lhs,ni,nz)
+            lhs_fac = self.band_factor(lhs_b, bw)
+            lhs_solve = self.band_solve
+            
+        k1_flat = lhs_solve(lhs_fac, df)
         k1 = k1_flat.reshape(y.shape)
         
         yk2 = y + k1/r
-        df = chemdf(yk2,M,k).flatten() + diffdf(yk2, atm).flatten()
+        df = self.chemdf(yk2,M,k).flatten() + diffdf(yk2, atm).flatten()
         
         # TEST condensation
         # Fixed species
@@ -2926,7 +3433,7 @@ class Ros2(ODESolver):
             df[atm.fix_e_indx] = 0
             
         rhs = df - 2./(r*h)*k1_flat
-        k2 = scipy.linalg.solve_banded((bw,bw),lhs_b,rhs)
+        k2 = lhs_solve(lhs_fac, rhs)
         k2 = k2.reshape(y.shape)
         
         sol = y + 3./(2.*r)*k1 + 1/(2.*r)*k2
@@ -3027,7 +3534,7 @@ class Ros2(ODESolver):
     
         r = 1. + 1./2.**0.5
 
-        df = chemdf(y,M,k).flatten() + diffdf(y, atm).flatten()
+        df = self.chemdf(y,M,k).flatten() + diffdf(y, atm).flatten()
         lhs = jac_tot(var, atm)
         
         lhs_b, bw = self.store_bandM(lhs,ni,nz)
@@ -3036,7 +3543,7 @@ class Ros2(ODESolver):
         k1 = k1_flat.reshape(y.shape)
         
         yk2 = y + k1/r
-        df = chemdf(yk2,M,k).flatten() + diffdf(yk2, atm).flatten()
+        df = self.chemdf(yk2,M,k).flatten() + diffdf(yk2, atm).flatten()
         
         rhs = df - 2./(r*h)*k1_flat
         k2 = scipy.linalg.solve_banded((bw,bw),lhs_b,rhs)
@@ -3102,10 +3609,14 @@ class Ros2(ODESolver):
                   
         return var, para                    
         
-    def step_size(self, var, para, dt_var_min = vulcan_cfg.dt_var_min, dt_var_max = vulcan_cfg.dt_var_max, dt_min = vulcan_cfg.dt_min, dt_max = vulcan_cfg.dt_max):  
+    def step_size(self, var, para, dt_var_min = None, dt_var_max = None, dt_min = None, dt_max = None):  
         """
         step-size control by delta(truncation error) for the Rosenbrock method
         """
+        if dt_var_min == None: dt_var_min = self.dt_var_min
+        if dt_var_max == None: dt_var_max = self.dt_var_max
+        if dt_min == None: dt_min = self.dt_min
+        if dt_max == None: dt_max = self.dt_max
         h = var.dt
         delta = para.delta
         rtol = vulcan_cfg.rtol
@@ -3146,6 +3657,37 @@ class Output(object):
             
             print ('Warning... the output file: ' + str(out_name) + ' already exists.\n')
         
+        self.open_progress()
+        
+        # streaming the evolution (every save_evo_frq step) into output_dir + out_name + '.evo' while integrating
+        self.evo_writer = None
+        if vulcan_cfg.save_evolution == True and getattr(vulcan_cfg, 'evo_stream', False) == True:
+            self.evo_writer = evo_stream.EvoWriter(output_dir + out_name + '.evo', chunk=getattr(vulcan_cfg, 'evo_chunk', 50), compress=getattr(vulcan_cfg, 'evo_compress', False), append=checkpoint.resuming())
+        
+    def open_progress(self):
+        # the progress records (json lines) go to progress_file: '' for none, '-' for stdout (mixed with the log)
+        self.progress_frq = getattr(vulcan_cfg, 'progress_frq', 100)
+        fname = getattr(vulcan_cfg, 'progress_file', '')
+        if not fname: self.progress = None
+        elif fname == '-': self.progress = sys.stdout
+        else: self.progress = open(fname, 'a', buffering=1)
+    
+    def write_progress(self, var, para, event='step'):
+        '''
+        writing one progress record (a json object on one line, starting with "event"):
+        event is 'start', 'step' or 'end' (with end_case 1: converged, 2: runtime or 3: count_max exceeded)
+        '''
+        if self.progress == None: return
+        rec = {'event': event, 'out_name': vulcan_cfg.out_name, 'count': para.count, 'count_max': vulcan_cfg.count_max,\
+        't': float(var.t), 'dt': float(var.dt), 'longdy': float(var.longdy), 'longdydt': float(var.longdydt),\
+        'aflux_change': float(var.aflux_change), 'yconv_cri': vulcan_cfg.yconv_cri,\
+        'rejections': {'nega': para.nega_count, 'loss': para.loss_count, 'delta': para.delta_count},\
+        'wall': time.time() - para.start_time, 'peak_rss': peak_rss()}
+        if event == 'end': rec['end_case'] = para.end_case
+        self.progress.write(json.dumps(rec) + '\n')
+        self.progress.flush()
+        if event == 'end' and self.progress is not sys.stdout: self.progress.close()
+    
     def print_prog(self, var, para):
         indx_max = np.nanargmax(para.where_varies_most)
         print ('Elapsed time: ' +"{:.2e}".format(var.t) + ' || Step number: ' + str(para.count) + '/' + str(vulcan_cfg.count_max) ) 
@@ -3158,6 +3700,8 @@ class Output(object):
         print ("After ------- %s seconds -------" % ( time.time()- para.start_time ) + ' s CPU time') 
         print (vulcan_cfg.out_name[:-4] + ' has successfully run to steady-state with ' + str(para.count) + ' steps and ' + str("{:.2e}".format(var.t)) + ' s' )
         print ('long dy = ' + f"{var.longdy:.6e}" + ' and long dy/dt = ' + f"{var.longdydt:.6e}" )
+        if vulcan_cfg.use_photo == True:
+            print ('photo updates (tau, flux and J): ' + str(para.photo_update_count) + ' done and ' + str(para.photo_update_skip) + ' skipped')
         
         print ('total atom loss:')
         for atom in vulcan_cfg.atom_list: 
@@ -3208,9 +3752,11 @@ class Output(object):
             print( 'Directory ' , output_dir,  " created.")
             os.mkdir(output_dir)
 
-        # copy the vulcan_cfg.py file
-        with open('vulcan_cfg.py' ,'r') as f:
-            cfg_str = f.read()
+        # copy the vulcan_cfg.py file (or the source of the active configuration object)
+        if vulcan_config.active != None: cfg_str = vulcan_config.active.source
+        else:
+            with open('vulcan_cfg.py' ,'r') as f:
+                cfg_str = f.read()
         with open(dname + '/' + output_dir + "cfg_" + out_name[:-3] + "txt", 'w') as f: f.write(cfg_str)
     
     def save_out(self, var, atm, para, dname): 
@@ -3222,6 +3768,11 @@ class Output(object):
             print( 'Directory ' , output_dir,  " created.")
             os.mkdir(output_dir)
             
+        if self.evo_writer != None:
+            self.evo_writer.close()
+            # reading the streamed evolution back only for plotting
+            if vulcan_cfg.use_plot_evo == True: var.t_time, var.y_time = evo_stream.read_evo(self.evo_writer.fname)
+        
         # convert lists into numpy arrays
         for key in var.var_evol_save:
             as_nparray = np.array(getattr(var, key))
@@ -3239,20 +3790,24 @@ class Output(object):
         
         for key in var.var_save:
             var_save[key] = getattr(var, key)
-        if vulcan_cfg.save_evolution == True:
-            # slicing time-sequential data to reduce ouput filesize
-            fq = vulcan_cfg.save_evo_frq
+        if self.evo_writer != None:
+            # y_time and t_time are in the .evo file (evo_stream.read_evo)
+            var_save['evo_file'] = os.path.basename(self.evo_writer.fname)
+        elif vulcan_cfg.save_evolution == True:
+            # time-sequential data (already recorded every save_evo_frq step in save_step)
             for key in var.var_evol_save:
-                as_nparray = getattr(var, key)[::fq]
-                setattr(var, key, as_nparray)
                 var_save[key] = getattr(var, key)
 
+        out = {'variable': var_save, 'atm': vars(atm), 'parameter': vars(para)}
+        # the hash of the inputs given by the campaign runners (to skip the runs with unchanged inputs)
+        if getattr(vulcan_cfg, 'input_hash', ''): out['input_hash'] = vulcan_cfg.input_hash
+        
         with open(output_file, 'wb') as outfile:
             if vulcan_cfg.output_humanread == True: # human-readable form, less efficient 
-                outfile.write(str({'variable': var_save, 'atm': vars(atm), 'parameter': vars(para)}))
+                outfile.write(str(out))
             else:
                 # the protocol must be <= 2 for python 2.X
-                pickle.dump( {'variable': var_save, 'atm': vars(atm), 'parameter': vars(para) }, outfile, protocol=4)
+                pickle.dump(out, outfile, protocol=4)
                 # how to add  'config': vars(vulcan_cfg) ?
         
             
@@ -4,12 +4,37 @@ import yaml
 import os
 import subprocess
 
-def create_vulcan_cfg(config_file):
+def data_path(path, root):
+    # the input files are given relative to the VULCAN folder (boundary_conditions/ relative to the folder of the bc files)
+    if not root or os.path.isabs(path): return path
+    return os.path.join(root, path).replace(os.sep, '/')
+
+def render_cfg(config_file, data_dir=None, bc_dir=None, network=None, progress_file='', input_hash='', vul_ini='', dttry=None, resume=False):
+    '''
+    the text of vulcan_cfg.py for the yaml config_file.
+    data_dir: the (read-only) folder with thermo/, atm/ and fastchem_vulcan/ shared by the runs; None: the working directory.
+    bc_dir: the folder of the boundary-condition files (boundary_conditions/ in the yaml files).
+    network: the path of the network file (default: the one in the yaml file, under data_dir)
+    progress_file: where the json-lines progress records go ('' for none, '-' for stdout)
+    input_hash: the hash of the inputs saved in the output
+    vul_ini: a .vul output to initialize the abundances from (ini_mix = 'vulcan_ini'); '': the const_mix of the yaml file
+    dttry: the starting timestep (default: 1.E-10)
+    resume: continuing from the checkpoint of the run (if any)
+    '''
     with open(config_file, 'r') as f:
         conf = yaml.safe_load(f)
     
+    data_dir = os.path.abspath(data_dir).replace(os.sep, '/') if data_dir else ''
+    if network == None: network = data_path(conf['chemistry']['network'], data_dir)
+    bot_BC_flux_file = conf['chemistry']['bot_BC_flux_file']
+    if bc_dir and bot_BC_flux_file.startswith('boundary_conditions/'):
+        bot_BC_flux_file = data_path(bot_BC_flux_file[len('boundary_conditions/'):], os.path.abspath(bc_dir))
+    
     # Convert const_mix dict to string representation for python file
     const_mix_str = str(conf['atmosphere']['const_mix'])
+    # warm start from a previous run
+    ini_mix = 'vulcan_ini' if vul_ini else 'const_mix'
+    dttry = repr(float(dttry)) if dttry else '1.E-10'
     
     cfg_content = f"""# =============================================================================
 # Configuration file of VULCAN (Auto-generated from {config_file})
@@ -19,16 +44,19 @@ def create_vulcan_cfg(config_file):
 atom_list = ['H', 'O', 'C', 'N', 'S']
 
 # ====== Setting up paths and filenames ======
-network = '{conf['chemistry']['network']}'
+data_dir = '{data_dir}' # the folder with thermo/, atm/ and fastchem_vulcan/ ('': the working directory)
+network = '{network}'
 use_lowT_limit_rates = False
-gibbs_text = 'thermo/gibbs_text.txt'
-cross_folder = 'thermo/photo_cross/'
-com_file = 'thermo/all_compose.txt'
-atm_file = '{conf['atmosphere']['atm_file']}'
-sflux_file = '{conf['star']['sflux_file']}'
-top_BC_flux_file = 'atm/BC_top.txt'
-bot_BC_flux_file = '{conf['chemistry']['bot_BC_flux_file']}'
-vul_ini = 'output/'
+gibbs_text = '{data_path('thermo/gibbs_text.txt', data_dir)}'
+cross_folder = '{data_path('thermo/photo_cross/', data_dir)}'
+com_file = '{data_path('thermo/all_compose.txt', data_dir)}'
+chem_funs_cache = '~/.cache/vulcan/chem_funs' # the shared folder for the generated chem_funs.py keyed by the hash of the network, gibbs_text and com_file (None: always re-make)
+atm_file = '{data_path(conf['atmosphere']['atm_file'], data_dir)}'
+sflux_file = '{data_path(conf['star']['sflux_file'], data_dir)}'
+top_BC_flux_file = '{data_path('atm/BC_top.txt', data_dir)}'
+bot_BC_flux_file = '{bot_BC_flux_file}'
+vul_ini = '{vul_ini or 'output/'}'
+input_hash = '{input_hash}' # the hash of the inputs saved in the output under 'input_hash' (set by the campaign runners)
 output_dir = 'output/'
 plot_dir = 'plot/'
 movie_dir = 'plot/movie/'
@@ -41,7 +69,7 @@ C_H = 2.7761E-4
 N_H = 8.1853E-5
 S_H = 1.3183E-5
 He_H = 0.09692
-ini_mix = 'const_mix'
+ini_mix = '{ini_mix}'
 fastchem_met_scale = 1.
 
 use_ini_cold_trap = True
@@ -63,8 +91,11 @@ edd = 0.5
 dbin1 = 0.1
 dbin2 = 2.
 dbin_12trans = 240.
+cross_cache = '~/.cache/vulcan/cross' # the shared folder for the binned cross sections keyed by the species, bins, stellar wavelength range and T profile (None: always read the csv files)
 ini_update_photo_frq = 100
 final_update_photo_frq = 5
+use_adapt_photo_frq = False
+photo_col_tol = 0.01
 
 # ====== Setting up ionchemistry ======
 use_ion = False
@@ -126,10 +157,15 @@ conv_step = 500
 
 # ====== Setting up numerical parameters for the ODE solver ====== 
 ode_solver = 'Ros2' # case sensitive
+use_band_jac = True # assemble the Ros2 lhs directly in the banded form (no dense (ni*nz)^2 Jacobian)
+lhs_solver = 'banded' # 'banded': LAPACK banded LU; 'block_thomas': block-tridiagonal LU over the nz layers
+use_stoich_chemdf = True # compute the chemical dy/dt from the stoichiometry matrix of re_dict (False: the generated chem_funs.chemdf)
 use_print_prog = True
 use_print_delta = False
 print_prog_num = 500  # print the progress every x steps 
-dttry = 1.E-10
+progress_file = '{progress_file}' # json-lines progress records (count, t, dt, longdy, ...): '' for none, '-' for stdout
+progress_frq = 100 # write a progress record every x steps
+dttry = {dttry}
 trun_min = 1e2
 runtime = 1.E22
 dt_min = 1.E-14
@@ -180,31 +216,90 @@ output_humanread = False
 use_shark = False
 save_evolution = False   # save the evolution of chemistry (y_time and t_time) for every save_evo_frq step
 save_evo_frq = 10
+evo_stream = True   # with save_evolution: write y_time and t_time into output_dir + out_name + '.evo' during the run (read with evo_stream.read_evo) instead of keeping them in memory
+evo_chunk = 50   # number of snapshots written at once
+evo_compress = False   # zlib-compress the chunks
+# checkpoint/restart (checkpoint.py):
+use_checkpoint = True   # write the state of the integration into checkpoint_file every checkpoint_frq steps, every checkpoint_min minutes, at the end of an unconverged run and on SIGTERM
+checkpoint_frq = 1000
+checkpoint_min = 30.
+checkpoint_file = ''   # '' for output_dir + out_name + '.ckpt'
+resume = {resume}   # continue from checkpoint_file if it exists (also vulcan.py --resume)
 """
+    return cfg_content
+
+def create_vulcan_cfg(config_file, data_dir=None, bc_dir=None, progress_file='', input_hash='', vul_ini='', dttry=None, resume=False):
+    '''
+    writing vulcan_cfg.py in the working directory (the run folder); see render_cfg for the other arguments
+    '''
+    network = None
+    if data_dir:
+        # make_chem_funs.py rewrites the network with renumbered reactions: using a copy in the run folder
+        with open(config_file, 'r') as f: network = yaml.safe_load(f)['chemistry']['network']
+        shutil.copyfile(data_path(network, data_dir), os.path.basename(network))
+        network = os.path.basename(network)
+    
     with open('vulcan_cfg.py', 'w') as f:
-        f.write(cfg_content)
+        f.write(render_cfg(config_file, data_dir, bc_dir, network, progress_file, input_hash, vul_ini, dttry, resume))
     print(f"Generated vulcan_cfg.py from {config_file}")
 
+def run_in_process(config_files, data_dir=None, bc_dir=None, progress_file=''):
+    '''
+    running the yaml config_files one after another in this process, each with its own vulcan_config.Config.
+    vulcan_cfg.py is only written once (from the first file) to make chem_funs.py, so all files must use the same network.
+    '''
+    create_vulcan_cfg(config_files[0], data_dir, bc_dir, progress_file)
+    sys.path.insert(0, os.getcwd())
+    import vulcan, vulcan_config # making (or restoring) chem_funs.py for the network
+    for config_file in config_files:
+        print(f"Running VULCAN for {config_file}...")
+        cfg = vulcan_config.Config.from_yaml(config_file, data_dir, bc_dir)
+        cfg.progress_file = progress_file
+        vulcan.run(cfg)
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python run_case.py <config_yaml>")
+    # positional arguments: the yaml files; options: --data-dir <dir>, --bc-dir <dir>, --progress <file or ->, --input-hash <hash>, --vul-ini <file>, --dttry <s>, --resume and --in-process
+    config_files, opts, argv = [], {}, sys.argv[1:]
+    while argv:
+        arg = argv.pop(0)
+        if arg in ('--in-process', '--resume'): opts[arg] = True
+        elif arg.startswith('--') and argv: opts[arg] = argv.pop(0)
+        else: config_files.append(arg)
+    
+    if not config_files:
+        print("Usage: python run_case.py <config_yaml> [<config_yaml> ...] [--data-dir <VULCAN folder>] [--bc-dir <boundary-condition folder>] [--progress <file or ->] [--input-hash <hash>] [--vul-ini <.vul file> [--dttry <s>]] [--resume] [--in-process]")
+        print("With --data-dir, the working directory is the run folder (vulcan_cfg.py, chem_funs.py, output/ and plot/) and the input data are read from the data folder.")
+        print("With several yaml files or --in-process, the cases run one after another in this Python process.")
+        print("With --progress, VULCAN writes json-lines progress records into the file (- for stdout).")
+        print("With --input-hash, the hash of the inputs (computed by the campaign runners) is saved in the output.")
+        print("With --vul-ini, the abundances are initialized from a previous output (warm start) with the starting timestep --dttry.")
+        print("With --resume, the run continues from its checkpoint in output/ (if any), e.g. after it was stopped by SIGTERM.")
         sys.exit(1)
     
-    config_file = sys.argv[1]
+    data_dir, bc_dir, progress_file = opts.get('--data-dir'), opts.get('--bc-dir'), opts.get('--progress', '')
+    input_hash, vul_ini, dttry = opts.get('--input-hash', ''), opts.get('--vul-ini', ''), opts.get('--dttry')
+    if vul_ini: vul_ini = os.path.abspath(vul_ini).replace(os.sep, '/')
+    resume = bool(opts.get('--resume'))
+    exit_code = 0
     # Backup original cfg
     if os.path.exists('vulcan_cfg.py') and not os.path.exists('vulcan_cfg.py.bak'):
         shutil.copy('vulcan_cfg.py', 'vulcan_cfg.py.bak')
     
     try:
-        create_vulcan_cfg(config_file)
-        print("Running VULCAN...")
-        # Run vulcan.py
-        subprocess.run([sys.executable, '-u', 'vulcan.py'], check=True)
+        if len(config_files) > 1 or opts.get('--in-process'):
+            run_in_process(config_files, data_dir, bc_dir, progress_file)
+        else:
+            create_vulcan_cfg(config_files[0], data_dir, bc_dir, progress_file, input_hash, vul_ini, dttry, resume)
+            print("Running VULCAN...")
+            # Run vulcan.py (from the VULCAN folder) in the working directory
+            subprocess.run([sys.executable, '-u', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'vulcan.py')], check=True)
         
     except Exception as e:
         print(f"Error: {e}")
+        exit_code = 1 # reported to the campaign runners
     finally:
         # Restore
         if os.path.exists('vulcan_cfg.py.bak'):
             shutil.move('vulcan_cfg.py.bak', 'vulcan_cfg.py')
             print("Restored original vulcan_cfg.py")
+    sys.exit(exit_code)
@@ -12,6 +12,90 @@ import vulcan_cfg
 from vulcan_cfg import nz
 from chem_funs import ni, nr, spec_list  # number of species and reactions in the network
 
+class RateCoef(dict):
+    """
+    rate coefficients backed by one contiguous array arr of shape (nr+1, nz)
+    behaves as the dict {i: k_i} used throughout VULCAN: k[i] is a view of the row arr[i] 
+    (so k[i][mask] = ... modifies arr in place) and k[i] = value copies value into the row
+    pickled as a plain dict of arrays (e.g. in the .vul output)
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.arr = np.zeros((nr+1, nz))
+        self.update(*args, **kwargs)
+        
+    def __setitem__(self, i, value):
+        self.arr[i] = value
+        super().__setitem__(i, self.arr[i])
+    
+    def set_rows(self, indx, values):
+        """
+        k[indx[n]] = values[n] for all n in one assignment
+        """
+        self.arr[indx] = values
+        for i in indx: super().__setitem__(i, self.arr[i])
+    
+    def update(self, *args, **kwargs):
+        for i, value in dict(*args, **kwargs).items(): self[i] = value
+        
+    def setdefault(self, i, value=0.):
+        if i not in self: self[i] = value
+        return self[i]
+    
+    def copy(self):
+        return RateCoef(self)
+        
+    def __reduce__(self):
+        return (dict, (dict(self),))
+
+class StepHistory(object):
+    """
+    fixed-capacity ring buffer of the number densities and times of the last cap accepted steps (for the convergence check)
+    the step n (counted from 0, i.e. n = para.count-1 for the latest one) is stored in the slot n % cap 
+    and stays available as long as n >= count - cap
+    """
+    def __init__(self, cap=None):
+        if cap == None: cap = max(vulcan_cfg.conv_step, 2) # conv() never looks further back than conv_step steps
+        self.cap = cap
+        self.y = np.zeros((cap, nz, ni))
+        self.t = np.zeros(cap)
+        self.count = 0
+    
+    def append(self, y, t):
+        self.y[self.count % self.cap] = y
+        self.t[self.count % self.cap] = t
+        self.count += 1
+    
+    def __len__(self):
+        return self.count
+    
+    def first(self):
+        """
+        the oldest step still stored
+        """
+        return max(0, self.count - self.cap)
+    
+    def y_at(self, n):
+        if n < self.first() or n >= self.count: raise IndexError('step ' + str(n) + ' is not in the history')
+        return self.y[n % self.cap]
+    
+    def t_at(self, n):
+        if n < self.first() or n >= self.count: raise IndexError('step ' + str(n) + ' is not in the history')
+        return self.t[n % self.cap]
+    
+    def nearest(self, t):
+        """
+        the stored step with the time closest to t (the earlier one for a tie), by bisection since the times increase
+        """
+        lo, hi = self.first(), self.count
+        while lo < hi:
+            mid = (lo + hi)//2
+            if self.t[mid % self.cap] < t: lo = mid + 1
+            else: hi = mid
+        if lo == self.count: return self.count - 1
+        if lo > self.first() and t - self.t_at(lo-1) <= self.t_at(lo) - t: return lo - 1
+        return lo
+
 #from numba import jitclass
 #from numba import f8 # f8: float64 = double
 
@@ -23,7 +107,7 @@ class Variables(object):
     store the essential variables for calculation  
     """
     def __init__(self): # self means the created object instance
-        self.k = {}  # rate coefficients: k[1] is the rate constant of R1 reaction at every level (same shape as Tco and pco)
+        self.k = RateCoef()  # rate coefficients: k[1] is the rate constant of R1 reaction at every level (same shape as Tco and pco); contiguous in k.arr (nr+1,nz)
         self.y = np.zeros((nz, ni)) # current number density in the shape of (number of vertical levels, number of species)
         self.y_prev = np.zeros((nz, ni)) # number density at the previous step
         self.ymix = np.zeros((nz, ni)) # current mixing ratios
@@ -43,8 +127,9 @@ class Variables(object):
         self.dydt_time = []
         self.atim_loss_time = []
         self.ymix_time = [] # storing the mixing ratio at each step 
-        self.y_time = [] # storing the number density at each step 
-        self.t_time = [] # storing the time  at each step 
+        self.hist = StepHistory() # the number density and time of the last conv_step steps (for the convergence check)
+        self.y_time = [] # storing the number density every save_evo_frq step (when save_evolution or use_plot_evo is on)
+        self.t_time = [] # storing the time every save_evo_frq step
         self.dt_time = [] # storing the time step  at each step 
         self.atom_loss_time = [] # storing the loss of atoms at each step
         
@@ -58,6 +143,9 @@ class Variables(object):
         self.Rindx = {}
         self.a, self.n, self.E, self.a_inf, self.n_inf, self.E_inf,= [{} for i in range(6)]
         self.k_fun, self.k_inf = [{} for i in range(2)] 
+        # the Arrhenius/Lindemann coefficients in arrays (set in read_rate and used by ReadRate.arr_rate)
+        self.rate_indx, self.rate_lind = np.array([],dtype=int), np.array([],dtype=bool)
+        self.rate_a, self.rate_n, self.rate_E, self.rate_a_inf, self.rate_n_inf, self.rate_E_inf = [np.array([]) for i in range(6)]
         self.photo_sp = set()  
         self.pho_rate_index, self.n_branch, self.wavelen = {}, {}, {}
         #if vulcan_cfg.use_ion == True:
@@ -94,6 +182,8 @@ class Variables(object):
         self.threshold = {}
         # list of avaliable temperatures of cross sections 
         self.cross_T_sp_list = {}
+        # incremented whenever the binned cross sections are set (the key of the stacked cross sections in op.py)
+        self.cross_version = 0
         
         # TEST 
         self.v_ratio = np.ones(nz)
@@ -194,6 +284,8 @@ class Parameters(object):
         self.end_case = 0
         self.solver_str = '' # for assigning the name of solver
         self.switch_final_photo_frq = False
+        self.photo_update_count = 0 # number of updates of tau, flux and J
+        self.photo_update_skip = 0 # number of updates at final_update_photo_frq skipped by use_adapt_photo_frq
         self.where_varies_most = np.zeros((nz, ni)) # recording from where and what species flucating from convergence
         self.pic_count = 0 # for live plotting
         
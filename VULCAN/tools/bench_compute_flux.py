@@ -0,0 +1,115 @@
+# Benchmark of ODESolver.compute_flux (two-stream radiative transfer) against the previous implementation
+# (temporary arrays in every call and per-species sums) for one or more stellar spectra
+# usage (from the tools folder): python bench_compute_flux.py [number of calls] [sflux_file ...]
+# default spectra: the Sun (Gueymard_solar.txt) and TRAPPIST-1 (TRAPPIST1_surface.txt, if present in atm/stellar_flux/)
+import sys, os
+vulcan_dir = os.path.abspath('../')
+sys.path.insert(0, vulcan_dir) # including the upper level of directory for the path of modules
+os.chdir(vulcan_dir) # VULCAN reads the input files relative to the main folder
+
+import numpy as np
+import time
+import vulcan_cfg
+import store, build_atm, op
+from op import nz, species, hc
+
+n_call = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+sflux_files = sys.argv[2:] if len(sys.argv) > 2 else ['atm/stellar_flux/Gueymard_solar.txt', 'atm/stellar_flux/TRAPPIST1_surface.txt']
+
+def compute_flux_old(var):
+    # the previous implementation
+    mu_ang = -1.*np.cos(vulcan_cfg.sl_angle)
+    edd = vulcan_cfg.edd
+    tau = var.tau
+    ag0 = op.ag0
+    delta_tau = tau - np.roll(tau,-1,axis=0)
+    delta_tau = delta_tau[:-1]
+    nbins = len(var.bins)
+    tot_abs, tot_scat = np.zeros((nz, nbins)), np.zeros((nz, nbins))
+    for sp in var.photo_sp:
+        tot_abs += np.vstack(var.ymix[:,species.index(sp)])*var.cross[sp]
+    for sp in vulcan_cfg.scat_sp:
+        tot_scat += np.vstack(var.ymix[:,species.index(sp)])*var.cross_scat[sp]
+    with np.errstate(divide='ignore',invalid='ignore'):
+        w0 = tot_scat  / (tot_abs + tot_scat)
+    w0 = np.nan_to_num(w0)
+    w0 = np.minimum(w0,1.-1.E-8)
+    var.sflux = var.sflux_top *  np.exp(-1.*tau/np.cos(vulcan_cfg.sl_angle) )
+    dir_flux = var.sflux * np.cos(vulcan_cfg.sl_angle)
+    if ag0 == 0:
+        tran = np.exp( -1./edd *(1.- w0)**0.5 * delta_tau )
+        zeta_p = 0.5*( 1. + (1.-w0)**0.5 )
+        zeta_m = 0.5*( 1. - (1.-w0)**0.5 )
+        ll = -1.*w0/( 1./mu_ang**2 -1./edd**2 *(1.-w0) )
+        g_p = 0.5*( ll*(1./edd+1./mu_ang) )
+        g_m = 0.5*( ll*(1./edd-1./mu_ang) )
+    else:
+        tran = np.exp( -1./edd *( (1.- w0*ag0)*(1.- w0) )**0.5 * delta_tau )
+        zeta_p = 0.5*( 1. + ((1.-w0)/(1-w0*ag0))**0.5 )
+        zeta_m = 0.5*( 1. - ((1.-w0)/(1-w0*ag0))**0.5 )
+        ll = ( (1.-w0)*(1-w0*ag0) - 1.)/( 1./mu_ang**2 -1./edd**2 *(1.-w0)*(1-w0*ag0) )
+        g_p = 0.5*( ll*(1./edd+1/(mu_ang*(1.-w0*ag0))) + w0*ag0*mu_ang/(1.-w0*ag0)  )
+        g_m = 0.5*( ll*(1./edd-1/(mu_ang*(1.-w0*ag0))) - w0*ag0*mu_ang/(1.-w0*ag0)  )
+    chi = zeta_m**2*tran**2 - zeta_p**2
+    xi = zeta_p*zeta_m*(1.-tran**2)
+    phi = (zeta_m**2-zeta_p**2)*tran
+    i_u = phi*g_p*dir_flux[:-1] - (xi*g_m+chi*g_p)*dir_flux[1:]
+    i_d = phi*g_m*dir_flux[1:] - (chi*g_m+xi*g_p)*dir_flux[:-1]
+    for j in range(nz-1,-1,-1):
+        var.dflux_d[j] = 1./chi[j]*(phi[j]*var.dflux_d[j+1] - xi[j]*var.dflux_u[j] + i_d[j]/mu_ang )
+    for j in range(1,nz+1):
+        var.dflux_u[j] = 1./chi[j-1]*(phi[j-1]*var.dflux_u[j-1] - xi[j-1]*var.dflux_d[j] + i_u[j-1]/mu_ang )
+    ave_dir_flux = 0.5*( var.sflux[:-1] + var.sflux[1:])
+    tot_flux = ave_dir_flux + 0.5*(var.dflux_u[:-1] + var.dflux_u[1:] + var.dflux_d[1:] + var.dflux_d[:-1])/edd
+    var.aflux = tot_flux / (hc/var.bins)
+
+def setup(sflux_file):
+    # the same steps as vulcan.py up to the first compute_tau
+    vulcan_cfg.sflux_file = sflux_file
+    var, atm = store.Variables(), store.AtmData()
+    make_atm = build_atm.Atm()
+    atm = make_atm.f_pico(atm)
+    atm = make_atm.load_TPK(atm)
+    if vulcan_cfg.use_condense == True: make_atm.sp_sat(atm)
+    rate = op.ReadRate()
+    var = rate.read_rate(var, atm)
+    var = rate.rev_rate(var, atm)
+    var = rate.remove_rate(var)
+    ini_abun = build_atm.InitialAbun()
+    var = ini_abun.ini_y(var, atm)
+    var = ini_abun.ele_sum(var)
+    atm = make_atm.f_mu_dz(var, atm, op.Output())
+    rate.make_bins_read_cross(var, atm)
+    make_atm.read_sflux(var, atm)
+    solver = op.Ros2()
+    solver.compute_tau(var, atm)
+    return var, atm, solver
+
+results = []
+for sflux_file in sflux_files:
+    if not os.path.isfile(sflux_file):
+        print (sflux_file + ' not found: skipped')
+        continue
+    var, atm, solver = setup(sflux_file)
+    dflux_u, dflux_d = var.dflux_u.copy(), var.dflux_d.copy()
+
+    t0 = time.time()
+    for n in range(n_call):
+        var.dflux_u[:], var.dflux_d[:] = dflux_u, dflux_d
+        compute_flux_old(var)
+    t_old = (time.time() - t0)/n_call
+    aflux_old = var.aflux.copy()
+
+    t0 = time.time()
+    for n in range(n_call):
+        var.dflux_u[:], var.dflux_d[:] = dflux_u, dflux_d
+        solver.compute_flux(var, atm)
+    t_new = (time.time() - t0)/n_call
+
+    err = np.amax(np.abs(var.aflux-aflux_old)[aflux_old>vulcan_cfg.flux_atol]/aflux_old[aflux_old>vulcan_cfg.flux_atol])
+    results.append((os.path.basename(sflux_file), var.nbin, t_old, t_new, err))
+
+print ('')
+print ('{:<28s} {:>6s} {:>12s} {:>12s} {:>8s} {:>10s}'.format('spectrum', 'nbins', 'old (s)', 'new (s)', 'speed-up', 'max rel diff'))
+for name, nbin, t_old, t_new, err in results:
+    print ('{:<28s} {:>6d} {:>12.4e} {:>12.4e} {:>8.1f} {:>10.2e}'.format(name, nbin, t_old, t_new, t_old/t_new, err))
@@ -0,0 +1,58 @@
+# Micro-benchmark of Ros2.store_bandM (packing the dense lhs into the diagonal ordered form)
+# against the previous column-by-column implementation
+# usage (from the tools folder): python bench_store_bandM.py [nz] [number of steps]
+import sys, os
+vulcan_dir = os.path.abspath('../')
+sys.path.insert(0, vulcan_dir) # including the upper level of directory for the path of modules
+os.chdir(vulcan_dir) # VULCAN reads the thermo files relative to the main folder
+
+import numpy as np
+import time
+import vulcan_cfg
+import op
+from chem_funs import ni
+
+nz = int(sys.argv[1]) if len(sys.argv) > 1 else vulcan_cfg.nz
+n_step = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+def store_bandM_loop(a, nb, nn):
+    # the previous implementation: Python loop over all nb*nn columns with a new ab every call
+    bw = 2*nb-1
+    ab = np.zeros((2*bw+1,nb*nn))
+    for i in range(0,2*nb):
+        ab[-(2*nb+i):,i] = a[0:2*nb+i,i]
+    for i in range(2*nb, nn*nb-2*nb):
+        ab[:,i] = a[(i-2*nb+1):(i-2*nb+1)+(2*bw+1),i]
+    for ne,i in enumerate(range(nn*nb-2*nb,nn*nb)):
+        ab[:(2*bw+1 -ne),i] = a[-(2*bw+1 -ne):,i]
+    return (ab, bw)
+
+# a random block-tridiagonal matrix with diagonal off-diagonal blocks (the structure of the Ros2 lhs)
+rng = np.random.default_rng(0)
+a = np.zeros((ni*nz, ni*nz))
+for j in range(nz):
+    jj = np.arange(j*ni, (j+1)*ni)
+    a[np.ix_(jj, jj)] = rng.random((ni,ni))
+    if j < nz-1:
+        a[jj, jj+ni] = rng.random(ni)
+        a[jj+ni, jj] = rng.random(ni)
+
+solver = op.Ros2()
+
+t0 = time.time()
+solver.store_bandM(a, ni, nz) # the first call computes the gather indices
+t_setup = time.time() - t0
+
+t0 = time.time()
+for n in range(n_step): ab, bw = solver.store_bandM(a, ni, nz)
+t_new = (time.time() - t0)/n_step
+
+t0 = time.time()
+for n in range(n_step): ab_old, bw_old = store_bandM_loop(a, ni, nz)
+t_old = (time.time() - t0)/n_step
+
+print ('ni = ' + str(ni) + ', nz = ' + str(nz) + ' (matrix size ' + str(ni*nz) + ')')
+print ('identical output: ' + str(bw == bw_old and np.array_equal(ab, ab_old)))
+print ('column loop       : {:.4e} s per step'.format(t_old))
+print ('gather (reused)   : {:.4e} s per step (+ {:.4e} s for the indices in the first call)'.format(t_new, t_setup))
+print ('speed-up          : {:.1f}'.format(t_old/t_new))
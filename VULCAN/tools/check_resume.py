@@ -0,0 +1,47 @@
+# Check of checkpoint/restart (checkpoint.py): a run stopped at step n_stop (its end-of-run checkpoint)
+# and resumed to n_total must give the same state as an uninterrupted run to n_total.
+# n_total defaults to past ini_update_photo_frq, so the resumed run does a photo update (tau, flux, J) as well.
+# usage (from the tools folder): python check_resume.py <run folder with vulcan_cfg.py (e.g. made by run_case.py --data-dir)> [n_stop] [n_total]
+import sys, os, shutil, subprocess, pickle
+import numpy as np
+
+vulcan_dir = os.path.abspath('../')
+run_dir = os.path.abspath(sys.argv[1])
+settings = {}
+exec(open(os.path.join(run_dir, 'vulcan_cfg.py')).read(), settings)
+n_stop = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+n_total = int(sys.argv[3]) if len(sys.argv) > 3 else settings['ini_update_photo_frq'] + 30
+rtol = 1e-10
+
+def run(folder, count_max, resume):
+    # a copy of the run folder's vulcan_cfg.py (and network) with the step limit and the checkpoint switches
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+        if not os.path.isabs(settings['network']): shutil.copy(os.path.join(run_dir, settings['network']), folder)
+    with open(os.path.join(folder, 'vulcan_cfg.py'), 'w') as f:
+        f.write(open(os.path.join(run_dir, 'vulcan_cfg.py')).read())
+        f.write('\n# check_resume.py\ncount_max = ' + str(count_max) + '\ncount_min = 1\nuse_checkpoint = True\ncheckpoint_frq = 10**9\ncheckpoint_min = 1e9\nresume = ' + str(resume) + '\n')
+    with open(os.path.join(folder, 'log.txt'), 'a') as log:
+        subprocess.run([sys.executable, '-u', os.path.join(vulcan_dir, 'vulcan.py')], cwd=folder, stdout=log, stderr=subprocess.STDOUT, check=True)
+    with open(os.path.join(folder, settings['output_dir'], settings['out_name']), 'rb') as f:
+        return pickle.load(f)
+
+work_dir = os.path.join(run_dir, 'check_resume')
+if os.path.exists(work_dir): shutil.rmtree(work_dir)
+ref = run(os.path.join(work_dir, 'ref'), n_total, False)
+run(os.path.join(work_dir, 'resumed'), n_stop, False)
+res = run(os.path.join(work_dir, 'resumed'), n_total, True)
+
+max_err = 0.
+for key in ['y', 't', 'dt']:
+    a, b = np.asarray(ref['variable'][key]), np.asarray(res['variable'][key])
+    max_err = max(max_err, np.amax(np.abs(a - b) / np.maximum(np.abs(a), 1e-30)))
+for sp in ref['variable'].get('J_sp', {}):
+    a, b = ref['variable']['J_sp'][sp], res['variable']['J_sp'][sp]
+    max_err = max(max_err, np.amax(np.abs(a - b) / np.maximum(np.abs(a), 1e-30)))
+
+print ('steps: ' + str(ref['parameter']['count']) + ' (uninterrupted) and ' + str(res['parameter']['count']) + ' (stopped at ' + str(n_stop) + ' and resumed)')
+print ('photo updates: ' + str(ref['parameter']['photo_update_count']) + ' and ' + str(res['parameter']['photo_update_count']))
+ok = max_err < rtol and ref['parameter']['count'] == res['parameter']['count'] and ref['parameter']['photo_update_count'] == res['parameter']['photo_update_count']
+print ('max relative difference of y, t, dt and J: {:.3e}'.format(max_err) + (' (OK)' if ok else ' (FAILED)'))
+if ok: shutil.rmtree(work_dir)
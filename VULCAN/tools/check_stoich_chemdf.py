@@ -0,0 +1,48 @@
+# Numerical-equivalence check of the stoichiometry-matrix engine (op.StoichChemdf, use_stoich_chemdf = True)
+# against the generated chem_funs.chemdf, with random number densities and rate coefficients
+# usage (from the tools folder): python check_stoich_chemdf.py [number of trials]
+import sys, os
+vulcan_dir = os.path.abspath('../')
+sys.path.insert(0, vulcan_dir) # including the upper level of directory for the path of modules
+os.chdir(vulcan_dir) # VULCAN reads the thermo files relative to the main folder
+
+import numpy as np
+import time
+import op
+from op import nz
+from chem_funs import ni, nr, chemdf, re_dict, spec_list
+
+n_trial = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+rtol = 1e-10
+
+rng = np.random.default_rng(0)
+stoich_chemdf = op.StoichChemdf()
+# the number of times each species appears in reaction j (reactants + products)
+gross = np.zeros((nr,ni))
+for j in range(1,nr+1):
+    for sp in re_dict[j][0] + re_dict[j][1]: gross[j-1,spec_list.index(sp)] += 1
+max_err = 0.
+t_gen, t_stoi = 0., 0.
+
+for n in range(n_trial):
+    # log-uniform number densities and rate coefficients spanning the typical ranges
+    y = 10**rng.uniform(-5, 19, (nz,ni))
+    M = np.sum(y, axis=1)
+    k = {j: 10**rng.uniform(-40, 0, nz) for j in range(1,nr+1)}
+    
+    t0 = time.time()
+    dy_gen = chemdf(y, M, k)
+    t_gen += time.time() - t0
+    t0 = time.time()
+    dy_stoi = stoich_chemdf(y, M, k)
+    t_stoi += time.time() - t0
+    
+    # compare relative to the sum of all production and loss terms of each species (dy/dt includes cancellations)
+    scale = np.abs(stoich_chemdf.rate(y, M, k)) @ gross
+    scale[scale == 0] = 1.
+    max_err = max(max_err, np.amax(np.abs(dy_gen - dy_stoi)/scale))
+
+print ('ni = ' + str(ni) + ', nr = ' + str(nr) + ', nz = ' + str(nz))
+print ('max relative difference: {:.3e}'.format(max_err) + (' (OK)' if max_err < rtol else ' (FAILED)'))
+print ('generated chemdf : {:.4e} s per call'.format(t_gen/n_trial))
+print ('stoichiometry    : {:.4e} s per call'.format(t_stoi/n_trial))
@@ -60,28 +60,34 @@ import scipy.optimize as sop
 import time, timeit, sys
 import ast
 
+# the working directory is the run folder: its vulcan_cfg.py and chem_funs.py take precedence over the ones in the VULCAN folder
+vulcan_dir = os.path.dirname(os.path.abspath(__file__))
+if os.getcwd() != vulcan_dir: sys.path.insert(0, os.getcwd())
+
 # no arguments or not setting '-n' (no re-making chem_funs.py) option
 if len(sys.argv) < 2 or sys.argv[1] != '-n': 
-    # running prepipe to construch chem_funs.py
-    print ('Making chem_funs.py ...')
-    python_executable = sys.executable
-    os.system(python_executable + ' make_chem_funs.py')
+    # reusing chem_funs.py generated from the same network, gibbs_text and com_file (chem_funs_cache.py)
+    import chem_funs_cache
+    chem_key = chem_funs_cache.cache_key()
+    if not chem_funs_cache.restore(chem_key):
+        # running prepipe to construch chem_funs.py
+        print ('Making chem_funs.py ...')
+        python_executable = sys.executable
+        if os.system(python_executable + ' "' + os.path.join(vulcan_dir, 'make_chem_funs.py') + '"') == 0: chem_funs_cache.store(chem_key)
 else: pass
 
 # import VULCAN modules
-import store, build_atm, op
+import store, build_atm, op, checkpoint
 try: import chem_funs
 except: 
     raise IOError ('\nThe module "chem_funs" does not exist.\nPlease run prepipe.py first to create the module...')
      
 # import the configuration inputs
-import vulcan_cfg
+import vulcan_cfg, vulcan_config
 from phy_const import kb, Navo
 
-# Setting the current working directory to the script location
-abspath = os.path.abspath(sys.argv[0])
-dname = os.path.dirname(abspath)
-os.chdir(dname)
+# the input files are read relative to the working directory (or from vulcan_cfg.data_dir) and the outputs are written there
+dname = os.getcwd()
 
 from chem_funs import ni, nr  # number of species and reactions in the network
 np.set_printoptions(threshold=np.inf)  # print all for debuging
@@ -98,90 +104,115 @@ compo = np.genfromtxt(vulcan_cfg.com_file,names=True,dtype=type_list)
 compo_row = list(compo['species'])
 ### read in the basic chemistry data
 
-### creat the instances for storing the variables and parameters
-data_var = store.Variables()
-data_atm = store.AtmData()
-data_para = store.Parameters()
+def run(cfg=None):
+    '''
+    running one case, with the configuration object cfg (vulcan_config.Config) or vulcan_cfg.py of the working directory,
+    and saving the output. Returns data_var, data_atm and data_para.
+    cfg is made the active configuration (the vulcan_cfg module read by all VULCAN modules) for the whole run.
+    '''
+    vulcan_config.use(cfg)
+    vulcan_config.running = True # no other configuration can be activated until the run has finished
+    try: return run_active()
+    finally: vulcan_config.running = False
+
+def run_active():
+    '''
+    running one case with the active configuration
+    '''
+    
+    ### creat the instances for storing the variables and parameters
+    data_var = store.Variables()
+    data_atm = store.AtmData()
+    data_para = store.Parameters()
 
-# record starting CPU time
-data_para.start_time = time.time()
+    # record starting CPU time
+    data_para.start_time = time.time()
 
-make_atm = build_atm.Atm()
+    make_atm = build_atm.Atm()
 
-# for plotting and printing
-output = op.Output()
+    # for plotting and printing
+    output = op.Output()
 
-# saving the config file
-output.save_cfg(dname)
+    # saving the config file
+    output.save_cfg(dname)
 
-# construct pico
-data_atm = make_atm.f_pico(data_atm)
-# construct Tco and Kzz 
-data_atm =  make_atm.load_TPK(data_atm)
-# construct Dzz (molecular diffusion)
+    # construct pico
+    data_atm = make_atm.f_pico(data_atm)
+    # construct Tco and Kzz 
+    data_atm =  make_atm.load_TPK(data_atm)
+    # construct Dzz (molecular diffusion)
 
-# calculating the saturation pressure
-if vulcan_cfg.use_condense == True: make_atm.sp_sat(data_atm)
+    # calculating the saturation pressure
+    if vulcan_cfg.use_condense == True: make_atm.sp_sat(data_atm)
 
-# for reading rates
-rate = op.ReadRate()
+    # for reading rates
+    rate = op.ReadRate()
 
-# read-in network and calculating forward rates
-data_var = rate.read_rate(data_var, data_atm)
+    # read-in network and calculating forward rates
+    data_var = rate.read_rate(data_var, data_atm)
 
-# for low-T rates e.g. Jupiter       
-if vulcan_cfg.use_lowT_limit_rates == True: data_var = rate.lim_lowT_rates(data_var, data_atm)
+    # for low-T rates e.g. Jupiter       
+    if vulcan_cfg.use_lowT_limit_rates == True: data_var = rate.lim_lowT_rates(data_var, data_atm)
     
-# reversing rates
-data_var = rate.rev_rate(data_var, data_atm)
-# removing rates
-data_var = rate.remove_rate(data_var)
+    # reversing rates
+    data_var = rate.rev_rate(data_var, data_atm)
+    # removing rates
+    data_var = rate.remove_rate(data_var)
 
-ini_abun = build_atm.InitialAbun()
-# initialing y and ymix (the number density and the mixing ratio of every species)
-data_var = ini_abun.ini_y(data_var, data_atm)
+    ini_abun = build_atm.InitialAbun()
+    # initialing y and ymix (the number density and the mixing ratio of every species)
+    data_var = ini_abun.ini_y(data_var, data_atm)
 
-# storing the initial total number of atmos
-data_var = ini_abun.ele_sum(data_var)
+    # storing the initial total number of atmos
+    data_var = ini_abun.ele_sum(data_var)
 
-# calculating mean molecular weight, dz, and dzi and plotting TP
-data_atm = make_atm.f_mu_dz(data_var, data_atm, output)
+    # calculating mean molecular weight, dz, and dzi and plotting TP
+    data_atm = make_atm.f_mu_dz(data_var, data_atm, output)
 
-# after dz is calculated
-# Only setting up ms (the species molecular weight) if vulcan_cfg.use_moldiff == False
-make_atm.mol_diff(data_atm)
+    # after dz is calculated
+    # Only setting up ms (the species molecular weight) if vulcan_cfg.use_moldiff == False
+    make_atm.mol_diff(data_atm)
 
-# specify the BC
-make_atm.BC_flux(data_atm)
+    # specify the BC
+    make_atm.BC_flux(data_atm)
 
 
-# ============== Execute VULCAN  ==============
-# time-steping in the while loop until conv() returns True or count > count_max 
+    # ============== Execute VULCAN  ==============
+    # time-steping in the while loop until conv() returns True or count > count_max 
 
-# setting the numerical solver to the desinated one in vulcan_cfg
-solver_str = vulcan_cfg.ode_solver
-solver = getattr(op, solver_str)()
+    # setting the numerical solver to the desinated one in vulcan_cfg
+    solver_str = vulcan_cfg.ode_solver
+    solver = getattr(op, solver_str)()
 
-# Setting up for photo chemistry
-if vulcan_cfg.use_photo == True:
-    rate.make_bins_read_cross(data_var, data_atm)
-    #rate.read_cross(data_var)
-    make_atm.read_sflux(data_var, data_atm)
+    # Setting up for photo chemistry
+    if vulcan_cfg.use_photo == True:
+        rate.make_bins_read_cross(data_var, data_atm)
+        #rate.read_cross(data_var)
+        make_atm.read_sflux(data_var, data_atm)
     
-    # computing the optical depth (tau), flux, and the photolisys rates (J) for the first time 
-    solver.compute_tau(data_var, data_atm)
-    solver.compute_flux(data_var, data_atm)
-    solver.compute_J(data_var, data_atm)
-    # they will be updated in op.Integration by the assigned frequence
+        # computing the optical depth (tau), flux, and the photolisys rates (J) for the first time 
+        solver.compute_tau(data_var, data_atm)
+        solver.compute_flux(data_var, data_atm)
+        solver.compute_J(data_var, data_atm)
+        # they will be updated in op.Integration by the assigned frequence
     
-    # removing rates
-    data_var = rate.remove_rate(data_var)
+        # removing rates
+        data_var = rate.remove_rate(data_var)
 
-integ = op.Integration(solver, output)
-# Assgining the specific solver corresponding to different B.C.s
-solver.naming_solver(data_para)
+    integ = op.Integration(solver, output)
+    # Assgining the specific solver corresponding to different B.C.s
+    solver.naming_solver(data_para)
+    
+    # continuing from the last checkpoint (resume = True or --resume)
+    if checkpoint.resuming(): checkpoint.load(checkpoint.default_file(), data_var, data_atm, data_para, integ)
+    elif getattr(vulcan_cfg, 'resume', False) == True or '--resume' in sys.argv: print ('No checkpoint ' + checkpoint.default_file() + ' to resume from: starting from the beginning.')
  
-# Running the integration loop
-integ(data_var, data_atm, data_para, make_atm)
+    # Running the integration loop
+    integ(data_var, data_atm, data_para, make_atm)
+
+    output.save_out(data_var, data_atm, data_para, dname)
+    
+    return data_var, data_atm, data_para
 
-output.save_out(data_var, data_atm, data_para, dname)
+if __name__ == '__main__':
+    run()
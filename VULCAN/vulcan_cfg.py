@@ -8,16 +8,19 @@ use_lowT_limit_rates = False
 
 # ====== Setting up paths and filenames for the input and output files  ======
 # input:
+data_dir = '' # the folder with thermo/, atm/ and fastchem_vulcan/ used by nasa9_table.py and FastChem ('': the working directory)
 network = 'thermo/SNCHO_full_photo_network.txt'
 use_lowT_limit_rates = False
 gibbs_text = 'thermo/gibbs_text.txt' # (all the nasa9 files must be placed in the folder: thermo/NASA9/)
 cross_folder = 'thermo/photo_cross/'
 com_file = 'thermo/all_compose.txt'
+chem_funs_cache = '~/.cache/vulcan/chem_funs' # the shared folder for the generated chem_funs.py keyed by the hash of the network, gibbs_text and com_file (None: always re-make)
 atm_file = 'atm/atm_Earth_Jan_Kzz.txt' # TP and Kzz (optional) file
 sflux_file = 'atm/stellar_flux/Gueymard_solar.txt' # This is the flux density at the stellar surface
 top_BC_flux_file = 'atm/' # the file for the top boundary conditions
 bot_BC_flux_file = 'atm/BC_bot_Earth.txt' # the file for the lower boundary conditions
 vul_ini = 'output/' # the file to initialize the abundances for ini_mix = 'vulcan_ini'
+input_hash = '' # the hash of the inputs saved in the output under 'input_hash' (set by the campaign runners)
 # output:
 output_dir = 'output/'
 plot_dir = 'plot/'
@@ -52,10 +55,13 @@ edd = 0.5 # the Eddington coefficient
 dbin1 = 0.1  # the uniform bin width < dbin_12trans (nm)
 dbin2 = 2.   # the uniform bin width > dbin_12trans (nm)
 dbin_12trans = 240. # the wavelength switching from dbin1 to dbin2 (nm)
+cross_cache = '~/.cache/vulcan/cross' # the shared folder for the binned cross sections keyed by the species, bins, stellar wavelength range and T profile (None: always read the csv files)
 
 # the frequency to update the actinic flux and optical depth
 ini_update_photo_frq = 100
 final_update_photo_frq = 5
+use_adapt_photo_frq = False # in the final stage, skipping the updates while the actinic flux and the absorber columns are not changing
+photo_col_tol = 0.01 # the relative change of the absorber column densities that triggers an update
 
 # ====== Setting up ionchemistry ======
 use_ion = False
@@ -125,9 +131,14 @@ conv_step = 500
 
 # ====== Setting up numerical parameters for the ODE solver ====== 
 ode_solver = 'Ros2' # case sensitive
+use_band_jac = True # assemble the Ros2 lhs directly in the banded form (no dense (ni*nz)^2 Jacobian)
+lhs_solver = 'banded' # 'banded': LAPACK banded LU; 'block_thomas': block-tridiagonal LU over the nz layers
+use_stoich_chemdf = True # compute the chemical dy/dt from the stoichiometry matrix of re_dict (False: the generated chem_funs.chemdf)
 use_print_prog = True
 use_print_delta = False
 print_prog_num = 500  # print the progress every x steps 
+progress_file = '' # json-lines progress records (count, t, dt, longdy, ...): '' for none, '-' for stdout
+progress_frq = 100 # write a progress record every x steps
 dttry = 1.E-10
 trun_min = 1e2
 runtime = 1.E22
@@ -174,3 +185,12 @@ output_humanread = False
 use_shark = False
 save_evolution = False   # save the evolution of chemistry (y_time and t_time) for every save_evo_frq step
 save_evo_frq = 10
+evo_stream = True   # with save_evolution: write y_time and t_time into output_dir + out_name + '.evo' during the run (read with evo_stream.read_evo) instead of keeping them in memory
+evo_chunk = 50   # number of snapshots written at once
+evo_compress = False   # zlib-compress the chunks
+# checkpoint/restart (checkpoint.py):
+use_checkpoint = False   # write the state of the integration into checkpoint_file every checkpoint_frq steps, every checkpoint_min minutes, at the end of an unconverged run and on SIGTERM
+checkpoint_frq = 1000
+checkpoint_min = 30.
+checkpoint_file = ''   # '' for output_dir + out_name + '.ckpt'
+resume = False   # continue from checkpoint_file if it exists (also vulcan.py --resume)
@@ -0,0 +1,70 @@
+# ==============================================================================
+# In-process configuration objects
+# A Config holds the settings of one run (the names of vulcan_cfg.py) as attributes and can be made
+# from a planet yaml file (with the same template as run_case.py), a cfg source string or the vulcan_cfg module.
+# use(cfg) makes it the active configuration: the settings are swapped into the vulcan_cfg module
+# imported by store, build_atm, op and chem_funs, so scenarios can run one after another in one process
+# without writing vulcan_cfg.py or reloading modules. vulcan.run(cfg) activates cfg once for the whole run
+# (the VULCAN classes take no configuration of their own) and no other one can be activated until it has finished.
+# The network, gibbs_text and com_file (i.e. chem_funs) must be the same for all the runs in one process.
+# ==============================================================================
+import os, sys, types
+import vulcan_cfg
+
+class Config(object):
+    """
+    the settings of one run as attributes (source: the text of the equivalent vulcan_cfg.py)
+    """
+    def __init__(self, source='', **settings):
+        self.source = source
+        self.__dict__.update(settings)
+
+    @classmethod
+    def from_source(cls, source):
+        settings = {}
+        exec(compile(source, 'vulcan_cfg', 'exec'), settings)
+        return cls(source, **settings_of(settings))
+
+    @classmethod
+    def from_yaml(cls, config_file, data_dir=None, bc_dir=None):
+        import run_case
+        return cls.from_source(run_case.render_cfg(config_file, data_dir, bc_dir))
+
+    @classmethod
+    def from_module(cls, module=vulcan_cfg):
+        try:
+            with open(module.__file__) as f: source = f.read()
+        except (AttributeError, OSError): source = ''
+        return cls(source, **settings_of(vars(module)))
+
+    def settings(self):
+        return settings_of(self.__dict__, skip=['source'])
+
+def settings_of(names, skip=[]):
+    # the cfg entries: no dunder names, modules or the attributes of Config
+    return dict( (k, v) for k, v in names.items() if not k.startswith('__') and k not in skip and not isinstance(v, types.ModuleType) )
+
+active = None # the Config in the vulcan_cfg module (None: vulcan_cfg.py as imported)
+running = False # a run with the active configuration is in progress (set by vulcan.run)
+
+def use(cfg):
+    '''
+    making cfg the active configuration: replacing the entries of the vulcan_cfg module in place
+    (and the copies of nz in the VULCAN modules). Does nothing if cfg is already active or None.
+    Raises RuntimeError while a run with another configuration is in progress.
+    '''
+    global active
+    if cfg is None or cfg is active: return
+    if running: raise RuntimeError('Cannot activate another configuration while a run is in progress.')
+    for name in ['network', 'gibbs_text', 'com_file']:
+        # the network is copied into the run folder by run_case.py: comparing the file names only
+        if hasattr(vulcan_cfg, name) and os.path.basename(str(getattr(cfg, name, ''))) != os.path.basename(str(getattr(vulcan_cfg, name))):
+            raise ValueError(name + ' of the configuration (' + str(getattr(cfg, name, None)) + ') differs from the one chem_funs was made with (' + str(getattr(vulcan_cfg, name)) + ')')
+
+    network = vulcan_cfg.network # the (renumbered) network chem_funs was made with
+    for k in list(settings_of(vars(vulcan_cfg))): delattr(vulcan_cfg, k)
+    for k, v in cfg.settings().items(): setattr(vulcan_cfg, k, v)
+    vulcan_cfg.network = network
+    for mod in ['store', 'build_atm', 'op', 'cross_cache']:
+        if mod in sys.modules and hasattr(sys.modules[mod], 'nz'): sys.modules[mod].nz = vulcan_cfg.nz
+    active = cfg